@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the detection backends of a model on sample images (a directory,
+or frames grabbed from the camera if ~image_dir is not set).
+
+_mode:=backends (default)
+    Every backend is run on the same images. For each image the detections
+    are checked against the torch detections (same number of boxes, same
+    class, IoU above ~iou_threshold) and the per-image latency of each
+    backend is reported.
+
+_mode:=roi
+    Accuracy versus latency of full-frame inference at ~sizes and of ROI
+    inference at ~roi_sizes on a recorded frame sequence (e.g. the frames of
+    a servoing run, in order). The reference is full-frame inference at 640;
+    the center error of the top detection and the misses are reported.
+
+usage: rosrun kinova_apps benchmark_detection_backends.py \
+           _model:=door_knob _backends:="[onnxruntime, onnxruntime_int8, opencv]" \
+           _image_dir:=/path/to/images
+       rosrun kinova_apps benchmark_detection_backends.py \
+           _mode:=roi _backend:=torch _image_dir:=/path/to/servoing_run
+"""
+
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+import rospy
+
+from utils.detection_backends import create_detector, detections_match
+from utils.frame_hub import get_frame_hub
+from utils.model_registry import MODEL_PARAMS, get_model_path, warmup_detector
+from utils.roi_inference import RoiDetector
+
+
+def top_center(detections):
+    """
+    Center of the highest-score box, None if there are no detections
+    """
+    if len(detections) == 0:
+        return None
+    x1, y1, x2, y2 = detections[detections[:, 4].argmax(), :4]
+    return np.array([(x1 + x2) / 2.0, (y1 + y2) / 2.0])
+
+
+def load_images(image_dir, num_frames):
+    if image_dir:
+        paths = sorted(
+            glob.glob(os.path.join(image_dir, "*.png"))
+            + glob.glob(os.path.join(image_dir, "*.jpg"))
+        )
+        return [cv2.imread(path) for path in paths]
+
+    images = []
+    hub = get_frame_hub()
+    with hub.perception():
+        while not rospy.is_shutdown() and len(images) < num_frames:
+            msg = hub.latest_msg()
+            images.append(hub.get_frame("bgr8", msg).copy())
+            hub.wait_for_frame(newer_than=msg.header.stamp)
+    return images
+
+
+class DetectionBackendBenchmark(object):
+    def __init__(self, model, backends, iterations, iou_threshold):
+        self.model_path = get_model_path(model)
+        self.backends = ["torch"] + [b for b in backends if b != "torch"]
+        self.iterations = iterations
+        self.iou_threshold = iou_threshold
+
+    def run(self, images):
+        rospy.loginfo(
+            "model: %s, %d images" % (self.model_path, len(images))
+        )
+        reference = None
+        success = True
+        for backend in self.backends:
+            detector = create_detector(
+                self.model_path, backend, model_params=MODEL_PARAMS
+            )
+            warmup_detector(detector)
+
+            times = []
+            results = []
+            for image in images:
+                for _ in range(self.iterations):
+                    start = time.perf_counter()
+                    detections = detector.detect(image)
+                    times.append(time.perf_counter() - start)
+                results.append(detections)
+
+            if reference is None:
+                reference = results
+                mismatches = 0
+            else:
+                mismatches = sum(
+                    not detections_match(ref, res, self.iou_threshold)
+                    for ref, res in zip(reference, results)
+                )
+                success = success and mismatches == 0
+
+            times_ms = np.array(times) * 1e3
+            rospy.loginfo(
+                "%-17s mean %.1f ms, median %.1f ms, mismatching images: %d"
+                % (
+                    backend,
+                    np.mean(times_ms),
+                    np.median(times_ms),
+                    mismatches,
+                )
+            )
+        return success
+
+
+class RoiInferenceBenchmark(object):
+    def __init__(self, model, backend, sizes, roi_sizes):
+        self.model_path = get_model_path(model)
+        self.detector = create_detector(
+            self.model_path, backend, model_params=MODEL_PARAMS
+        )
+        warmup_detector(self.detector)
+        self.backend = backend
+        self.sizes = sizes
+        self.roi_sizes = roi_sizes
+
+    def evaluate(self, name, detect_fn, images, reference):
+        """
+        Runs detect_fn over the frame sequence and logs the latency and the
+        center error against the reference centers
+        """
+        times = []
+        errors = []
+        misses = 0
+        for image, ref in zip(images, reference):
+            start = time.perf_counter()
+            center = top_center(detect_fn(image))
+            times.append(time.perf_counter() - start)
+            if ref is None:
+                continue
+            if center is None:
+                misses += 1
+            else:
+                errors.append(np.linalg.norm(center - ref))
+
+        times_ms = np.array(times) * 1e3
+        errors = np.array(errors) if errors else np.array([np.nan])
+        num_targets = sum(ref is not None for ref in reference)
+        rospy.loginfo(
+            "%-15s mean %.1f ms, median %.1f ms, center error mean %.1f px, "
+            "max %.1f px, missed %d / %d"
+            % (
+                name,
+                np.mean(times_ms),
+                np.median(times_ms),
+                np.mean(errors),
+                np.max(errors),
+                misses,
+                num_targets,
+            )
+        )
+
+    def run(self, images):
+        rospy.loginfo(
+            "model: %s, backend: %s, %d images"
+            % (self.model_path, self.backend, len(images))
+        )
+        reference = [
+            top_center(self.detector.detect(image, size=640))
+            for image in images
+        ]
+        for size in self.sizes:
+            self.evaluate(
+                "full frame %d" % size,
+                lambda image, size=size: self.detector.detect(image, size),
+                images,
+                reference,
+            )
+        for roi_size in self.roi_sizes:
+            roi_detector = RoiDetector(self.detector, roi_size=roi_size)
+            self.evaluate(
+                "ROI %d" % roi_size, roi_detector.detect, images, reference
+            )
+            rospy.loginfo("%-15s %s" % ("", roi_detector.stats()))
+
+
+def main():
+    rospy.init_node("benchmark_detection_backends")
+    mode = rospy.get_param("~mode", "backends")
+    model = rospy.get_param("~model", "door_knob")
+    image_dir = rospy.get_param("~image_dir", "")
+    num_frames = rospy.get_param("~num_frames", 20)
+
+    images = load_images(image_dir, num_frames)
+    if mode == "roi":
+        benchmark = RoiInferenceBenchmark(
+            model,
+            rospy.get_param("~backend", "torch"),
+            rospy.get_param("~sizes", [480, 512, 640]),
+            rospy.get_param("~roi_sizes", [256, 320, 416]),
+        )
+        benchmark.run(images)
+        return
+
+    backends = rospy.get_param(
+        "~backends", ["onnxruntime", "onnxruntime_int8", "opencv"]
+    )
+    iterations = rospy.get_param("~iterations", 5)
+    iou_threshold = rospy.get_param("~iou_threshold", 0.9)
+    benchmark = DetectionBackendBenchmark(
+        model, backends, iterations, iou_threshold
+    )
+    benchmark.run(images)
+
+
+if __name__ == "__main__":
+    main()
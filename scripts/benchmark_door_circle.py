@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Compares the door circle detection of get_door_knob_error,
+find_door_circle (contour scoring with a downscaled Hough fallback), with
+the full-frame HoughCircles of detect_door_circle on recorded door images
+(a directory, in servoing order, or frames grabbed from the camera if
+~image_dir is not set).
+
+Both run on the same edge image (door_edges of the door ROI). For every
+variant the agreement with the reference (both found, both missed), the
+center and radius difference and the latency are reported. The reference
+are the labels in ~labels if given (a text file with one "x y r" line per
+image in ROI pixels, "nan nan nan" without a circle), otherwise the
+detect_door_circle result. The variants are
+    hough: detect_door_circle
+    contour: find_door_circle without prior
+    tracked: find_door_circle with the previous frame's circle as prior
+    fallback: find_door_circle forced to the Hough fallback (with prior)
+
+usage: rosrun kinova_apps benchmark_door_circle.py \
+           _image_dir:=/path/to/door_images _iterations:=5 \
+           _labels:=/path/to/labels.txt
+"""
+
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+import rospy
+
+from utils.frame_hub import get_frame_hub
+from utils.perception_utils import (
+    detect_door_circle,
+    door_edges,
+    find_door_circle,
+)
+
+
+def load_images(image_dir, num_frames):
+    if image_dir:
+        paths = sorted(
+            glob.glob(os.path.join(image_dir, "*.png"))
+            + glob.glob(os.path.join(image_dir, "*.jpg"))
+        )
+        return [cv2.imread(path) for path in paths]
+
+    images = []
+    hub = get_frame_hub()
+    with hub.perception():
+        while not rospy.is_shutdown() and len(images) < num_frames:
+            msg = hub.latest_msg()
+            images.append(hub.get_frame("bgr8", msg).copy())
+            hub.wait_for_frame(newer_than=msg.header.stamp)
+    return images
+
+
+def single_circle(circles):
+    """
+    The circle get_door_knob_error servos to, None if none or ambiguous
+    """
+    if circles is None or len(circles) != 1:
+        return None
+    return np.asarray(circles[0], dtype=np.float64)
+
+
+def timed(fn, iterations):
+    """
+    output: result of fn, mean latency in milliseconds
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = fn()
+    return result, (time.perf_counter() - start) / iterations * 1e3
+
+
+class DoorCircleBenchmark(object):
+    def __init__(self, crop, iterations, labels=None):
+        self.crop = crop
+        self.iterations = iterations
+        self.labels = labels
+
+    def edges(self, image):
+        min_x, min_y, max_x, max_y = self.crop
+        return door_edges(image[min_y:max_y, min_x:max_x])
+
+    def run(self, images):
+        variants = {
+            "hough": lambda edges, prior: detect_door_circle(edges),
+            "contour": lambda edges, prior: find_door_circle(edges),
+            "tracked": lambda edges, prior: find_door_circle(
+                edges, prior=prior
+            ),
+            "fallback": lambda edges, prior: find_door_circle(
+                edges, prior=prior, min_score=np.inf
+            ),
+        }
+        edges = [self.edges(image) for image in images]
+        results = {name: [] for name in variants}
+        latencies = {name: [] for name in variants}
+        for name, detect in variants.items():
+            prior = None
+            for edge_image in edges:
+                circles, latency = timed(
+                    lambda: detect(edge_image, prior), self.iterations
+                )
+                circle = single_circle(circles)
+                if circle is not None:
+                    prior = circle
+                results[name].append(circle)
+                latencies[name].append(latency)
+
+        if self.labels is None:
+            reference = results["hough"]
+        else:
+            reference = [
+                None if np.isnan(label).any() else label
+                for label in self.labels
+            ]
+        rospy.loginfo(
+            "%d images, door ROI %s, reference: %s"
+            % (
+                len(images),
+                list(self.crop),
+                "hough" if self.labels is None else "labels",
+            )
+        )
+        for name in variants:
+            both_found = both_missed = 0
+            center_errors, radius_errors = [], []
+            for ref, circle in zip(reference, results[name]):
+                if ref is None or circle is None:
+                    both_missed += ref is None and circle is None
+                    continue
+                both_found += 1
+                center_errors.append(np.hypot(*(circle[:2] - ref[:2])))
+                radius_errors.append(abs(circle[2] - ref[2]))
+            rospy.loginfo(
+                "%-8s found %d/%d, agrees %d/%d, center diff mean %.2f "
+                "max %.2f px, radius diff mean %.2f px, latency mean %.2f "
+                "max %.2f ms"
+                % (
+                    name,
+                    sum(circle is not None for circle in results[name]),
+                    len(images),
+                    both_found + both_missed,
+                    len(images),
+                    np.mean(center_errors) if center_errors else np.nan,
+                    np.max(center_errors) if center_errors else np.nan,
+                    np.mean(radius_errors) if radius_errors else np.nan,
+                    np.mean(latencies[name]),
+                    np.max(latencies[name]),
+                )
+            )
+
+
+def main():
+    rospy.init_node("benchmark_door_circle")
+    image_dir = rospy.get_param("~image_dir", "")
+    num_frames = rospy.get_param("~num_frames", 20)
+    # min_x, min_y, max_x, max_y of get_door_knob_error
+    crop = rospy.get_param("~crop", [280, 400, 1000, 720])
+    iterations = rospy.get_param("~iterations", 5)
+    labels_path = rospy.get_param("~labels", "")
+
+    images = load_images(image_dir, num_frames)
+    if not images:
+        rospy.logerr("no images")
+        return
+    labels = None
+    if labels_path:
+        labels = np.loadtxt(labels_path, ndmin=2)
+        if len(labels) != len(images):
+            rospy.logerr(
+                "%d labels for %d images" % (len(labels), len(images))
+            )
+            return
+    DoorCircleBenchmark(crop, iterations, labels).run(images)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Compares the BaseFeedbackReader against the full genpy deserialization of
+BaseCyclic_Feedback on the live feedback stream.
+
+For every received message both paths are run on the same raw buffer; the
+extracted fields are checked for equality and the CPU time per message of
+each path is reported.
+
+usage: rosrun kinova_apps benchmark_feedback_reader.py _num_messages:=2000
+"""
+
+import time
+
+import numpy as np
+import rospy
+import kortex_driver.msg
+
+from utils.feedback_reader import (
+    BaseFeedbackReader,
+    FEEDBACK_TOPIC,
+    TOOL_POSE_FIELDS,
+    COMMANDED_TOOL_POSE_FIELDS,
+    WRENCH_FIELDS,
+)
+
+
+class FeedbackReaderBenchmark(object):
+    def __init__(self, num_messages):
+        self.num_messages = num_messages
+        self.reader = BaseFeedbackReader(
+            joint_angles=True, gripper_position=True, subscribe=False
+        )
+        self.full_times = []
+        self.reader_times = []
+        self.mismatches = 0
+        self.sub = rospy.Subscriber(FEEDBACK_TOPIC, rospy.AnyMsg, self.feedback_cb)
+
+    def feedback_cb(self, msg):
+        if len(self.full_times) >= self.num_messages:
+            return
+        buf = msg._buff
+
+        start = time.process_time()
+        full = kortex_driver.msg.BaseCyclic_Feedback().deserialize(buf)
+        self.full_times.append(time.process_time() - start)
+
+        start = time.process_time()
+        sample = self.reader.parse(buf)
+        self.reader_times.append(time.process_time() - start)
+
+        if not self.equal(full, sample):
+            self.mismatches += 1
+
+    def equal(self, full, sample):
+        expected = [getattr(full.base, f) for f in TOOL_POSE_FIELDS]
+        expected += [getattr(full.base, f) for f in COMMANDED_TOOL_POSE_FIELDS]
+        expected += [getattr(full.base, f) for f in WRENCH_FIELDS]
+        actual = np.concatenate(
+            [sample.tool_pose, sample.commanded_tool_pose, sample.wrench]
+        )
+        if not np.array_equal(np.float32(expected), actual):
+            return False
+        for name in sample.base.dtype.names:
+            if np.float32(getattr(full.base, name)) != np.float32(sample.base[name]):
+                return False
+        joint_angles = [a.position for a in full.actuators]
+        if not np.array_equal(np.float32(joint_angles), sample.joint_angles):
+            return False
+        grippers = full.interconnect.oneof_tool_feedback.gripper_feedback
+        if grippers and grippers[0].motor:
+            return np.float32(grippers[0].motor[0].position) == np.float32(
+                sample.gripper_position
+            )
+        return sample.gripper_position is None
+
+    def run(self):
+        rate = rospy.Rate(10)
+        while (
+            not rospy.is_shutdown()
+            and len(self.full_times) < self.num_messages
+        ):
+            rate.sleep()
+        self.sub.unregister()
+
+        full_us = np.array(self.full_times) * 1e6
+        reader_us = np.array(self.reader_times) * 1e6
+        rospy.loginfo("messages compared: %d" % len(full_us))
+        rospy.loginfo("mismatching messages: %d" % self.mismatches)
+        rospy.loginfo(
+            "full deserialization: mean %.1f us, median %.1f us per message"
+            % (np.mean(full_us), np.median(full_us))
+        )
+        rospy.loginfo(
+            "feedback reader:      mean %.1f us, median %.1f us per message"
+            % (np.mean(reader_us), np.median(reader_us))
+        )
+        return self.mismatches == 0
+
+
+def main():
+    rospy.init_node("benchmark_feedback_reader")
+    num_messages = rospy.get_param("~num_messages", 2000)
+    benchmark = FeedbackReaderBenchmark(num_messages)
+    benchmark.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Compares the in-process seven-segment reader (utils/seven_segment.py) with
+the Tesseract OCR of ByodAction.multimeter_screen_ocr on saved screen
+images: camera frames at the screen_read_pose, as written by
+ByodAction.save_debug_images.
+
+The screen is cropped and thresholded as in the action, then read by
+    seven_segment: SevenSegmentReader (~seven_segment parameters)
+    tesseract: pytesseract (skipped if it is not installed)
+    combined: seven_segment with the Tesseract fallback of the action
+For each the readings, the number of failed reads, the accuracy against
+~labels (a text file with the expected reading of each image, one per line
+in sorted file order) and the latency are reported.
+
+usage: rosrun kinova_apps benchmark_multimeter_ocr.py \
+           _image_dir:=/path/to/BYOD _labels:=/path/to/labels.txt
+"""
+
+import glob
+import importlib.util
+import os
+import time
+
+import cv2
+import numpy as np
+import rospy
+
+from utils.seven_segment import (
+    create_seven_segment_reader,
+    crop_screen,
+    read_with_tesseract,
+    screen_mask,
+)
+
+
+def timed(fn, iterations):
+    """
+    output: result of fn, mean latency in milliseconds
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = fn()
+    return result, (time.perf_counter() - start) / iterations * 1e3
+
+
+def normalize(text):
+    """
+    Reading as compared with the labels ("" for a failed read)
+    """
+    return "" if text is None else text.strip()
+
+
+class MultimeterOcrBenchmark(object):
+    def __init__(self, roi, angle, flip, reader, iterations, tesseract):
+        self.roi = roi
+        self.angle = angle
+        self.flip = flip
+        self.reader = reader
+        self.iterations = iterations
+        self.tesseract = tesseract
+
+    def seven_segment(self, mask):
+        reading = self.reader.read(mask)
+        return None if reading is None else reading.text
+
+    def run(self, names, images, labels):
+        masks, preprocessing = [], []
+        for image in images:
+            mask, latency = timed(
+                lambda: screen_mask(
+                    crop_screen(image, self.roi, self.angle, self.flip)
+                ),
+                self.iterations,
+            )
+            masks.append(mask)
+            preprocessing.append(latency)
+        rospy.loginfo(
+            "%d images, preprocessing %.2f ms"
+            % (len(images), np.mean(preprocessing))
+        )
+
+        methods = {"seven_segment": self.seven_segment}
+        if self.tesseract:
+            methods["tesseract"] = lambda mask: read_with_tesseract(mask)[0]
+        results = {}
+        for name, read in methods.items():
+            # tesseract is too slow to repeat
+            iterations = self.iterations if name == "seven_segment" else 1
+            results[name] = [
+                timed(lambda: read(mask), iterations) for mask in masks
+            ]
+        if self.tesseract:
+            results["combined"] = [
+                (text, latency)
+                if text is not None
+                else (
+                    results["tesseract"][i][0],
+                    latency + results["tesseract"][i][1],
+                )
+                for i, (text, latency) in enumerate(results["seven_segment"])
+            ]
+
+        for i, name in enumerate(names):
+            rospy.loginfo(
+                "%s: %s%s"
+                % (
+                    name,
+                    ", ".join(
+                        "%s %r" % (method, result[i][0])
+                        for method, result in sorted(results.items())
+                    ),
+                    "" if labels is None else ", expected %r" % labels[i],
+                )
+            )
+        for method, result in sorted(results.items()):
+            texts = [normalize(text) for text, _ in result]
+            latencies = np.array([latency for _, latency in result])
+            accuracy = ""
+            if labels is not None:
+                correct = sum(
+                    text == label for text, label in zip(texts, labels)
+                )
+                accuracy = ", correct %d/%d" % (correct, len(labels))
+            rospy.loginfo(
+                "%-13s failed %d/%d%s, latency mean %.2f max %.2f ms"
+                % (
+                    method,
+                    sum(text == "" for text in texts),
+                    len(texts),
+                    accuracy,
+                    latencies.mean(),
+                    latencies.max(),
+                )
+            )
+
+
+def main():
+    rospy.init_node("benchmark_multimeter_ocr")
+    image_dir = rospy.get_param("~image_dir")
+    labels_path = rospy.get_param("~labels", "")
+    # screen crop of ByodAction.multimeter_screen_ocr
+    roi = rospy.get_param("~roi", [520, 470, 756, 580])
+    angle = rospy.get_param("~angle", 1.0)
+    flip = rospy.get_param("~flip", True)
+    iterations = rospy.get_param("~iterations", 5)
+    tesseract = rospy.get_param("~tesseract", True)
+    reader = create_seven_segment_reader(
+        dict(rospy.get_param("~seven_segment", {}), enabled=True)
+    )
+
+    paths = sorted(
+        glob.glob(os.path.join(image_dir, "*.png"))
+        + glob.glob(os.path.join(image_dir, "*.jpg"))
+    )
+    if not paths:
+        rospy.logerr("no images in %s" % image_dir)
+        return
+    labels = None
+    if labels_path:
+        with open(labels_path) as f:
+            labels = [line.strip() for line in f if line.strip()]
+        if len(labels) != len(paths):
+            rospy.logerr(
+                "%d labels for %d images" % (len(labels), len(paths))
+            )
+            return
+    if tesseract and importlib.util.find_spec("pytesseract") is None:
+        rospy.logwarn("pytesseract is not installed, skipping it")
+        tesseract = False
+
+    MultimeterOcrBenchmark(
+        roi, angle, flip, reader, iterations, tesseract
+    ).run(
+        [os.path.basename(path) for path in paths],
+        [cv2.imread(path) for path in paths],
+        labels,
+    )
+
+
+if __name__ == "__main__":
+    main()
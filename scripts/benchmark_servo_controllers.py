@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Compares the servo controllers (utils/servo_controllers.py) on a simulated
+servo loop.
+
+The simulated camera looks straight down at a point on the board; every
+iteration the controller gets the pixel error of a frame captured ~latency
+seconds ago plus gaussian noise (optionally latency compensated, as in the
+actions), and the commanded tool velocity moves the point by
+pixels_per_meter * velocity * dt. For random initial errors the iterations
+and time to converge, the remaining true error and the oscillations are
+reported per controller.
+
+usage: rosrun kinova_apps benchmark_servo_controllers.py _num_trials:=200
+       _tool_height:=0.3 _rate:=10 _latency:=0.15 _noise:=1.0
+"""
+
+import numpy as np
+import rospy
+
+from utils.camera_model import get_camera_model
+from utils.servo_controllers import create_servo_controller
+from utils.servo_metrics import ServoMetrics
+
+
+class ServoSimulation(object):
+    def __init__(
+        self,
+        controller,
+        camera,
+        tool_height,
+        rate,
+        latency,
+        noise,
+        compensate,
+        max_iterations,
+        rng,
+    ):
+        self.controller = controller
+        self.tool_height = tool_height
+        self.dt = 1.0 / rate
+        self.latency = latency
+        self.noise = noise
+        self.compensate = compensate
+        self.max_iterations = max_iterations
+        self.rng = rng
+        self.ppm = np.array(camera.pixels_per_meter(tool_height))
+
+    def measure(self, history, t):
+        # error on the last frame captured before t - latency
+        capture_time = max(0.0, t - self.latency)
+        index = int(capture_time / self.dt)
+        error = history[min(index, len(history) - 1)]
+        if self.compensate:
+            # ideal compensation, the pose history is exact here
+            error = error - (history[index] - history[-1])
+        return error + self.rng.normal(0.0, self.noise, size=2)
+
+    def run(self, initial_error):
+        error = np.array(initial_error, dtype=float)
+        history = [error.copy()]
+        metrics = ServoMetrics(["x", "y"])
+        for iteration in range(self.max_iterations):
+            t = iteration * self.dt
+            measured = self.measure(history, t)
+            velocity = self.controller.compute(
+                measured.tolist(), self.tool_height
+            )
+            metrics.update(measured.tolist(), velocity, self.latency)
+            if velocity[0] == 0.0 and velocity[1] == 0.0:
+                metrics.finish(converged=True)
+                break
+            error = error - self.ppm * np.array(velocity) * self.dt
+            history.append(error.copy())
+        else:
+            metrics.finish(converged=False)
+        return metrics, error
+
+
+def main():
+    rospy.init_node("benchmark_servo_controllers")
+    num_trials = rospy.get_param("~num_trials", 200)
+    tool_height = rospy.get_param("~tool_height", 0.3)
+    rate = rospy.get_param("~rate", 10.0)
+    latency = rospy.get_param("~latency", 0.15)
+    noise = rospy.get_param("~noise", 1.0)
+    compensate = rospy.get_param("~compensate", True)
+    max_error = rospy.get_param("~max_error", 250.0)
+    max_iterations = rospy.get_param("~max_iterations", 1000)
+    controllers = rospy.get_param(
+        "~controllers",
+        {
+            "bang_bang": {"type": "bang_bang"},
+            "jacobian": dict(
+                rospy.get_param("~servo_controller", {}), type="jacobian"
+            ),
+        },
+    )
+
+    camera = get_camera_model()
+    initial_errors = np.random.default_rng(0).uniform(
+        -max_error, max_error, size=(num_trials, 2)
+    )
+    rospy.loginfo(
+        "%d trials, |error| <= %.0f px, tool height %.3f m (%.0f px/m), "
+        "%.0f Hz, latency %.0f ms%s, noise %.1f px"
+        % (
+            num_trials,
+            max_error,
+            tool_height,
+            camera.pixels_per_meter(tool_height)[0],
+            rate,
+            latency * 1e3,
+            " (compensated)" if compensate else "",
+            noise,
+        )
+    )
+    for name, params in sorted(controllers.items()):
+        simulation = ServoSimulation(
+            create_servo_controller(params),
+            camera,
+            tool_height,
+            rate,
+            latency,
+            noise,
+            compensate,
+            max_iterations,
+            np.random.default_rng(1),
+        )
+        iterations, final_errors, oscillations = [], [], []
+        converged = 0
+        for initial_error in initial_errors:
+            metrics, error = simulation.run(initial_error)
+            converged += metrics.converged
+            iterations.append(metrics.iterations)
+            final_errors.append(np.max(np.abs(error)))
+            oscillations.append(sum(metrics.oscillations.values()))
+        iterations = np.array(iterations)
+        rospy.loginfo(
+            "%-10s converged %d/%d, iterations mean %.1f max %d "
+            "(%.2f / %.2f s), final error mean %.2f max %.2f px, "
+            "oscillations mean %.2f"
+            % (
+                name,
+                converged,
+                num_trials,
+                iterations.mean(),
+                iterations.max(),
+                iterations.mean() / rate,
+                iterations.max() / rate,
+                np.mean(final_errors),
+                np.max(final_errors),
+                np.mean(oscillations),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Exports the bundled YOLOv5 models to ONNX for the onnxruntime and opencv
+detection backends, optionally with an int8 (dynamically quantized) copy for
+the onnxruntime_int8 backend.
+
+The .onnx files are written next to the .pt weights in the package models/
+directory, with the static input size of utils.detection_backends, or with
+dynamic height and width (_dynamic:=true) so the onnxruntime backends can
+run the reduced-size ROI inference.
+
+usage: rosrun kinova_apps export_onnx_models.py _int8:=true
+       rosrun kinova_apps export_onnx_models.py _models:="[door_knob]"
+"""
+
+import os
+
+import rospy
+from yolov5 import export
+
+from utils.detection_backends import ONNX_INPUT_SHAPE, onnx_path
+from utils.model_registry import MODELS, get_model_path
+
+
+def export_model(name, int8=False, dynamic=False, opset=12):
+    model_path = get_model_path(name)
+    rospy.loginfo("[export_onnx] exporting %s" % model_path)
+    export.run(
+        weights=model_path,
+        imgsz=list(ONNX_INPUT_SHAPE),
+        include=("onnx",),
+        opset=opset,
+        simplify=True,
+        dynamic=dynamic,
+        device="cpu",
+    )
+    output = onnx_path(model_path, "onnxruntime")
+    if not os.path.exists(output):
+        rospy.logerr("[export_onnx] export of %s failed" % name)
+        return False
+    rospy.loginfo("[export_onnx] wrote %s" % output)
+
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized = onnx_path(model_path, "onnxruntime_int8")
+        quantize_dynamic(output, quantized, weight_type=QuantType.QUInt8)
+        rospy.loginfo("[export_onnx] wrote %s" % quantized)
+    return True
+
+
+def main():
+    rospy.init_node("export_onnx_models")
+    names = rospy.get_param("~models", sorted(MODELS))
+    int8 = rospy.get_param("~int8", False)
+    dynamic = rospy.get_param("~dynamic", False)
+    opset = rospy.get_param("~opset", 12)
+    for name in names:
+        export_model(name, int8, dynamic, opset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Relays the 1 kHz BaseCyclic_Feedback stream as a decimated, fixed-size
+kinova_apps/CompactFeedback message (stamp, tool pose, wrench, joint angles
+and gripper position).
+
+Only this node deserializes the full feedback; clients started with the
+/use_compact_feedback parameter set subscribe to ~compact_feedback instead.
+
+Parameters:
+    ~decimation (int): publish every n-th feedback message (default 10)
+    ~wrench_filter_alpha (float): smoothing factor of the exponential
+        low-pass filter for filtered_wrench, in (0, 1]; 0 disables the
+        filter (default 0.0)
+"""
+
+import numpy as np
+import rospy
+
+from kinova_apps.msg import CompactFeedback
+from utils.feedback_reader import BaseFeedbackReader
+
+
+class FeedbackRelay(object):
+    def __init__(self):
+        self.decimation = max(1, rospy.get_param("~decimation", 10))
+        self.wrench_filter_alpha = rospy.get_param("~wrench_filter_alpha", 0.0)
+        self.filtered_wrench = None
+        self.count = 0
+        self.msg = CompactFeedback()
+
+        self.pub = rospy.Publisher(
+            "~compact_feedback", CompactFeedback, queue_size=1
+        )
+        self.reader = BaseFeedbackReader(
+            "~base_feedback",
+            callback=self.feedback_cb,
+            joint_angles=True,
+            gripper_position=True,
+        )
+
+    def feedback_cb(self, sample):
+        # the filter runs on every sample, publishing is decimated
+        if self.wrench_filter_alpha > 0.0:
+            if self.filtered_wrench is None:
+                self.filtered_wrench = sample.wrench.astype(np.float64)
+            else:
+                self.filtered_wrench += self.wrench_filter_alpha * (
+                    sample.wrench - self.filtered_wrench
+                )
+
+        self.count += 1
+        if self.count < self.decimation:
+            return
+        self.count = 0
+
+        msg = self.msg
+        msg.header.stamp = sample.stamp
+        msg.tool_pose = sample.tool_pose.tolist()
+        msg.commanded_tool_pose = sample.commanded_tool_pose.tolist()
+        msg.wrench = sample.wrench.tolist()
+        if self.filtered_wrench is not None:
+            msg.filtered_wrench = self.filtered_wrench.tolist()
+        joint_angles = np.zeros(len(msg.joint_angles), dtype=np.float32)
+        n = min(len(sample.joint_angles), len(joint_angles))
+        joint_angles[:n] = sample.joint_angles[:n]
+        msg.joint_angles = joint_angles.tolist()
+        if sample.gripper_position is not None:
+            msg.gripper_position = sample.gripper_position
+        self.pub.publish(msg)
+
+
+def main():
+    rospy.init_node("feedback_relay")
+    FeedbackRelay()
+    rospy.spin()
+
+
+if __name__ == "__main__":
+    main()
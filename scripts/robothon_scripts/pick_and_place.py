@@ -11,6 +11,7 @@ from std_msgs.msg import String
 from kinova_apps.full_arm_movement import FullArmMovement
 from kinova_apps.transform_utils import TransformUtils
 from utils.kinova_pose import get_kinovapose_from_pose_stamped
+from utils.feedback_reader import feedback_subscriber
 import kortex_driver.msg
 import numpy as np
 from kortex_driver.srv import *
@@ -50,11 +51,7 @@ class PickAndPlace(object):
             "~debug_pose", PoseStamped, queue_size=1
         )
 
-        self.base_feedback_sub = rospy.Subscriber(
-            "/my_gen3/base_feedback",
-            kortex_driver.msg.BaseCyclic_Feedback,
-            self.base_feedback_cb,
-        )
+        self.base_feedback_sub = feedback_subscriber(callback=self.base_feedback_cb)
         self.cart_vel_pub = rospy.Publisher(
             "/my_gen3/in/cartesian_velocity",
             kortex_driver.msg.TwistCommand,
@@ -65,8 +62,8 @@ class PickAndPlace(object):
 
         self.setup_arm_for_pick()
 
-    def base_feedback_cb(self, msg):
-        self.current_force_z.append(msg.base.tool_external_wrench_force_z)
+    def base_feedback_cb(self, sample):
+        self.current_force_z.append(sample.wrench[2])
         if len(self.current_force_z) > 25:
             self.current_force_z.pop(0)
 
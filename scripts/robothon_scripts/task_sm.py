@@ -7,7 +7,6 @@ import math
 import std_msgs.msg
 import geometry_msgs.msg
 import tf
-from kortex_driver.msg import BaseCyclic_Feedback
 
 import rospy
 from kinova_apps.full_arm_movement import FullArmMovement
@@ -125,13 +124,13 @@ class TaskSM(object):
         )
         quat = tf.transformations.quaternion_from_euler(math.pi, 0.0, euler[2])
 
-        feedback = rospy.wait_for_message(
-            "/my_gen3/base_feedback", BaseCyclic_Feedback
-        )
+        # the arm's feedback reader already subscribes to base_feedback as
+        # AnyMsg, a typed wait_for_message on that topic would get AnyMsg
+        feedback = self.arm.feedback_reader.wait_for_sample()
         updated_pose = self.init_board_pose
         updated_pose.pose.position.x = self.init_board_pose.pose.position.x
         updated_pose.pose.position.y = self.init_board_pose.pose.position.y
-        updated_pose.pose.position.z = feedback.base.tool_pose_z - 0.05
+        updated_pose.pose.position.z = feedback.tool_pose[2] - 0.05
         updated_pose.pose.orientation = geometry_msgs.msg.Quaternion(*quat)
         kinova_pose = get_kinovapose_from_pose_stamped(updated_pose)
         self.arm.send_cartesian_pose(kinova_pose)
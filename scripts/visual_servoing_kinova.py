@@ -15,9 +15,11 @@ Assumptions:
 1. The desired object is a black color
 2. The desired object is a kind of circular shape
 
+The per-frame errors are combined over the last frames by the error
+estimator of the servo engine (~error_estimator, median of 5 by default).
+
 TODO:
-1. Take 30 images and calculate the median of the error
-2. Pose transformation for moving direction
+1. Pose transformation for moving direction
 
 """
 
@@ -28,16 +30,16 @@ from sensor_msgs.msg import Image
 from cv_bridge import CvBridge, CvBridgeError
 import cv2
 from kinova_apps.full_arm_movement import FullArmMovement
+from utils.feedback_reader import feedback_subscriber
+from utils.debug_visualization import get_debug_publisher
+from utils.perception_utils import contour_stats
+from utils.visual_servoing import VisualServoing
 
 
 class WrenchTest(object):
     def __init__(self):
         self.arm = FullArmMovement()
-        self.sub = rospy.Subscriber(
-            "/my_gen3/base_feedback",
-            kortex_driver.msg.BaseCyclic_Feedback,
-            self.base_feedback_cb,
-        )
+        self.sub = feedback_subscriber(callback=self.base_feedback_cb)
         self.pub = rospy.Publisher(
             "/my_gen3/in/cartesian_velocity",
             kortex_driver.msg.TwistCommand,
@@ -46,9 +48,8 @@ class WrenchTest(object):
         self.img_sub = rospy.Subscriber(
             "/camera/color/image_raw", Image, self.image_cb
         )
-        self.img_pub = rospy.Publisher(
-            "/visual_servoing_debug_img", Image, queue_size=10
-        )
+        # debug overlays, only rendered while someone is subscribed
+        self.img_pub = get_debug_publisher("/visual_servoing_debug_img")
         self.loop_rate = rospy.Rate(3.0)
         self.current_force_z = []
         self.bridge = CvBridge()
@@ -56,13 +57,22 @@ class WrenchTest(object):
         self.error_threshold = 5.0
         self.stop = False
         self.velocity = 0.005
+        # servos the image x error along linear_x, 2 px deadband
+        self.visual_servoing = VisualServoing(
+            self.pub,
+            name="visual_servoing_kinova",
+            rate=3.0,
+            reference_frame=(
+                kortex_driver.msg.CartesianReferenceFrame.CARTESIAN_REFERENCE_FRAME_UNSPECIFIED
+            ),
+        )
         self.image_queue = []
         self.move_up_done = False
         self.move_down_done = False
         self.close_gripper_done = False
 
-    def base_feedback_cb(self, msg):
-        self.current_force_z.append(msg.base.tool_external_wrench_force_z)
+    def base_feedback_cb(self, sample):
+        self.current_force_z.append(sample.wrench[2])
         if len(self.current_force_z) > 25:
             self.current_force_z.pop(0)
 
@@ -123,120 +133,95 @@ class WrenchTest(object):
         self.image_queue.append(image)
 
     def run_visual_servoing(self):
-        while not rospy.is_shutdown():
-            if len(self.image_queue) == 0:
-                self.loop_rate.sleep()
-                continue
+        result = self.visual_servoing.run(
+            self.get_error,
+            axes=["x"],
+            asynchronous=False,
+            deadband=2,
+            ready_fn=lambda: len(self.image_queue) > 0,
+        )
+        return result.converged
+
+    def get_error(self):
+        """
+        output: (error,) between the vertical center line and the centroid
+                of the black circular object in pixels, None if not found
+        """
+        image = self.image_queue[-1]
+
+        circularity_threshold = 0.8
+        contours_area_threshold = 100
+        black_color_threshold = 60
+
+        # find the contours
+        # convert the image to grayscale
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # apply gaussian blur to the image
+        blur = cv2.GaussianBlur(gray, (5, 5), 0)
+        # apply canny edge detection
+        canny = cv2.Canny(blur, 50, 150)
+        # find the contours
+        contours, _ = cv2.findContours(
+            canny, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+        )
 
-            image = self.image_queue[-1]
-
-            circularity_threshold = 0.8
-            contours_area_threshold = 100
-            black_color_threshold = 60
-
-            # find the contours
-            # convert the image to grayscale
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            # apply gaussian blur to the image
-            blur = cv2.GaussianBlur(gray, (5, 5), 0)
-            # apply canny edge detection
-            canny = cv2.Canny(blur, 50, 150)
-            # find the contours
-            contours, _ = cv2.findContours(
-                canny, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
-            )
-
-            # draw a horizontal line in the middle of the image
-            horizontal_line = [
-                (0, image.shape[0] // 2),
-                (image.shape[1], image.shape[0] // 2),
-            ]
-            cv2.line(
-                image, horizontal_line[0], horizontal_line[1], (0, 0, 255), 2
-            )
-
-            # draw a vertical line in the middle of the image
-            vertical_line = [
-                (image.shape[1] // 2, 0),
-                (image.shape[1] // 2, image.shape[0]),
-            ]
-            cv2.line(image, vertical_line[0], vertical_line[1], (0, 0, 255), 2)
-
-            # filter out black contours
-            filtered_contours = []
-            mean_colors = []
-            circularities = []
-            for contour in contours:
-                # Calculate area and perimeter of the contour
-                area = cv2.contourArea(contour)
-                perimeter = cv2.arcLength(contour, True)
-
-                # filter out small contours
-                if area < contours_area_threshold:
-                    continue
-
-                # Calculate circularity of the contour (reference: https://en.wikipedia.org/wiki/Roundness)
-                circularity = (4 * np.pi * area) / (perimeter**2)
-
-                # create a mask of the contour
-                n_mask = np.zeros(image.shape[:2], dtype="uint8")
-                cv2.drawContours(n_mask, [contour], 0, (255, 255, 255), -1)
-
-                # get the mean color of the contour using the mask
-                mean_color = cv2.mean(image, mask=n_mask)
-
-                # filter out non black contours
-                # threshold the circularity value to classify the contour as circular or not
-                if (
-                    mean_color[0] < black_color_threshold
-                    and circularity > circularity_threshold
-                ):
-                    filtered_contours.append(contour)
-                    mean_colors.append(mean_color[0])
-                    circularities.append(circularity)
-
-            # print("Number of filtered contours: {}".format(len(filtered_contours)))
-
-            # NOTE: it should only be one contour
-            # draw the filtered contour one by one on the image
-            for i, contour in enumerate(filtered_contours):
-                cv2.drawContours(image, [contour], -1, (255, 0, 0), 3)
-
-                # calculate the centroid of the contour
-                M = cv2.moments(contour)
-                centroid_x = int(M["m10"] / M["m00"])
-                centroid_y = int(M["m01"] / M["m00"])
-                centroid = (centroid_x, centroid_y)
-                cv2.circle(image, centroid, 5, (0, 0, 255), -1)
-
-                # calculate the perpendicular distance between the vertical line and the centroid in the image (y-axis only)
-                self.error = (image.shape[1] // 2) - centroid_x
-                print("Error: {}".format(self.error))
-
-                # TODO: put a max threshold on error to prevent the arm from moving too much
-                # call the arm motion function
-                if not self.stop:
-                    if abs(self.error) > 2 and abs(self.error) < 300:
-                        if self.error > 0:
-                            self.move(1)
-                            rospy.loginfo("Moving arm to the right")
-                        else:
-                            self.move(-1)
-                            rospy.loginfo("Moving arm to the left")
-                    else:
-                        self.move(0)
-                        continue
-                else:
-                    self.move(0)
-                    return True
-
-                # draw the error line on the image from the centroid to the vertical line
-                error_line = [centroid, (centroid_x + self.error, centroid_y)]
-                cv2.line(image, error_line[0], error_line[1], (0, 255, 0), 2)
-
-                # publish the image
-                self.img_pub.publish(self.bridge.cv2_to_imgmsg(image, "bgr8"))
-                # rospy.loginfo("Published a final image!")
+        overlay = self.img_pub.overlay(image)
+
+        # draw a horizontal line in the middle of the image
+        horizontal_line = [
+            (0, image.shape[0] // 2),
+            (image.shape[1], image.shape[0] // 2),
+        ]
+        overlay.line(horizontal_line[0], horizontal_line[1], (0, 0, 255), 2)
+
+        # draw a vertical line in the middle of the image
+        vertical_line = [
+            (image.shape[1] // 2, 0),
+            (image.shape[1] // 2, image.shape[0]),
+        ]
+        overlay.line(vertical_line[0], vertical_line[1], (0, 0, 255), 2)
+
+        # area, circularity and mean color of all contours in one pass
+        blobs = contour_stats(contours, image.shape, image)
+        # filter out small, non black and non circular contours
+        # (reference: https://en.wikipedia.org/wiki/Roundness)
+        selected = (
+            (blobs["area"] >= contours_area_threshold)
+            & (blobs["mean_color"][:, 0] < black_color_threshold)
+            & (blobs["circularity"] > circularity_threshold)
+        )
+        filtered_contours = [contours[i] for i in np.flatnonzero(selected)]
+
+        # print("Number of filtered contours: {}".format(len(filtered_contours)))
+
+        # NOTE: it should only be one contour
+        # draw the filtered contour one by one on the image
+        for i, contour in enumerate(filtered_contours):
+            overlay.contours([contour], (255, 0, 0), 3)
+
+            # calculate the centroid of the contour
+            M = cv2.moments(contour)
+            centroid_x = int(M["m10"] / M["m00"])
+            centroid_y = int(M["m01"] / M["m00"])
+            centroid = (centroid_x, centroid_y)
+            overlay.circle(centroid, 5, (0, 0, 255), -1)
+
+            # calculate the perpendicular distance between the vertical line and the centroid in the image (y-axis only)
+            self.error = (image.shape[1] // 2) - centroid_x
+            print("Error: {}".format(self.error))
+
+            # draw the error line on the image from the centroid to the vertical line
+            error_line = [centroid, (centroid_x + self.error, centroid_y)]
+            overlay.line(error_line[0], error_line[1], (0, 255, 0), 2)
+
+            # publish the image
+            self.img_pub.publish(overlay)
+            # rospy.loginfo("Published a final image!")
+
+            # larger errors are not trusted, the arm would move too much
+            if abs(self.error) < 300:
+                return (self.error,)
+        return None
 
     def move_down(self):
         rospy.loginfo("Moving down")
@@ -29,6 +29,8 @@ from kinova_apps.abstract_action import AbstractAction
 from kinova_apps.full_arm_movement import FullArmMovement
 from utils.transform_utils import TransformUtils
 from utils.kinova_pose import KinovaPose, get_kinovapose_from_pose_stamped
+from utils.visualizer import get_visualizer
+from utils.hsv_classifier import HsvClassifier
 
 
 class ClearClutterAction(AbstractAction):
@@ -60,6 +62,12 @@ class ClearClutterAction(AbstractAction):
         self.rgb_image = None
         self.pc = None
 
+        # debug images, see ~visualization (off by default, never blocks)
+        self.visualizer = get_visualizer()
+
+        # compiled from clutter/hsv_ranges on the first image
+        self.hsv_classifier = HsvClassifier()
+
     def pre_perceive(self) -> bool:
         success = True
         # open gripper before picking
@@ -153,6 +161,8 @@ class ClearClutterAction(AbstractAction):
         return True
     
     def draw_pose_on_image(self, pose: np.ndarray, eigenvector: np.ndarray) -> None:
+        if not self.visualizer.enabled:
+            return
         img = self.rgb_image
         # convert img to cv2
         img = self.bridge.imgmsg_to_cv2(img, desired_encoding='passthrough')
@@ -168,8 +178,7 @@ class ClearClutterAction(AbstractAction):
         # draw the pose on the image
         img = cv2.circle(img, (int(pose[0]), int(pose[1])), 5, (0, 0, 255), -1)
         # show the image
-        cv2.imshow("pose", img)
-        cv2.waitKey(0)   
+        self.visualizer.show("pose", img)
     
     def get_pose_of_polygon(self, polygon: Polygon) -> np.ndarray:
         '''
@@ -338,43 +347,34 @@ class ClearClutterAction(AbstractAction):
         # get the hsv_ranges from the parameter server
         hsv_ranges = rospy.get_param("clutter/hsv_ranges")
 
-        # create colors list
-        colors = [key for key in hsv_ranges.keys()]
-
-        # Create HSV Image
-        hsv_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2HSV)
+        # the lookup tables are only rebuilt if the ranges changed
+        self.hsv_classifier.update(hsv_ranges)
 
-        # create masks for each color
-        masks = []
-        for color in colors:
-            lower = np.array(hsv_ranges[color]["lower"])
-            upper = np.array(hsv_ranges[color]["upper"])
-            mask = cv2.inRange(hsv_image, lower, upper)
-            masks.append(mask)
+        # create masks for all colors in one pass
+        masks = self.hsv_classifier.masks(cv_image)
 
         # get polygons for each color
         polygons = {}
-        for i, color in enumerate(colors):
-            polygons[color] = self.apply_mask_and_get_polygons(cv_image, masks[i])
+        for color in self.hsv_classifier.classes:
+            polygons[color] = self.apply_mask_and_get_polygons(cv_image, masks[color])
         
         # combine all polygons
         polygons = [p for color in polygons for p in polygons[color]]
         
-        draw_image = cv_image.copy()
-
         # check if two or more polygons are close to each other
         cluttered_polygons = self.check_polygons(polygons)
 
         if len(cluttered_polygons) > 0:
-            # draw cluttered polygons
-            for polygon in cluttered_polygons:
-                # convert to contour
-                polygon = np.array(polygon.exterior.coords, dtype=np.int32)
-                # draw contour
-                cv2.drawContours(draw_image, [polygon], -1, (0, 0, 255), 3)
-
-            cv2.imshow("clutters", draw_image)
-            cv2.waitKey(0)
+            if self.visualizer.enabled:
+                draw_image = cv_image.copy()
+                # draw cluttered polygons
+                for polygon in cluttered_polygons:
+                    # convert to contour
+                    polygon = np.array(polygon.exterior.coords, dtype=np.int32)
+                    # draw contour
+                    cv2.drawContours(draw_image, [polygon], -1, (0, 0, 255), 3)
+
+                self.visualizer.show("clutters", draw_image)
 
             return True, polygons, cluttered_polygons
         
@@ -24,6 +24,7 @@ import actionlib
 from geometry_msgs.msg import PoseStamped
 from utils.kinova_pose import KinovaPose
 from utils.force_measure import ForceMeasurmement
+from utils.feedback_reader import feedback_subscriber
 
 from typing import List
 
@@ -53,6 +54,9 @@ class FullArmMovement:
         # initialize force measurment
         self.fm = ForceMeasurmement()
 
+        # keeps the latest tool pose without deserializing the full feedback
+        self.feedback_reader = feedback_subscriber(robot_name=self.robot_name)
+
         # Init the action topic subscriber
         self.action_topic_sub = rospy.Subscriber(
             "/" + self.robot_name + "/action_topic",
@@ -273,17 +277,13 @@ class FullArmMovement:
             Returns:
                 Current pose of the robot in KinovaPose format.
         """
-        feedback = rospy.wait_for_message(
-            "/" + self.robot_name + "/base_feedback", BaseCyclic_Feedback
-        )
+        feedback = self.feedback_reader.latest
+        if feedback is None:
+            feedback = self.feedback_reader.wait_for_sample()
 
-        current_pose = KinovaPose(0, 0, 0, 0, 0, 0)
-        current_pose.x = feedback.base.commanded_tool_pose_x
-        current_pose.y = feedback.base.commanded_tool_pose_y
-        current_pose.z = feedback.base.commanded_tool_pose_z
-        current_pose.theta_x_deg = feedback.base.commanded_tool_pose_theta_x
-        current_pose.theta_y_deg = feedback.base.commanded_tool_pose_theta_y
-        current_pose.theta_z_deg = feedback.base.commanded_tool_pose_theta_z
+        current_pose = KinovaPose(
+            *[float(v) for v in feedback.commanded_tool_pose]
+        )
 
         return current_pose
 
@@ -9,6 +9,7 @@ import kortex_driver.msg
 import math
 from utils.transform_utils import TransformUtils
 from utils.kinova_pose import get_kinovapose_from_pose_stamped
+from utils.feedback_reader import feedback_subscriber
 import numpy as np
 
 
@@ -31,10 +32,8 @@ P
         reference_frame: str = "board_link",
     ) -> None:
         super(ButtonPressAction, self).__init__(arm, transform_utils)
-        self.base_feedback_sub = rospy.Subscriber(
-            "/my_gen3/base_feedback",
-            kortex_driver.msg.BaseCyclic_Feedback,
-            self.base_feedback_cb,
+        self.base_feedback_sub = feedback_subscriber(
+            callback=self.base_feedback_cb
         )
         self.cart_vel_pub = rospy.Publisher(
             "/my_gen3/in/cartesian_velocity",
@@ -44,8 +43,8 @@ P
         self.current_force_z = []
         self.button_reference_frame = reference_frame
 
-    def base_feedback_cb(self, msg):
-        self.current_force_z.append(msg.base.tool_external_wrench_force_z)
+    def base_feedback_cb(self, sample):
+        self.current_force_z.append(sample.wrench[2])
         if len(self.current_force_z) > 25:
             self.current_force_z.pop(0)
 
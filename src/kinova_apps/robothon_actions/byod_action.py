@@ -4,8 +4,6 @@ import rospy
 import numpy as np
 import math
 import cv2
-import os
-import datetime
 
 from kortex_driver.msg import TwistCommand, CartesianReferenceFrame
 
@@ -19,15 +17,29 @@ from utils.kinova_pose import (
     get_kinovapose_from_list,
 )
 from utils.force_measure import ForceMeasurmement
-from sensor_msgs.msg import Image
+from utils.frame_hub import get_frame_hub
+from utils.perception_cache import per_frame_cache
+from utils.debug_image_writer import get_debug_image_writer
+from utils.debug_visualization import get_debug_publisher
+from utils.screen_consensus import create_screen_consensus
+from utils.seven_segment import (
+    create_seven_segment_reader,
+    crop_screen,
+    read_with_tesseract,
+    screen_mask,
+)
 from std_msgs.msg import String
 from cv_bridge import CvBridge, CvBridgeError
-import pytesseract
 
 
 class ByodAction(AbstractAction):
     # TODO: fix the [ERROR] [1682429626.398549]: Received ACTION_ABORT notification problem
 
+    # multimeter screen in the camera image at the screen_read_pose
+    # (min_x, min_y, max_x, max_y), and the rotation straightening the digits
+    SCREEN_ROI = (520, 470, 756, 580)
+    SCREEN_ANGLE = 1  # degrees, anti-clockwise
+
     def __init__(self, arm: FullArmMovement, transform_utils: TransformUtils):
         super().__init__(arm, transform_utils)
         self.arm = arm
@@ -44,22 +56,37 @@ class ByodAction(AbstractAction):
         self.cartesian_velocity_pub = rospy.Publisher(
             "/my_gen3/in/cartesian_velocity", TwistCommand, queue_size=1
         )
-        self.img_sub = rospy.Subscriber(
-            "/camera/color/image_raw", Image, self.image_cb
-        )
-        # same topic as other debug images
-        self.img_pub = rospy.Publisher(
-            "/visual_servoing_debug_img", Image, queue_size=10
-        )
+        self.frame_hub = get_frame_hub()
+        # same topic as other debug images, only published while subscribed
+        self.img_pub = get_debug_publisher("/visual_servoing_debug_img")
         self.multimeter_value_pub = rospy.Publisher(
             "/multimeter_value", String, queue_size=10
         )
         self.save_debug_image_dir = "/home/b-it-bots/temp/robothon/BYOD"
+        # in-process screen reader, tesseract is only the fallback; see
+        # ~seven_segment
+        seven_segment_params = rospy.get_param("~seven_segment", {})
+        self.seven_segment_reader = create_seven_segment_reader(
+            seven_segment_params
+        )
+        # vote over several frames read in worker processes; see
+        # ~screen_consensus
+        self.screen_consensus = create_screen_consensus(
+            rospy.get_param("~screen_consensus", {}),
+            roi=self.SCREEN_ROI,
+            angle=self.SCREEN_ANGLE,
+            flip=True,
+            reader_params=seven_segment_params,
+        )
         print("BYOD Action Initialized")
 
     def pre_perceive(self) -> bool:
         print("in pre perceive")
 
+        # spawn the screen reading workers while the arm moves
+        if self.screen_consensus is not None:
+            self.screen_consensus.start()
+
         success = self.arm.execute_gripper_command(0.35)
         if not success:
             return False
@@ -108,13 +135,12 @@ class ByodAction(AbstractAction):
         print("in verify")
         return True
 
-    def image_cb(self, msg):
-        # get the image from the message
-        try:
-            image = self.bridge.imgmsg_to_cv2(msg, "bgr8")
-        except CvBridgeError as e:
-            print(e)
-        self.image = image
+    @property
+    def image(self):
+        """
+        Latest camera frame from the shared frame hub, decoded on demand
+        """
+        return self.frame_hub.get_frame("bgr8")
 
     def get_poses_and_follow_trajactory(self):
         success = True
@@ -448,7 +474,12 @@ class ByodAction(AbstractAction):
         rospy.loginfo(">> Reading multimeter screen <<")
 
         # read the screen and publish the value
-        readings = self.multimeter_screen_ocr(save_debug_images=True)
+        # the camera is only subscribed to while the screen is being read
+        with self.frame_hub.perception():
+            if self.screen_consensus is not None:
+                readings = self.read_screen_consensus()
+            else:
+                readings = self.multimeter_screen_ocr(save_debug_images=True)
 
         # publish the value
         if readings:
@@ -460,115 +491,68 @@ class ByodAction(AbstractAction):
 
         return True
 
+    def read_screen_consensus(self):
+        """
+        Reads the screen on consecutive frames and returns the reading most
+        of them agree on ("" if none could be read)
+        """
+        self.save_debug_images()
+        reading = self.screen_consensus.read()
+        if reading is None:
+            rospy.logwarn("[byod] no frame of the screen could be read")
+            return ""
+        self.img_pub.publish_image(reading.mask, "mono8")
+        log = rospy.loginfo if reading.quorum else rospy.logwarn
+        log(
+            "[byod] screen reading %s: %d of %d frames agree%s (confidence "
+            "%.2f)"
+            % (
+                reading.text,
+                reading.votes,
+                reading.num_read,
+                "" if reading.quorum else ", no quorum",
+                reading.confidence,
+            )
+        )
+        return reading.text
+
+    @per_frame_cache
     def multimeter_screen_ocr(self, save_debug_images=False):
         if self.save_debug_images:
             self.save_debug_images()
 
-        image_original = self.image.copy()
-
-        # flip the image vertically
-        img = cv2.flip(image_original, 0)
-        # flip the image horizontally
-        flipped_image = cv2.flip(img, 1)
-
-        # ROI crop parameters
-        min_x = 520
-        max_x = 756
-        min_y = 470
-        max_y = 580
-
-        # # crop to ROI
-        image = self.image[min_y:max_y, min_x:max_x]
-
-        # flip the image vertically
-        image = cv2.flip(image, 0)
-        # flip the image horizontally
-        image = cv2.flip(image, 1)
-
-        # rotate the image little but anti-clockwise to make the numbers straight
-        image = self.rotate_image(image, 1)  # angle in degrees
-        image_original = image.copy()
-
-        # Convert image to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-        # blur the image
-        blur = cv2.GaussianBlur(gray, (5, 5), 0)
-
-        # Apply threshold to get image with only black and white
-        thresh = cv2.threshold(
-            blur, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU
-        )[1]
-
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-        opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=1)
-        invert = 255 - opening
-
-        # add padding to the image
-        invert = cv2.copyMakeBorder(
-            invert, 300, 300, 300, 300, cv2.BORDER_CONSTANT, value=255
+        # crop to ROI, flip the image vertically and horizontally and rotate
+        # it a little anti-clockwise to make the numbers straight; only the
+        # crop is copied
+        image = crop_screen(
+            self.image, self.SCREEN_ROI, self.SCREEN_ANGLE, flip=True
         )
 
-        # resize to 640x480
-        invert = cv2.resize(invert, (640, 480))
-
-        # erode the image and dilate the image
-        kernel = np.ones((3, 3), np.uint8)
-        invert = cv2.erode(invert, kernel, iterations=1)
-        invert = cv2.dilate(invert, kernel, iterations=1)
-
-        # config = ("-l eng --oem 3 --psm 6 -c tessedit_char_whitelist=0123456789")
-        config = "-l ssd -c tessedit_char_whitelist=0123456789"
-        result = pytesseract.image_to_string(invert, config=config)
-
-        # only keep the numbers
-        result = "".join([c for c in result if c.isdigit() or c == "."])
-
-        # print the result on the image
-        cv2.putText(
-            flipped_image,
-            str(result),
-            (10, 30),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.8,
-            (0, 0, 255),
-            2,
-        )
+        # lit segments in white
+        opening = screen_mask(image)
+
+        if self.seven_segment_reader is not None:
+            reading = self.seven_segment_reader.read(opening)
+            if reading is not None:
+                rospy.loginfo(
+                    "[byod] seven-segment reading %s (unit %s, confidence "
+                    "%.2f)" % (reading.text, reading.unit, reading.confidence)
+                )
+                self.img_pub.publish_image(opening, "mono8")
+                return reading.text
+            rospy.logwarn(
+                "[byod] seven-segment reader failed, using tesseract"
+            )
+        result, invert = read_with_tesseract(opening)
 
         # publish the image
-        self.img_pub.publish(self.bridge.cv2_to_imgmsg(invert, "mono8"))
-
-        return str(result)
-
-    def rotate_image(self, image, angle):
-        # grab the dimensions of the image and then determine the
-        # center
-        (h, w) = image.shape[:2]
-        (cX, cY) = ((w - 1) / 2.0, (h - 1) / 2.0)
+        self.img_pub.publish_image(invert, "mono8")
 
-        # grab the rotation matrix (applying the negative of the
-        # angle to rotate clockwise), then grab the sine and cosine
-        # (i.e., the rotation components of the matrix)
-
-        # angle = -angle
-        M = cv2.getRotationMatrix2D((cX, cY), angle, 1.0)  # angle in degrees
-
-        # perform the actual rotation and return the image
-        return cv2.warpAffine(image, M, (w, h))
+        return result
 
     def save_debug_images(self):
-        # get the current date and time
-        now = datetime.datetime.now()
-
-        # check if the directory exists
-        if not os.path.exists(self.save_debug_image_dir):
-            os.makedirs(self.save_debug_image_dir)
-
-        if self.image is not None:
-            cv2.imwrite(
-                os.path.join(
-                    self.save_debug_image_dir,
-                    "BYOD_debug_image_{}.png".format(now),
-                ),
-                self.image,
-            )
+        # encoded and written in the background, the directory is created
+        # on the first write
+        get_debug_image_writer(self.save_debug_image_dir).save(
+            self.image, "BYOD_debug_image"
+        )
@@ -7,35 +7,22 @@ from typing import Type, TypeVar
 from kinova_apps.full_arm_movement import FullArmMovement
 from kinova_apps.abstract_action import AbstractAction
 from utils.transform_utils import TransformUtils
+from utils.feedback_reader import feedback_subscriber
+from utils.frame_hub import get_frame_hub
+from utils.visual_servoing import VisualServoing
+from utils.depth_localization import DepthAlignment
+from utils.visualizer import get_visualizer
+from utils.perception_cache import per_frame_cache, perception_cache
+from utils.debug_image_writer import get_debug_image_writer
+from utils.debug_visualization import Overlay, get_debug_publisher
+from utils.perception_utils import contour_stats
+from utils.hsv_classifier import HsvClassifier
+from utils.pipeline import Pipeline, mask_pipeline
+from utils.screw_pattern import ScrewPatternMatcher
 from cv_bridge import CvBridge, CvBridgeError
 import cv2
-from sensor_msgs.msg import Image
 import math
-import scipy.spatial as spatial
-import datetime
-import os
-
-
-def dilate(img, dilation_size=1):
-    dilation_shape = cv2.MORPH_RECT
-    element = cv2.getStructuringElement(
-        dilation_shape,
-        (2 * dilation_size + 1, 2 * dilation_size + 1),
-        (dilation_size, dilation_size),
-    )
-    img = cv2.dilate(img, element)
-    return img
-
-
-def erode(img, erosion_size=1):
-    erosion_shape = cv2.MORPH_RECT
-    element = cv2.getStructuringElement(
-        erosion_shape,
-        (2 * erosion_size + 1, 2 * erosion_size + 1),
-        (erosion_size, erosion_size),
-    )
-    img = cv2.erode(img, element)
-    return img
+import functools
 
 
 class PlugRemoveSlidAction(AbstractAction):
@@ -59,41 +46,84 @@ class PlugRemoveSlidAction(AbstractAction):
     -
     """
 
+    # align_black_port_2 ROI origin and target pixel in the ROI
+    ## These are targets when tool_pose_z = approx 0.148 m
+    BLACK_PORT_ROI_ORIGIN = (280, 100)
+    BLACK_PORT_TARGET = (356, 330)
+
+    # screws (silver circles) around the red port in the align_red_port ROI
+    # at tool_pose_z = approx 0.148 m: a vertical pair (aligned in x) and a
+    # horizontal pair (aligned in y), about 104 px apart
+    SCREW_LAYOUT = ((535, 268), (531, 164), (324, 342), (218, 343))
+    SCREW_LAYOUT_HEIGHT = 0.148
+    VERTICAL_SCREWS = [0, 1]
+    HORIZONTAL_SCREWS = [2, 3]
+
     def __init__(
         self, arm: FullArmMovement, transform_utils: TransformUtils
     ) -> None:
         super(PlugRemoveSlidAction, self).__init__(arm, transform_utils)
         self.current_force_z = []
         self.current_height = None
-        self.base_feedback_sub = rospy.Subscriber(
-            "/my_gen3/base_feedback",
-            kortex_driver.msg.BaseCyclic_Feedback,
-            self.base_feedback_cb,
+        self.base_feedback_sub = feedback_subscriber(
+            callback=self.base_feedback_cb
         )
         self.cart_vel_pub = rospy.Publisher(
             "/my_gen3/in/cartesian_velocity",
             kortex_driver.msg.TwistCommand,
             queue_size=1,
         )
-        self.img_sub = rospy.Subscriber(
-            "/camera/color/image_raw", Image, self.image_cb
+        self.frame_hub = get_frame_hub()
+        self.visual_servoing = VisualServoing(
+            self.cart_vel_pub, name="plug_remove_slid"
         )
-        self.img_pub = rospy.Publisher(
-            "/visual_servoing_debug_img", Image, queue_size=10
+        # single Cartesian move to the depth localized target before
+        # servoing, see ~depth_localization
+        self.depth_alignment = DepthAlignment(self.arm, "plug_remove_slid")
+        # debug overlays, only rendered while someone is subscribed
+        self.img_pub = get_debug_publisher("/visual_servoing_debug_img")
+        # intermediate images, see ~visualization
+        self.visualizer = get_visualizer()
+        self.hsv_classifier = HsvClassifier()
+        self.screw_matcher = ScrewPatternMatcher(
+            self.SCREW_LAYOUT, self.SCREW_LAYOUT_HEIGHT
+        )
+        # preprocessing of the black port ROI, buffers reused across frames
+        self.black_port_pipeline = (
+            Pipeline("black_port")
+            .gray()
+            .clahe(3.0, (15, 15))
+            .blur(5)
+            .threshold(0, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            .canny(50, 150)
+        )
+        self.red_port_pipeline = mask_pipeline(
+            "red_port",
+            lambda image, dst: self.hsv_classifier.mask(image, "red", dst=dst),
+        )
+        # bright screw heads of the red port ROI, blurred for HoughCircles
+        self.screws_pipeline = (
+            Pipeline("screws")
+            .gray()
+            .adaptive_threshold(
+                cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 11, 23
+            )
+            .erode(3)
+            .dilate(3)
+            .box_blur(3)
         )
         self.loop_rate = rospy.Rate(10.0)
-        self.image = None
         self.bridge = CvBridge()
         self.move_up_done = False
         self.move_down_done = False
         self.close_gripper_done = False
         self.save_debug_images_dir = "/home/b-it-bots/temp/robothon"
 
-    def base_feedback_cb(self, msg):
-        self.current_force_z.append(msg.base.tool_external_wrench_force_z)
+    def base_feedback_cb(self, sample):
+        self.current_force_z.append(sample.wrench[2])
         if len(self.current_force_z) > 25:
             self.current_force_z.pop(0)
-        self.current_height = msg.base.tool_pose_z
+        self.current_height = sample.tool_pose[2]
 
     def pre_perceive(self) -> bool:
         print("in pre perceive")
@@ -116,7 +146,13 @@ class PlugRemoveSlidAction(AbstractAction):
         print("in act")
         # Allign camera
         self.run_visual_servoing(
-            self.align_black_port_2, save_debug_images=True, run=True
+            self.align_black_port_2,
+            save_debug_images=True,
+            run=True,
+            target_pixel=(
+                self.BLACK_PORT_ROI_ORIGIN[0] + self.BLACK_PORT_TARGET[0],
+                self.BLACK_PORT_ROI_ORIGIN[1] + self.BLACK_PORT_TARGET[1],
+            ),
         )
         current_pose = self.arm.get_current_pose()
         current_pose.z -= 0.03
@@ -147,69 +183,52 @@ class PlugRemoveSlidAction(AbstractAction):
     def verify(self) -> bool:
         return True
 
-    def image_cb(self, msg):
-        # get the image from the message
-        try:
-            image = self.bridge.imgmsg_to_cv2(msg, "bgr8")
-        except CvBridgeError as e:
-            print(e)
-        self.image = image
+    @property
+    def image(self):
+        """
+        Latest camera frame from the shared frame hub, decoded on demand
+        """
+        return self.frame_hub.get_frame("bgr8")
 
     def run_visual_servoing(
-        self, vs_target_fn, save_debug_images=False, run=True
+        self,
+        vs_target_fn,
+        save_debug_images=False,
+        run=True,
+        target_pixel=None,
     ):
-        stop = False
-        while not rospy.is_shutdown():
-            if self.image is None:
-                rospy.loginfo("waiting for image")
-                self.loop_rate.sleep()
-                continue
-            msg = kortex_driver.msg.TwistCommand()
-            msg.reference_frame = (
-                kortex_driver.msg.CartesianReferenceFrame.CARTESIAN_REFERENCE_FRAME_TOOL
+        """
+        input: target_pixel: pixel (full image) vs_target_fn aligns the
+                             target to, for the depth localization (None:
+                             servo only)
+        """
+        with self.frame_hub.perception():
+            target_fn = functools.partial(vs_target_fn, save_debug_images)
+            # the target functions are called in the loop on the newest frame
+            servo_fn = lambda: self.visual_servoing.run(
+                target_fn,
+                asynchronous=False,
+                ready_fn=lambda: self.image is not None,
+                publish=run,
             )
-            x_error, y_error = vs_target_fn(save_debug_images)
-            if x_error is None:
-                msg.twist.linear_x = 0.0
-            if y_error is None:
-                msg.twist.linear_y = 0.0
-            if x_error is not None:
-                rospy.loginfo("X Error: %.2f" % (x_error))
-                if x_error < 0:
-                    msg.twist.linear_x = -0.005
-                if x_error > 0:
-                    msg.twist.linear_x = 0.005
-                if abs(x_error) < 3:
-                    msg.twist.linear_x = 0.0
-                elif abs(x_error) < 10:
-                    msg.twist.linear_x *= 0.5
-
-            if y_error is not None:
-                rospy.loginfo("Y Error: %.2f" % (y_error))
-                if y_error < 0:
-                    msg.twist.linear_y = -0.005
-                if y_error > 0:
-                    msg.twist.linear_y = 0.005
-                if abs(y_error) < 3:
-                    msg.twist.linear_y = 0.0
-                elif abs(y_error) < 10:
-                    msg.twist.linear_y *= 0.5
             if run:
-                self.cart_vel_pub.publish(msg)
-                if (
-                    msg.twist.linear_x == 0.0
-                    and msg.twist.linear_y == 0
-                    and x_error is not None
-                    and y_error is not None
-                ):
-                    break
-            self.loop_rate.sleep()
-        msg = kortex_driver.msg.TwistCommand()
-        msg.reference_frame = (
-            kortex_driver.msg.CartesianReferenceFrame.CARTESIAN_REFERENCE_FRAME_MIXED
-        )
-        self.cart_vel_pub.publish(msg)
+                self.depth_alignment.align(target_fn, target_pixel, servo_fn)
+            else:
+                servo_fn()
+            rospy.loginfo(
+                "[plug_remove_slid] preprocessing: %s; %s; %s"
+                % (
+                    self.black_port_pipeline.stats(),
+                    self.red_port_pipeline.stats(),
+                    self.screws_pipeline.stats(),
+                )
+            )
+            rospy.loginfo(
+                "[plug_remove_slid] perception cache: "
+                + perception_cache.stats()
+            )
 
+    @per_frame_cache
     def align_black_port(self, save_debug_images=False):
         if save_debug_images:
             self.save_debug_images()
@@ -232,63 +251,29 @@ class PlugRemoveSlidAction(AbstractAction):
 
         # crop to ROI
         image = self.image[min_y:max_y, min_x:max_x]
-        image_copy = image.copy()
+        # recorded only while the debug topic has subscribers
+        overlay = self.img_pub.overlay(image)
 
         # find the contours
         # convert the image to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(15, 15))
-        gray = clahe.apply(gray)
-        # apply gaussian blur to the image
-        blur = cv2.GaussianBlur(gray, (5, 5), 0)
-        # otsu thresholding
-        ret, blur = cv2.threshold(
-            blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
-        )
-        # apply canny edge detection
-        canny = cv2.Canny(blur, 50, 150)
+        # grayscale, CLAHE, blur, otsu thresholding and canny edges
+        canny = self.black_port_pipeline.run(image)
         # find the contours
         contours, _ = cv2.findContours(
             canny, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
         )
 
-        # filter out black contours
-        filtered_contours = []
-        for contour in contours:
-            # Calculate area and perimeter of the contour
-            area = cv2.contourArea(contour)
-            perimeter = cv2.arcLength(contour, True)
-
-            # filter out small contours
-            if (
-                area < contours_area_threshold_low
-                or area > contours_area_threshold_high
-            ):
-                continue
-
-            # Calculate circularity of the contour (reference: https://en.wikipedia.org/wiki/Roundness)
-            circularity = (4 * np.pi * area) / (perimeter**2)
-
-            # filter out non circular contours
-            if circularity < circularity_threshold_low:
-                continue
-
-            # draw the contour on the image
-            # cv2.drawContours(image, [contour], -1, (0, 255, 0), 2)
-
-            # create a mask of the contour
-            n_mask = np.zeros(image.shape[:2], dtype="uint8")
-            cv2.drawContours(n_mask, [contour], 0, (255, 255, 255), -1)
-
-            # get the mean color of the contour using the mask
-            mean_color = cv2.mean(image_copy, mask=n_mask)
-
-            # filter out non red contours
-            if (
-                mean_color[0] < red_color_threshold_high
-                and mean_color[0] > red_color_threshold_low
-            ):
-                filtered_contours.append(contour)
+        # area, circularity and mean color of all contours in one pass
+        blobs = contour_stats(contours, image.shape, image)
+        # filter out small, non circular and non red contours
+        selected = (
+            (blobs["area"] >= contours_area_threshold_low)
+            & (blobs["area"] <= contours_area_threshold_high)
+            & (blobs["circularity"] >= circularity_threshold_low)
+            & (blobs["mean_color"][:, 0] < red_color_threshold_high)
+            & (blobs["mean_color"][:, 0] > red_color_threshold_low)
+        )
+        filtered_contours = [contours[i] for i in np.flatnonzero(selected)]
 
         rospy.loginfo_throttle(
             2, "Number of filtered contours: {}".format(len(filtered_contours))
@@ -302,18 +287,24 @@ class PlugRemoveSlidAction(AbstractAction):
 
         elif len(filtered_contours) == 1:
             # draw the contour on the image
-            cv2.drawContours(image, filtered_contours, -1, (0, 255, 0), 2)
+            overlay.contours(filtered_contours, (0, 255, 0), 2)
 
             # display the image with target points
-            cv2.circle(image, (target_x, target_y), 5, (255, 255, 0), -1)
+            overlay.circle((target_x, target_y), 5, (255, 255, 0), -1)
 
             # draw a horizontal line from the target point
-            cv2.line(
-                image, (0, target_y), (image.shape[1], target_y), (0, 0, 255), 2
+            overlay.line(
+                (0, target_y),
+                (image.shape[1], target_y),
+                (0, 0, 255),
+                2,
             )
             # draw a vertical line from the target point
-            cv2.line(
-                image, (target_x, 0), (target_x, image.shape[0]), (0, 0, 255), 2
+            overlay.line(
+                (target_x, 0),
+                (target_x, image.shape[0]),
+                (0, 0, 255),
+                2,
             )
 
             # calculate the centroid of the contour
@@ -322,7 +313,7 @@ class PlugRemoveSlidAction(AbstractAction):
             centroid_y = int(M["m01"] / M["m00"])
 
             # draw the centroid on the image
-            cv2.circle(image, (centroid_x, centroid_y), 5, (0, 0, 255), -1)
+            overlay.circle((centroid_x, centroid_y), 5, (0, 0, 255), -1)
 
             # calculate the error
             error_x = target_x - centroid_x
@@ -334,25 +325,24 @@ class PlugRemoveSlidAction(AbstractAction):
             # print('Centroid: %d, %d, Error: %d, %d' % (centroid_x, centroid_y, error_x, error_y))
 
             # print the error in the image
-            cv2.putText(
-                image,
+            overlay.text(
                 "Error: {}, {}".format(error_x, error_y),
                 (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.6,
                 (255, 255, 0),
-                2,
             )
 
             # draw a horizontal error line from the centroid to the target point (x-axis only)
             horizontal_line = [(centroid_x, centroid_y), (target_x, centroid_y)]
-            cv2.line(
-                image, horizontal_line[0], horizontal_line[1], (0, 255, 0), 2
+            overlay.line(
+                horizontal_line[0],
+                horizontal_line[1],
+                (0, 255, 0),
+                2,
             )
 
             # draw a vertical error line from the end of the horizontal line to the target point (y-axis only)
             vertical_line = [(target_x, centroid_y), (target_x, target_y)]
-            cv2.line(image, vertical_line[0], vertical_line[1], (0, 255, 0), 2)
+            overlay.line(vertical_line[0], vertical_line[1], (0, 255, 0), 2)
 
             # show the result
             # cv2.imshow("Filtered Contours", image)
@@ -364,9 +354,10 @@ class PlugRemoveSlidAction(AbstractAction):
             error_x = None
             error_y = None
 
-        self.img_pub.publish(self.bridge.cv2_to_imgmsg(image, "bgr8"))
+        self.img_pub.publish(overlay)
         return error_x, error_y
 
+    @per_frame_cache
     def align_black_port_2(self, save_debug_images=False):
         if save_debug_images:
             self.save_debug_images()
@@ -378,15 +369,12 @@ class PlugRemoveSlidAction(AbstractAction):
         red_upper2 = [180, 255, 255]
         contours_area_threshold_low = 3000
         contours_area_threshold_high = 9000
-        visualization_flag = False
+        visualization_flag = self.visualizer.enabled
         # ROI crop parameters
-        min_x = 280
+        min_x, min_y = self.BLACK_PORT_ROI_ORIGIN
         max_x = 1000
-        min_y = 100
         max_y = 710
-        ## These are targets when tool_pose_z = approx 0.148 m
-        target_x = 356
-        target_y = 330
+        target_x, target_y = self.BLACK_PORT_TARGET
 
         # display the image
         # cv2.imshow("Input image", image)
@@ -395,46 +383,37 @@ class PlugRemoveSlidAction(AbstractAction):
 
         # crop to ROI
         image = self.image[min_y:max_y, min_x:max_x]
-        image_original = image.copy()
-        image_original_copy_2 = image.copy()
+        # the frame is read-only; the debug copies are made only when needed
+        image_original_copy_2 = image.copy() if visualization_flag else None
 
         if visualization_flag:
             # show the result
-            cv2.imshow("Input ROI image", image)
-            cv2.waitKey(0)
-            cv2.destroyAllWindows()
-
-        # convert to HSV color space
-        image_hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-
-        # define the lower and upper boundaries of the "red" HSV pixels
-        lower1 = np.array(red_lower1)
-        upper1 = np.array(red_upper1)
-        lower2 = np.array(red_lower2)
-        upper2 = np.array(red_upper2)
+            self.visualizer.show("Input ROI image", image)
+
+        # the "red" HSV pixels lie on both ends of the hue range; the lookup
+        # tables are only compiled on the first call
+        self.hsv_classifier.update(
+            {
+                "red": [
+                    {"lower": red_lower1, "upper": red_upper1},
+                    {"lower": red_lower2, "upper": red_upper2},
+                ]
+            }
+        )
 
-        # create the mask
-        mask1 = cv2.inRange(image_hsv, lower1, upper1)
-        mask2 = cv2.inRange(image_hsv, lower2, upper2)
-        mask = cv2.bitwise_or(mask1, mask2)
+        # create the mask and apply morphological transformations to remove
+        # noise
+        mask = self.red_port_pipeline.run(image, keep=visualization_flag)
 
         if visualization_flag:
             # show the result
-            cv2.imshow("Mask", mask)
-            cv2.waitKey(0)
-            cv2.destroyAllWindows()
-            pass
-
-        # Apply morphological transformations to remove noise
-        kernel = np.ones((5, 5), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+            self.visualizer.show(
+                "Mask", self.red_port_pipeline.outputs["mask"]
+            )
 
         if visualization_flag:
             # show the result
-            cv2.imshow("Morphological Transformed Mask", mask)
-            cv2.waitKey(0)
-            cv2.destroyAllWindows()
+            self.visualizer.show("Morphological Transformed Mask", mask)
 
         # find contours in the mask
         contours, hierarchy = cv2.findContours(
@@ -466,9 +445,7 @@ class PlugRemoveSlidAction(AbstractAction):
                     image_original_copy_2, [contour], -1, (0, 255, 0), 2
                 )
                 # show the result
-                cv2.imshow("Filtered Contour", image_original_copy_2)
-                cv2.waitKey(0)
-                cv2.destroyAllWindows()
+                self.visualizer.show("Filtered Contour", image_original_copy_2)
 
             filtered_contours.append(contour)
 
@@ -478,23 +455,19 @@ class PlugRemoveSlidAction(AbstractAction):
             return None, None
 
         # make a mask of the drawn contours
-        mask = np.zeros(image_original.shape[:2], dtype="uint8")
+        mask = np.zeros(image.shape[:2], dtype="uint8")
         cv2.drawContours(mask, filtered_contours, -1, 255, -1)
 
         if visualization_flag:
             # show the result
-            cv2.imshow("Masked Contours", mask)
-            cv2.waitKey(0)
-            cv2.destroyAllWindows()
+            self.visualizer.show("Masked Contours", mask)
 
         # smooth the edges of the mask
         mask = cv2.GaussianBlur(mask, (5, 5), 0)
 
         if visualization_flag:
             # show the result
-            cv2.imshow("Masked Contours blur", mask)
-            cv2.waitKey(0)
-            cv2.destroyAllWindows()
+            self.visualizer.show("Masked Contours blur", mask)
 
         # find hough circles
         circles = cv2.HoughCircles(
@@ -524,9 +497,7 @@ class PlugRemoveSlidAction(AbstractAction):
                     if visualization_flag:
                         print("Radius: ", r)
                         # show the result
-                        cv2.imshow("Circles", image_original_copy_2)
-                        cv2.waitKey(0)
-                        cv2.destroyAllWindows()
+                        self.visualizer.show("Circles", image_original_copy_2)
             else:
                 rospy.loginfo("[plug removal] red circle not found !")
                 return None, None
@@ -536,36 +507,34 @@ class PlugRemoveSlidAction(AbstractAction):
             circles = np.uint16(np.around(circles))
             circles = sorted(circles[0], key=lambda x: x[2], reverse=True)
             (centroid_x, centroid_y, r) = circles[0]
-            cv2.circle(
-                image_original, (centroid_x, centroid_y), r, (0, 255, 0), 2
-            )
+            if visualization_flag:
+                overlay = Overlay(image)
+            else:
+                overlay = self.img_pub.overlay(image)
+            overlay.circle((centroid_x, centroid_y), r, (0, 255, 0), 2)
 
             if visualization_flag:
                 # show the result
-                cv2.imshow("Final Circles", image_original)
-                cv2.waitKey(0)
-                cv2.destroyAllWindows()
+                self.visualizer.show("Final Circles", overlay)
         else:
             rospy.loginfo("[plug removal] red circle not found !")
             return None, None
 
         # display the center of the circle
-        cv2.circle(image_original, (centroid_x, centroid_y), 5, (0, 0, 255), -1)
+        overlay.circle((centroid_x, centroid_y), 5, (0, 0, 255), -1)
 
         # display the image with target points
-        cv2.circle(image_original, (target_x, target_y), 5, (255, 255, 0), -1)
+        overlay.circle((target_x, target_y), 5, (255, 255, 0), -1)
 
         # draw a horizontal line from the target point
-        cv2.line(
-            image_original,
+        overlay.line(
             (0, target_y),
             (image.shape[1], target_y),
             (0, 0, 255),
             2,
         )
         # draw a vertical line from the target point
-        cv2.line(
-            image_original,
+        overlay.line(
             (target_x, 0),
             (target_x, image.shape[0]),
             (0, 0, 255),
@@ -577,20 +546,13 @@ class PlugRemoveSlidAction(AbstractAction):
         error_y = target_y - centroid_y
 
         # print the error in the image
-        cv2.putText(
-            image_original,
-            "Error: {}, {}".format(error_x, error_y),
-            (10, 30),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.6,
-            (255, 255, 0),
-            2,
+        overlay.text(
+            "Error: {}, {}".format(error_x, error_y), (10, 30), (255, 255, 0)
         )
 
         # draw a horizontal line from the centroid to the target point (x-axis only)
         horizontal_line = [(centroid_x, centroid_y), (target_x, centroid_y)]
-        cv2.line(
-            image_original,
+        overlay.line(
             horizontal_line[0],
             horizontal_line[1],
             (0, 255, 0),
@@ -599,20 +561,17 @@ class PlugRemoveSlidAction(AbstractAction):
 
         # draw a vertical line from the end of the horizontal line to the target point (y-axis only)
         vertical_line = [(target_x, centroid_y), (target_x, target_y)]
-        cv2.line(
-            image_original, vertical_line[0], vertical_line[1], (0, 255, 0), 2
-        )
+        overlay.line(vertical_line[0], vertical_line[1], (0, 255, 0), 2)
 
         if visualization_flag:
             # show the result
-            cv2.imshow("FINAL IMAGE", image_original)
-            cv2.waitKey(0)
-            cv2.destroyAllWindows()
+            self.visualizer.show("FINAL IMAGE", overlay)
 
-        self.img_pub.publish(self.bridge.cv2_to_imgmsg(image_original, "bgr8"))
+        self.img_pub.publish(overlay)
 
         return error_x, error_y
 
+    @per_frame_cache
     def align_red_port(self, save_debug_images=False):
         min_x = 200
         max_x = 1000
@@ -624,58 +583,57 @@ class PlugRemoveSlidAction(AbstractAction):
         target_x = 559
         target_y = 318
         color_img = self.image[min_y:max_y, min_x:max_x]
-        img = cv2.cvtColor(color_img, cv2.COLOR_BGR2GRAY)
-        mask = cv2.GaussianBlur(img, (3, 3), sigmaX=33)
-        mask = cv2.adaptiveThreshold(
-            img, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 11, 23
-        )
-        mask = erode(mask)
-        mask = dilate(mask)
-        allc, vcirc, hcirc = self.detect_silver_circles(mask)
+        allc = self.detect_silver_circles(self.screws_pipeline.run(color_img))
         if allc is None:
             return None, None
+        overlay = self.img_pub.overlay(color_img)
         for idx, cc in enumerate(allc):
             a, b, r = cc[0], cc[1], cc[2]
-            cv2.circle(color_img, (a, b), r, (0, 0, 255), 2)
-        avg_x = 0
-        avg_y = 0
-        if len(vcirc) == 1:
-            avg_x = (allc[vcirc[0][0]][0] + allc[vcirc[0][1]][0]) / 2.0
-            error_x = target_x - avg_x
-        else:
-            error_x = None
-        if len(hcirc) == 1:
-            avg_y = (allc[hcirc[0][0]][1] + allc[hcirc[0][1]][1]) / 2.0
-            error_y = target_y - avg_y
-        else:
-            error_y = None
-        if error_x is not None:
-            rospy.loginfo(
-                "Vcirc Centroid X: %d, %d, Error: %d" % (avg_x, avg_y, error_x)
-            )
-        if error_y is not None:
-            rospy.loginfo(
-                "Hcirc Centroid Y: %d, %d, Error: %d" % (avg_x, avg_y, error_y)
+            overlay.circle((a, b), r, (0, 0, 255), 2)
+        # pose of the screw layout; with three of the four screws found both
+        # errors are still available
+        pose = self.screw_matcher.match(allc[:, :2], self.current_height)
+        if pose is None:
+            rospy.loginfo_throttle(2, "Screw pattern not found")
+            self.img_pub.publish(overlay)
+            return None, None
+        avg_x = pose.points[self.VERTICAL_SCREWS, 0].mean()
+        avg_y = pose.points[self.HORIZONTAL_SCREWS, 1].mean()
+        error_x = target_x - avg_x
+        error_y = target_y - avg_y
+        rospy.loginfo(
+            "Screw pattern: %d/%d screws, scale %.3f, rotation %.1f deg, "
+            "residual %.1f px, error: %d, %d"
+            % (
+                np.sum(pose.matches >= 0),
+                len(pose.matches),
+                pose.scale,
+                np.degrees(pose.rotation),
+                pose.residual,
+                error_x,
+                error_y,
             )
+        )
 
-        for pair in vcirc:
-            cc1 = allc[pair[0]]
-            cc2 = allc[pair[1]]
-            cv2.circle(color_img, (cc1[0], cc1[1]), cc1[2], (255, 0, 0), 2)
-            cv2.circle(color_img, (cc2[0], cc2[1]), cc2[2], (255, 0, 0), 2)
-
-        for pair in hcirc:
-            cc1 = allc[pair[0]]
-            cc2 = allc[pair[1]]
-            cv2.circle(color_img, (cc1[0], cc1[1]), cc1[2], (0, 255, 0), 2)
-            cv2.circle(color_img, (cc2[0], cc2[1]), cc2[2], (0, 255, 0), 2)
-        self.img_pub.publish(self.bridge.cv2_to_imgmsg(color_img, "bgr8"))
+        for screws, color in (
+            (self.VERTICAL_SCREWS, (255, 0, 0)),
+            (self.HORIZONTAL_SCREWS, (0, 255, 0)),
+        ):
+            for idx in screws:
+                match = pose.matches[idx]
+                r = allc[match][2] if match >= 0 else 15
+                overlay.circle(tuple(pose.points[idx]), r, color, 2)
+        self.img_pub.publish(overlay)
         return error_x, error_y
 
     def detect_silver_circles(self, img):
-        imgblur = cv2.blur(img, (3, 3))
+        """
+        input: img: blurred screw mask (see screws_pipeline)
+        output: (N, 3) array of x, y, r of the screw candidates, None if
+                there are none
+        """
         detected_circles = cv2.HoughCircles(
-            imgblur,
+            img,
             cv2.HOUGH_GRADIENT,
             1,
             20,
@@ -685,55 +643,8 @@ class PlugRemoveSlidAction(AbstractAction):
             maxRadius=20,
         )
         if detected_circles is None:
-            return None, None, None
-        detected_circles = detected_circles.astype(np.int64)[0]
-        filtered_circles = []
-        wanted_circle_centers = np.array(
-            [[535, 268], [531, 164], [324, 342], [218, 343]]
-        )
-        circ_centers = detected_circles[:, :2]
-        distances = spatial.distance.cdist(circ_centers, circ_centers)
-        np.fill_diagonal(distances, 1000.0)
-        vertical_circle_idx = []
-        horizontal_circle_idx = []
-        dist_threshold = 10
-        axis_threshold = 5
-        # approximate distance in pixels between silver circles (screws) at 0.148m height
-        target_dist = 104
-        all_circles = detected_circles.copy()
-        selected_circles = []
-        for idx, (cc, dist) in enumerate(zip(detected_circles, distances)):
-            # find circle which is at target_dist from current circle
-            best_match_idx = np.argmin(abs(dist - target_dist))
-            bmc = detected_circles[best_match_idx]
-            smallest = dist[np.argmin(abs(dist - target_dist))]
-            # if its close enough to target_dist and this distance is along the x-coordinate (horizontal circles)
-            if abs(smallest - target_dist) < dist_threshold and (
-                abs(abs(cc[0] - bmc[0]) - target_dist) < axis_threshold
-            ):
-                filtered_circles.append(cc)
-                if idx not in selected_circles:
-                    horizontal_circle_idx.append([idx, best_match_idx])
-                    selected_circles.append(best_match_idx)
-            # if its close enough to target_dist and this distance is along the y-coordinate (horizontal circles)
-            if abs(smallest - target_dist) < dist_threshold and (
-                abs(abs(cc[1] - bmc[1]) - target_dist) < axis_threshold
-            ):
-                filtered_circles.append(cc)
-                if idx not in selected_circles:
-                    vertical_circle_idx.append([idx, best_match_idx])
-                    selected_circles.append(best_match_idx)
-        detected_circles = np.array(filtered_circles)
-        # if we get two pairs of horizontal circles, pick the one that's above
-        if len(horizontal_circle_idx) == 2:
-            if (
-                all_circles[horizontal_circle_idx[0][0]][1]
-                < all_circles[horizontal_circle_idx[1][0]][1]
-            ):
-                horizontal_circle_idx.pop(1)
-            else:
-                horizontal_circle_idx.pop(0)
-        return all_circles, vertical_circle_idx, horizontal_circle_idx
+            return None
+        return detected_circles[0]
 
     def move_down_velocity_control(self):
         linear_vel_z = rospy.get_param("~linear_vel_z", 0.005)
@@ -927,19 +838,8 @@ class PlugRemoveSlidAction(AbstractAction):
     def save_debug_images(self):
         rospy.loginfo_once("Saving debug images")
 
-        # check if the directory exists
-        if not os.path.exists(self.save_debug_images_dir):
-            pass
-            # TODO: create a directory
-        else:
-            # get the current date and time
-            now = datetime.datetime.now()
-            date_time = now.strftime("%m_%d_%Y_%H_%M_%S")
-
-            # save the images
-            cv2.imwrite(
-                os.path.join(
-                    self.save_debug_images_dir, date_time + "_rgb.png"
-                ),
-                self.image,
-            )
+        # encoded and written in the background, the directory is created
+        # on the first write
+        get_debug_image_writer(self.save_debug_images_dir).save(
+            self.image, "rgb"
+        )
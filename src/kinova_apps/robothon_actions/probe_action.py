@@ -5,7 +5,6 @@ from kinova_apps.abstract_action import AbstractAction
 from geometry_msgs.msg import PoseStamped, Quaternion
 import geometry_msgs.msg
 import sensor_msgs.msg
-from sensor_msgs.msg import Image
 from kinova_apps.full_arm_movement import FullArmMovement
 from utils.transform_utils import TransformUtils
 from utils.kinova_pose import (
@@ -14,11 +13,23 @@ from utils.kinova_pose import (
     get_kinovapose_from_pose_stamped,
 )
 from utils.perception_utils import (
-    dilate,
-    erode,
     get_uppermost_contour,
-    detect_door_circle,
+    door_edges_pipeline,
+    find_door_circle,
 )
+from utils.feedback_reader import feedback_subscriber
+from utils.frame_hub import get_frame_hub
+from utils.visualizer import get_visualizer
+from utils.hsv_classifier import HsvClassifier
+from utils.pipeline import Pipeline, mask_pipeline
+from utils.perception_cache import per_frame_cache, perception_cache
+from utils.debug_image_writer import get_debug_image_writer
+from utils.debug_visualization import get_debug_publisher
+from utils.model_registry import get_detector, preload_detector
+from utils.visual_servoing import VisualServoing
+from utils.depth_localization import DepthAlignment
+from utils.roi_inference import create_roi_detector
+from utils.tracking import create_tracking_detector
 
 from kortex_driver.srv import *
 from kortex_driver.msg import *
@@ -31,12 +42,16 @@ import cv2
 import pdb
 from scipy.spatial.distance import cdist
 import math
-import os
-import datetime
-import yolov5
+import functools
 
 
 class ProbeAction(AbstractAction):
+    # pixels (full image) the servo targets are aligned to
+    ## door knob at the door knob approach height
+    DOOR_KNOB_TARGET = (362, 280)
+    ## probe point at a tool height of 0.3 m
+    PROBE_POINT_TARGET = (640, 495)
+
     def __init__(
         self, arm: FullArmMovement, transform_utils: TransformUtils
     ) -> None:
@@ -50,42 +65,101 @@ class ProbeAction(AbstractAction):
             kortex_driver.msg.TwistCommand,
             queue_size=1,
         )
-        self.base_feedback_sub = rospy.Subscriber(
-            "/my_gen3/base_feedback",
-            kortex_driver.msg.BaseCyclic_Feedback,
-            self.base_feedback_cb,
+        self.base_feedback_sub = feedback_subscriber(
+            callback=self.base_feedback_cb
         )
         self.door_knob_pose_pub = rospy.Publisher(
             "/door_knob_pose", PoseStamped, queue_size=1
         )
-        self.probe_cable_dir_debug_pub = rospy.Publisher(
-            "/probe_cable_dir_debug", Image, queue_size=1
+        # debug overlays, only rendered while someone is subscribed
+        self.probe_cable_dir_debug_pub = get_debug_publisher(
+            "/probe_cable_dir_debug"
+        )
+        self.visual_servo_debug_img = get_debug_publisher(
+            "/visual_servoing_debug_img"
+        )
+        self.frame_hub = get_frame_hub()
+        # intermediate images, see ~visualization
+        self.visualizer = get_visualizer()
+        # color classes of the probe cable and probe point, compiled once
+        self.hsv_classifier = HsvClassifier(
+            {
+                "probe_cable": {
+                    "lower": [0, 100, 100],
+                    "upper": [30, 255, 255],
+                },
+                "probe_point": {
+                    "lower": [91, 120, 140],
+                    "upper": [111, 255, 255],
+                },
+            }
         )
-        self.visual_servo_debug_img = rospy.Publisher(
-            "/visual_servoing_debug_img", Image, queue_size=1
+        # masks of the probe cable direction, buffers reused across calls:
+        # the orange cable end, and the dark cable (inverted threshold)
+        self.probe_cable_pipeline = mask_pipeline(
+            "probe_cable",
+            lambda image, dst: self.hsv_classifier.mask(
+                image, "probe_cable", dst=dst
+            ),
         )
-        self.image_sub = rospy.Subscriber(
-            "/camera/color/image_raw", sensor_msgs.msg.Image, self.image_cb
+        self.cable_pipeline = (
+            Pipeline("cable")
+            .gray()
+            .blur(5)
+            .threshold(50, cv2.THRESH_BINARY_INV)
+            .morphology(cv2.MORPH_OPEN, 5)
+            .morphology(cv2.MORPH_CLOSE, 5)
         )
-        self.model = yolov5.load(
-            "/home/b-it-bots/robothon_ros_workspace/src/kinova_apps/models/door_knob/door_knob_nano_ver1.pt"
+        # edges of the door knob circle
+        self.door_edges_pipeline = door_edges_pipeline()
+        # blue mask of the probe point, in the HSV of the crop
+        self.probe_point_pipeline = (
+            Pipeline("probe_point")
+            .hsv()
+            .stage(
+                "mask",
+                lambda src, dst: self.hsv_classifier.mask(
+                    src, "probe_point", hsv=True, dst=dst
+                ),
+            )
+            .dilate(3)
+            .erode(3)
         )
-        self.model_params()
+        # loaded in the background, ready by the time it is first used
+        self.model_name = "door_knob"
+        preload_detector(self.model_name)
+        # door circle (x, y, r) found in the previous frame
+        self.door_circle_prior = None
         self.save_debug_image_dir = "/home/b-it-bots/temp/robothon/door_knob"
 
         self.debug = rospy.get_param("~debug", False)
+        # detections older than ~max_detection_age (seconds) are not used
+        # for servoing
+        self.visual_servoing = VisualServoing(
+            self.cart_vel_pub,
+            name="probe_action",
+            max_detection_age=rospy.get_param("~max_detection_age", 0.5),
+        )
+        # single Cartesian move to the depth localized target before
+        # servoing, see ~depth_localization
+        self.depth_alignment = DepthAlignment(self.arm, "probe_action")
+        # YOLO detector behind the ROI inference and detect-then-track
+        # layers, created on first use
+        self._detector = None
         self.transform_utils = TransformUtils()
 
-    def base_feedback_cb(self, msg):
-        self.current_force_z.append(msg.base.tool_external_wrench_force_z)
+    def base_feedback_cb(self, sample):
+        self.current_force_z.append(sample.wrench[2])
         if len(self.current_force_z) > 25:
             self.current_force_z.pop(0)
-        self.current_height = msg.base.tool_pose_z
+        self.current_height = sample.tool_pose[2]
 
-    def image_cb(self, msg):
-        self.image = self.bridge.imgmsg_to_cv2(
-            msg, desired_encoding="passthrough"
-        )
+    @property
+    def image(self):
+        """
+        Latest camera frame from the shared frame hub, decoded on demand
+        """
+        return self.frame_hub.get_frame("passthrough")
 
     def pre_perceive(self) -> bool:
         rospy.loginfo("in pre perceive")
@@ -450,6 +524,7 @@ class ProbeAction(AbstractAction):
                 self.get_door_knob_error_2,
                 target_height=door_knob_kinova_pose.z,
                 save_debug_images=True,
+                target_pixel=self.DOOR_KNOB_TARGET,
             )
 
             # record the current tool pose
@@ -666,6 +741,7 @@ class ProbeAction(AbstractAction):
                 self.get_probe_point_error,
                 target_height=0.3,
                 save_debug_images=False,
+                target_pixel=self.PROBE_POINT_TARGET,
             )
             probed = self.move_down_and_probe()
             rospy.loginfo("Probed: %d" % probed)
@@ -778,29 +854,18 @@ class ProbeAction(AbstractAction):
             int(image.shape[0] * 0.25) : int(image.shape[0] * 0.75),
             int(image.shape[1] * 0.25) : int(image.shape[1] * 0.75),
         ]
-        or_image = image.copy()
-
-        # Convert the image to HSV color space
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-
-        # Define the lower and upper threshold for the pale orange color
-        lower_orange = np.array([0, 100, 100], dtype=np.uint8)
-        upper_orange = np.array([30, 255, 255], dtype=np.uint8)
-
-        # Threshold the image to obtain a binary mask of the pale orange regions
-        mask = cv2.inRange(hsv, lower_orange, upper_orange)
+        overlay = self.probe_cable_dir_debug_pub.overlay(image)
 
-        # Apply morphological operations to clean up the mask
-        kernel = np.ones((5, 5), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+        # Threshold the image to obtain a binary mask of the pale orange
+        # regions and apply morphological operations to clean it up
+        mask = self.probe_cable_pipeline.run(image)
 
         # Find contours in the mask
         contours, hierarchy = cv2.findContours(
             mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
         )
 
-        img2 = cv2.drawContours(image, contours, -1, (255, 0, 0), 2)
+        overlay.contours(contours, (255, 0, 0), 2)
 
         selected_idx = -1
         # Draw contours around the detected blobs on the original image
@@ -810,8 +875,7 @@ class ProbeAction(AbstractAction):
                 (x, y, w, h) = cv2.boundingRect(contour)
                 radius = int((w + h) / 4)
                 selected_idx = idx
-                cv2.circle(
-                    image,
+                overlay.circle(
                     (int(x + w / 2), int(y + h / 2)),
                     int((w + h) / 4),
                     (0, 255, 0),
@@ -820,6 +884,7 @@ class ProbeAction(AbstractAction):
 
         if selected_idx == -1:
             rospy.loginfo("Cannot find orange blob for grasping probe")
+            self.probe_cable_dir_debug_pub.publish(overlay)
             return 0.0
 
         # find the center of the circle
@@ -828,32 +893,13 @@ class ProbeAction(AbstractAction):
         cY = int(M["m01"] / M["m00"])
 
         # plot the center of the circle
-        cv2.circle(image, (cX, cY), 7, (255, 255, 255), -1)
-        cv2.putText(
-            image,
-            "center",
-            (cX - 20, cY - 20),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.5,
-            (255, 255, 255),
-            2,
-        )
-
-        # Convert the image to grayscale
-        gray = cv2.cvtColor(or_image, cv2.COLOR_BGR2GRAY)
+        overlay.circle((cX, cY), 7, (255, 255, 255), -1)
+        overlay.text("center", (cX - 20, cY - 20), (255, 255, 255), 0.5)
 
-        # Apply GaussianBlur to reduce noise
-        gray_blur = cv2.GaussianBlur(gray, (5, 5), 0)
-
-        ret, mask = cv2.threshold(gray_blur, 50, 255, cv2.THRESH_BINARY)
-        # flip white and black, so that the cable is in white
-        mask = cv2.bitwise_not(mask)
-
-        # Apply morphological operations to clean up the mask
-        kernel = np.ones((5, 5), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-        cv2.imshow("mask", mask)
+        # grayscale, blur and an inverted threshold, so that the cable is in
+        # white, cleaned up by morphological operations
+        mask = self.cable_pipeline.run(image)
+        self.visualizer.show("probe_cable_mask", mask)
 
         # Find contours in the mask
         contours, hierarchy = cv2.findContours(
@@ -862,7 +908,7 @@ class ProbeAction(AbstractAction):
         # remove all circles from the contours
         contours = [c for c in contours if cv2.arcLength(c, True) > 100]
 
-        imx = cv2.drawContours(image, contours, -1, (255, 0, 0), 2)
+        overlay.contours(contours, (255, 0, 0), 2)
 
         filtered_contours = []
         # check if the contour points are inside the circle and remove the contour if only all points are outside
@@ -884,10 +930,11 @@ class ProbeAction(AbstractAction):
             if area > 100:  # Filter out small contours
                 selected_idx = idx
                 (x, y, w, h) = cv2.boundingRect(contour)
-                cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                overlay.rectangle((x, y), (x + w, y + h), (0, 255, 0), 2)
 
         if selected_idx == -1:
             rospy.loginfo("Cannot find cable for grasping probe")
+            self.probe_cable_dir_debug_pub.publish(overlay)
             return 0.0
 
         M = cv2.moments(contours[selected_idx])
@@ -895,24 +942,20 @@ class ProbeAction(AbstractAction):
         bY = int(M["m01"] / M["m00"])
 
         # plot the direction of the cable with an arrow
-        cv2.arrowedLine(image, (cX, cY), (bX, bY), (255, 0, 0), 2)
+        overlay.arrow((cX, cY), (bX, bY), (255, 0, 0), 2)
 
         # urint the angle of the cable direction wrt center
         angle = math.atan2(bY - cY, bX - cX) * 180.0 / math.pi
 
         # plot the angle of the cable direction wrt center
-        cv2.putText(
-            image,
-            "angle: {:.2f} degrees".format(angle),
-            (10, 30),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.6,
-            (0, 0, 255),
-            2,
+        overlay.text(
+            "angle: {:.2f} degrees".format(angle), (10, 30), (0, 0, 255)
         )
+        self.probe_cable_dir_debug_pub.publish(overlay)
 
         return angle
 
+    @per_frame_cache
     def get_door_knob_error(self, save_debug_images=False):
         if save_debug_images:
             self.save_debug_image()
@@ -928,160 +971,132 @@ class ProbeAction(AbstractAction):
         target_x = 362
         target_y = 280
         image = self.image[min_y:max_y, min_x:max_x]
-
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (3, 3), 0)
-        gray = cv2.Canny(gray, 80, 200)
-        gray = dilate(gray)
-        gray = erode(gray)
-        circles = detect_door_circle(gray)
+        overlay = self.visual_servo_debug_img.overlay(image)
+
+        gray = self.door_edges_pipeline.run(image)
+        # the circle of the previous frame confines the Hough fallback
+        circles = find_door_circle(gray, prior=self.door_circle_prior)
+        if circles is None or len(circles) != 1:
+            # the prior is only kept while the circle is found
+            self.door_circle_prior = None
         if circles is not None:
             if len(circles) > 1:
                 return None, None
             elif len(circles) == 1:
                 cc = circles[0]
-                cx, cy, r = cc[0], cc[1], cc[2]
+                self.door_circle_prior = cc
+                cx, cy, r = float(cc[0]), float(cc[1]), float(cc[2])
                 # Draw the circumference of the circle.
-                cv2.circle(image, (cx, cy), r, (0, 255, 0), 2)
+                overlay.circle((cx, cy), r, (0, 255, 0), 2)
                 error_x = target_x - cx
                 error_y = target_y - cy
         else:
             error_x = None
             error_y = None
         # cv2.imshow("image", image)
-        self.visual_servo_debug_img.publish(
-            self.bridge.cv2_to_imgmsg(image, "bgr8")
-        )
+        self.visual_servo_debug_img.publish(overlay)
 
         # cv2.waitKey(1)
         return error_x, error_y
 
-    def model_params(self):
-        self.model.conf = 0.25  # NMS confidence threshold
-        self.model.iou = 0.45  # NMS IoU threshold
-        self.model.agnostic = False  # NMS class-agnostic
-        self.model.multi_label = False  # NMS multiple labels per box
-        self.model.max_det = 1000  # maximum number of detections per image
+    @property
+    def detector(self):
+        if self._detector is None:
+            detector = create_roi_detector(
+                get_detector(self.model_name),
+                rospy.get_param("~roi_inference", {}),
+            )
+            self._detector = create_tracking_detector(
+                detector, rospy.get_param("~tracking", {})
+            )
+        return self._detector
 
+    @per_frame_cache
     def get_door_knob_error_2(self, save_debug_images=False):
         if save_debug_images:
             self.save_debug_image()
 
-        image_copy = self.image.copy()
+        image = self.image
 
-        target_x = 362
-        target_y = 280
+        target_x, target_y = self.DOOR_KNOB_TARGET
 
-        results = self.model(self.image, size=640)  # try 480, 512, 640
-
-        # handle the error with try and except
-        try:
-            if results.pred[0] is not None:  # if there are any detections
-                predictions = results.pred[0]
-                if predictions[:, 4]:
-                    scores = predictions[:, 4]
-
-                    # if more than one detection then take the one with highest score
-                    max_score_index = scores.argmax()
-                    max_score = scores[max_score_index]
-
-                    # get the bounding box of the detection with highest score
-                    # convert it to numpy array
-                    boxes = predictions[max_score_index:, :4].asnumpy()
-
-                    # TODO: add some conditions to avoid wrong detections, eg. like the area of the bounding box
-                    boxes = predictions[:, :4]  # x1, y1, x2, y2
-
-                    # find the center of the image
-                    center = (image_copy.shape[1] / 2, image_copy.shape[0] / 2)
-
-                    # draw vertical line at the center of the image
-                    cv2.line(
-                        image_copy,
-                        (int(center[0]), 0),
-                        (int(center[0]), image_copy.shape[0]),
-                        (0, 0, 255),
-                        1,
-                    )
-
-                    # find the center of the bounding box
-                    center_box = (boxes[0][0] + boxes[0][2]) / 2, (
-                        boxes[0][1] + boxes[0][3]
-                    ) / 2
-
-                    # show the center of the bounding box on the image
-                    cv2.circle(
-                        image_copy,
-                        (int(center_box[0]), int(center_box[1])),
-                        4,
-                        (255, 255, 0),
-                        1,
-                    )
-
-                    # find the error
-                    error_x = target_x - center_box[0]
-                    error_y = target_y - center_box[1]
-
-                    # print the error on the image on the top left corner of the image
-                    cv2.putText(
-                        image_copy,
-                        "error_x: {:.2f} error_y: {:.2f}".format(
-                            error_x, error_y
-                        ),
-                        (10, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        0.6,
-                        (255, 255, 0),
-                        2,
-                    )
-
-                    # # draw a horizontal line from the centroid to the target point (x-axis only)
-                    horizontal_line = [
-                        (center_box[0], center_box[1]),
-                        (target_x, center_box[1]),
-                    ]
-                    cv2.line(
-                        image_copy,
-                        horizontal_line[0],
-                        horizontal_line[1],
-                        (0, 255, 0),
-                        2,
-                    )
-
-                    # draw a vertical line from the end of the horizontal line to the target point (y-axis only)
-                    vertical_line = [
-                        (target_x, center_box[1]),
-                        (target_x, target_y),
-                    ]
-                    cv2.line(
-                        image_copy,
-                        vertical_line[0],
-                        vertical_line[1],
-                        (0, 255, 0),
-                        2,
-                    )
-
-                    # publish the debug image
-                    self.img_pub.publish(
-                        self.bridge.cv2_to_imgmsg(image_copy, "bgr8")
-                    )
-
-                    return error_x, error_y
-            else:
-                print("No predictions")
-                return None, None
-        except:
+        # (N, 6) array of x1, y1, x2, y2, score, class
+        detections = self.detector.detect(image)
+        if len(detections) == 0:
             print("No predictions")
             return None, None
 
-    def get_orange_mask(self, img):
-        lower = np.array([91, 120, 140])
-        upper = np.array([111, 255, 255])
-        mask = cv2.inRange(img, lower, upper)
-        mask = dilate(mask)
-        mask = erode(mask)
-        return mask
+        # if more than one detection then take the one with highest score
+        # TODO: add some conditions to avoid wrong detections, eg. like the area of the bounding box
+        box = detections[detections[:, 4].argmax(), :4]  # x1, y1, x2, y2
+
+        # recorded only while the debug topic has subscribers
+        overlay = self.visual_servo_debug_img.overlay(image)
+
+        # find the center of the image
+        center = (image.shape[1] / 2, image.shape[0] / 2)
+
+        # draw vertical line at the center of the image
+        overlay.line(
+            (int(center[0]), 0),
+            (int(center[0]), image.shape[0]),
+            (0, 0, 255),
+            1,
+        )
+
+        # find the center of the bounding box
+        center_box = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+
+        # show the center of the bounding box on the image
+        overlay.circle(
+            (int(center_box[0]), int(center_box[1])),
+            4,
+            (255, 255, 0),
+            1,
+        )
+
+        # find the error
+        error_x = target_x - center_box[0]
+        error_y = target_y - center_box[1]
+
+        # print the error on the image on the top left corner of the image
+        if overlay:
+            overlay.text(
+                "error_x: {:.2f} error_y: {:.2f}".format(error_x, error_y),
+                (10, 30),
+                (255, 255, 0),
+            )
 
+        # # draw a horizontal line from the centroid to the target point (x-axis only)
+        horizontal_line = [
+            (int(center_box[0]), int(center_box[1])),
+            (target_x, int(center_box[1])),
+        ]
+        overlay.line(
+            horizontal_line[0],
+            horizontal_line[1],
+            (0, 255, 0),
+            2,
+        )
+
+        # draw a vertical line from the end of the horizontal line to the target point (y-axis only)
+        vertical_line = [
+            (target_x, int(center_box[1])),
+            (target_x, target_y),
+        ]
+        overlay.line(
+            vertical_line[0],
+            vertical_line[1],
+            (0, 255, 0),
+            2,
+        )
+
+        # render and publish the debug image in the background
+        self.visual_servo_debug_img.publish(overlay)
+
+        return float(error_x), float(error_y)
+
+    @per_frame_cache
     def get_probe_point_error(self, save_debug_images=False):
         if save_debug_images:
             self.save_debug_image()
@@ -1092,100 +1107,89 @@ class ProbeAction(AbstractAction):
         ## set at height of 0.3 m (i.e tool_pose_z = 0.3)
         ## if the probe ends up too far to the bottom, increase target_y
         ## if the probe ends up too far to the right, increase target_x
-        target_x = 640
-        target_y = 495
-        if self.image is None:
+        target_x, target_y = self.PROBE_POINT_TARGET
+        image = self.image
+        if image is None:
             return None, None
-        (height, width, c) = self.image.shape
+        (height, width, c) = image.shape
         start_y = int(height / 4)
         start_x = int(width * 0.4)
-        img = self.image[
+        img = image[
             start_y : int(height - height / 4),
             start_x : int(width - width / 4),
             :,
         ]
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        mask = self.get_orange_mask(hsv)
+        mask = self.probe_point_pipeline.run(img)
         cx, cy = get_uppermost_contour(mask)
         if cx is None:
             return None, None
-        cv2.circle(img, (cx, cy), 5, (0, 255, 0), 2)
-        self.visual_servo_debug_img.publish(
-            self.bridge.cv2_to_imgmsg(img, "bgr8")
-        )
+        overlay = self.visual_servo_debug_img.overlay(img)
+        overlay.circle((cx, cy), 5, (0, 255, 0), 2)
+        self.visual_servo_debug_img.publish(overlay)
         error_x = target_x - (cx + start_x)
         error_y = target_y - (cy + start_y)
         return error_x, error_y
 
     def run_visual_servoing(
-        self, vs_target_fn, target_height, save_debug_images=False
+        self,
+        vs_target_fn,
+        target_height,
+        save_debug_images=False,
+        target_pixel=None,
     ):
-        success = False
-        rospy.loginfo("Moving to correct height")
-        while not rospy.is_shutdown():
-            # we need to be at 0.3 height to do VS
-            height_error = self.current_height - target_height
-            msg = kortex_driver.msg.TwistCommand()
-            msg.reference_frame = (
-                kortex_driver.msg.CartesianReferenceFrame.CARTESIAN_REFERENCE_FRAME_TOOL
-            )
-            if height_error > 0.001:
-                msg.twist.linear_z = 0.02
-            elif height_error < -0.001:
-                msg.twist.linear_z = -0.02
-            else:
-                break
-            self.cart_vel_pub.publish(msg)
-            self.loop_rate.sleep()
-
-        rospy.loginfo("visual servoing")
-        stop = False
-        while not rospy.is_shutdown():
-            if len(self.current_force_z) < 20:
+        """
+        input: target_pixel: pixel vs_target_fn aligns the target to, for the
+                             depth localization (None: servo only)
+        """
+        with self.frame_hub.perception():
+            rospy.loginfo("Moving to correct height")
+            while not rospy.is_shutdown():
+                # we need to be at 0.3 height to do VS
+                height_error = self.current_height - target_height
+                msg = kortex_driver.msg.TwistCommand()
+                msg.reference_frame = (
+                    kortex_driver.msg.CartesianReferenceFrame.CARTESIAN_REFERENCE_FRAME_TOOL
+                )
+                if height_error > 0.001:
+                    msg.twist.linear_z = 0.02
+                elif height_error < -0.001:
+                    msg.twist.linear_z = -0.02
+                else:
+                    break
+                self.cart_vel_pub.publish(msg)
                 self.loop_rate.sleep()
-                continue
-            msg = kortex_driver.msg.TwistCommand()
-            msg.reference_frame = (
-                kortex_driver.msg.CartesianReferenceFrame.CARTESIAN_REFERENCE_FRAME_TOOL
+
+            rospy.loginfo("visual servoing")
+            if hasattr(self._detector, "reset"):
+                self._detector.reset()
+            # a new run may start from another pose
+            self.door_circle_prior = None
+            target_fn = functools.partial(vs_target_fn, save_debug_images)
+            # detection runs on its own thread on the newest frame, the loop
+            # only reads the latest result and never waits for inference
+            aligned = self.depth_alignment.align(
+                target_fn,
+                target_pixel,
+                lambda: self.visual_servoing.run(
+                    target_fn,
+                    ready_fn=lambda: len(self.current_force_z) >= 20,
+                ),
             )
-            error_x, error_y = vs_target_fn(save_debug_images)
-            if error_x is None:
-                msg.twist.linear_x = 0.0
-            else:
-                if error_x < 0:
-                    msg.twist.linear_x = -0.005
-                if error_x > 0:
-                    msg.twist.linear_x = 0.005
-                if abs(error_x) < 3:
-                    msg.twist.linear_x = 0.0
-                elif abs(error_x) < 10:
-                    msg.twist.linear_x *= 0.5
-
-                if error_y < 0:
-                    msg.twist.linear_y = -0.005
-                if error_y > 0:
-                    msg.twist.linear_y = 0.005
-                if abs(error_y) < 3:
-                    msg.twist.linear_y = 0.0
-                elif abs(error_y) < 10:
-                    msg.twist.linear_y *= 0.5
-            self.cart_vel_pub.publish(msg)
-            if (
-                msg.twist.linear_x == 0.0
-                and msg.twist.linear_y == 0
-                and error_x is not None
+            if hasattr(self._detector, "stats"):
+                rospy.loginfo(
+                    "[probe_action] detection: " + self._detector.stats()
+                )
+            rospy.loginfo(
+                "[probe_action] perception cache: " + perception_cache.stats()
+            )
+            for pipeline in (
+                self.door_edges_pipeline,
+                self.probe_point_pipeline,
             ):
-                break
-            self.loop_rate.sleep()
-        msg = kortex_driver.msg.TwistCommand()
-        msg.reference_frame = (
-            kortex_driver.msg.CartesianReferenceFrame.CARTESIAN_REFERENCE_FRAME_MIXED
-        )
-        msg.twist.linear_x = 0.0
-        msg.twist.linear_y = 0.0
-        self.cart_vel_pub.publish(msg)
-        success = True
-        return success
+                if any(mean for mean, _ in pipeline.timings().values()):
+                    rospy.loginfo("[probe_action] " + pipeline.stats())
+                    pipeline.reset_stats()
+            return aligned
 
     def move_down_and_probe(self):
         """
@@ -1308,18 +1312,8 @@ class ProbeAction(AbstractAction):
         return pose_list
 
     def save_debug_image(self):
-        # get the current date and time
-        now = datetime.datetime.now()
-
-        # check if the directory exists
-        if not os.path.exists(self.save_debug_image_dir):
-            os.makedirs(self.save_debug_image_dir)
-
-        if self.image is not None:
-            cv2.imwrite(
-                os.path.join(
-                    self.save_debug_image_dir,
-                    "DoorKnob_debug_image_{}.png".format(now),
-                ),
-                self.image,
-            )
+        # encoded and written in the background, the directory is created
+        # on the first write
+        get_debug_image_writer(self.save_debug_image_dir).save(
+            self.image, "DoorKnob_debug_image"
+        )
@@ -12,6 +12,7 @@ from geometry_msgs.msg import PoseStamped, Quaternion, Twist, Vector3
 from utils.transform_utils import TransformUtils
 from utils.kinova_pose import KinovaPose, get_kinovapose_from_pose_stamped
 from utils.force_measure import ForceMeasurmement
+from utils.feedback_reader import feedback_subscriber
 
 
 class SliderAction(AbstractAction):
@@ -27,14 +28,12 @@ class SliderAction(AbstractAction):
         self.cartesian_velocity_pub = rospy.Publisher(
             "/my_gen3/in/cartesian_velocity", TwistCommand, queue_size=1
         )
-        self.base_feedback_sub = rospy.Subscriber(
-            "/my_gen3/base_feedback",
-            kortex_driver.msg.BaseCyclic_Feedback,
-            self.base_feedback_cb,
+        self.base_feedback_sub = feedback_subscriber(
+            callback=self.base_feedback_cb
         )
 
-    def base_feedback_cb(self, msg):
-        self.current_force_z.append(msg.base.tool_external_wrench_force_z)
+    def base_feedback_cb(self, sample):
+        self.current_force_z.append(sample.wrench[2])
         if len(self.current_force_z) > 25:
             self.current_force_z.pop(0)
 
@@ -4,6 +4,15 @@ import rospy
 from kinova_apps.abstract_action import AbstractAction
 from kinova_apps.full_arm_movement import FullArmMovement
 from utils.transform_utils import TransformUtils
+from utils.frame_hub import get_frame_hub
+from utils.perception_cache import per_frame_cache, perception_cache
+from utils.debug_image_writer import get_debug_image_writer
+from utils.debug_visualization import get_debug_publisher
+from utils.model_registry import get_detector, preload_detector
+from utils.pipeline import Pipeline
+from utils.visual_servoing import VisualServoing
+from utils.roi_inference import create_roi_detector
+from utils.tracking import create_tracking_detector
 from utils.kinova_pose import (
     get_kinovapose_from_list,
     get_kinovapose_from_pose_stamped,
@@ -12,15 +21,12 @@ from geometry_msgs.msg import PoseStamped, Quaternion
 from kortex_driver.srv import *
 from kortex_driver.msg import *
 import tf
-import os
-from sensor_msgs.msg import Image
 from cv_bridge import CvBridge, CvBridgeError
 import cv2
 import numpy as np
 import math
-import datetime
+import functools
 import pdb
-import yolov5
 
 
 class WindCableAction(AbstractAction):
@@ -29,13 +35,9 @@ class WindCableAction(AbstractAction):
     ) -> None:
         super().__init__(arm, transform_utils)
         self.debug = rospy.get_param("~debug", False)
-        self.img_sub = rospy.Subscriber(
-            "/camera/color/image_raw", Image, self.image_cb
-        )
-        self.img_pub = rospy.Publisher(
-            "/visual_servoing_debug_img", Image, queue_size=10
-        )
-        self.image = None
+        self.frame_hub = get_frame_hub()
+        # debug overlays, only rendered while someone is subscribed
+        self.img_pub = get_debug_publisher("/visual_servoing_debug_img")
         self.loop_rate = rospy.Rate(10)
         self.bridge = CvBridge()
         self.cart_vel_pub = rospy.Publisher(
@@ -43,11 +45,37 @@ class WindCableAction(AbstractAction):
             kortex_driver.msg.TwistCommand,
             queue_size=1,
         )
-        self.model = yolov5.load(
-            "/home/b-it-bots/robothon_ros_workspace/src/kinova_apps/models/probe_holder_horizontal/probe_holder_horizontal_nano_ver2.pt"
-        )
-        self.model_params()
+        # loaded in the background, ready by the time it is first used
+        self.model_name = "probe_holder_horizontal_v2"
+        preload_detector(self.model_name)
         self.save_debug_image_dir = "/home/b-it-bots/temp/robothon/windCable"
+        # detections older than ~max_detection_age (seconds) are not used
+        # for servoing
+        self.visual_servoing = VisualServoing(
+            self.cart_vel_pub,
+            name="wind_cable",
+            max_detection_age=rospy.get_param("~max_detection_age", 0.5),
+        )
+        # YOLO detector behind the ROI inference and detect-then-track
+        # layers, created on first use
+        self._detector = None
+        # edges of the cable ROI for detect_wind_cable; the white border
+        # is drawn on the grayscale buffer since the frame is read-only
+        self.wind_cable_pipeline = (
+            Pipeline("wind_cable")
+            .gray()
+            .stage(
+                "border",
+                lambda gray: cv2.rectangle(
+                    gray, (0, 0), (gray.shape[1], gray.shape[0]), 255, 20
+                ),
+                in_place=True,
+            )
+            .blur(5)
+            .threshold(100, cv2.THRESH_BINARY)
+            .canny(50, 150)
+            .dilate(3)
+        )
 
     def pre_perceive(self) -> bool:
         print("in pre perceive")
@@ -118,13 +146,12 @@ class WindCableAction(AbstractAction):
         print("in verify")
         return True
 
-    def image_cb(self, msg):
-        # get the image from the message
-        try:
-            image = self.bridge.imgmsg_to_cv2(msg, "bgr8")
-        except CvBridgeError as e:
-            print(e)
-        self.image = image
+    @property
+    def image(self):
+        """
+        Latest camera frame from the shared frame hub, decoded on demand
+        """
+        return self.frame_hub.get_frame("bgr8")
 
     def get_pose_in_board(self, pose: list):
         msg = PoseStamped()
@@ -345,67 +372,33 @@ class WindCableAction(AbstractAction):
         return True
 
     def run_visual_servoing(
-        self, vs_target_fn, run=True, error_thresholds=[5, 10]
+        self, vs_target_fn, run=True, error_thresholds=[5, 10], timeout=30.0
     ):
-        stop = False
-        while not rospy.is_shutdown():
-            if self.image is None:
-                rospy.loginfo("waiting for image")
-                self.loop_rate.sleep()
-                continue
-            msg = kortex_driver.msg.TwistCommand()
-            msg.reference_frame = (
-                kortex_driver.msg.CartesianReferenceFrame.CARTESIAN_REFERENCE_FRAME_TOOL
-            )
-            x_error, y_error = vs_target_fn(True)
-            if x_error is None:
-                print("none")
-                msg.twist.linear_x = 0.0
-            if y_error is None:
-                print("none")
-                msg.twist.linear_y = 0.0
-            if x_error is not None:
-                rospy.loginfo("X Error: %.2f" % (x_error))
-                if x_error < 0:
-                    msg.twist.linear_x = -0.005
-                if x_error > 0:
-                    msg.twist.linear_x = 0.005
-                # TODO : Make this separate for both
-                if (
-                    abs(x_error) < error_thresholds[0]
-                ):  # TODO 40 for picking cable 5 for tcuking alignment
-                    msg.twist.linear_x = 0.0
-                elif (
-                    abs(x_error) < error_thresholds[1]
-                ):  # TODO 50 for picking cable
-                    msg.twist.linear_x *= 0.5
-
-            if y_error is not None:
-                rospy.loginfo("Y Error: %.2f" % (y_error))
-                if y_error < 0:
-                    msg.twist.linear_y = -0.005
-                if y_error > 0:
-                    msg.twist.linear_y = 0.005
-                if abs(y_error) < 3:
-                    msg.twist.linear_y = 0.0
-                elif abs(y_error) < 10:
-                    msg.twist.linear_y *= 0.5
-            if run:
-                self.cart_vel_pub.publish(msg)
-                if (
-                    msg.twist.linear_x == 0.0
-                    and msg.twist.linear_y == 0.0
-                    and x_error is not None
-                ):
-                    break
-            self.loop_rate.sleep()
-        msg = kortex_driver.msg.TwistCommand()
-        msg.reference_frame = (
-            kortex_driver.msg.CartesianReferenceFrame.CARTESIAN_REFERENCE_FRAME_MIXED
+        if hasattr(self._detector, "reset"):
+            self._detector.reset()
+        # detection runs on its own thread on the newest frame, the loop only
+        # reads the latest result and never waits for inference; the targets
+        # only measure x, thresholds: 40 / 50 for picking the cable, 5 / 10
+        # for the alignment
+        result = self.visual_servoing.run(
+            functools.partial(vs_target_fn, True),
+            axes=("x",),
+            deadband=(error_thresholds[0],),
+            slow_zone=(error_thresholds[1],),
+            timeout=timeout,
+            publish=run,
         )
-        self.cart_vel_pub.publish(msg)
-        return True
+        if hasattr(self._detector, "stats"):
+            rospy.loginfo("[wind_cable] detection: " + self._detector.stats())
+        rospy.loginfo(
+            "[wind_cable] preprocessing: " + self.wind_cable_pipeline.stats()
+        )
+        rospy.loginfo(
+            "[wind_cable] perception cache: " + perception_cache.stats()
+        )
+        return result.converged or not run
 
+    @per_frame_cache
     def detect_wind_cable(self, save_image=False):
         if save_image:
             self.save_debug_image()
@@ -416,9 +409,11 @@ class WindCableAction(AbstractAction):
         contours_area_threshold_min = 3000
         contours_area_threshold_max = 15000
 
+        image = self.image
+
         # image center coordinates
-        image_center_x = self.image.shape[1] // 2
-        image_center_y = self.image.shape[0] // 2
+        image_center_x = image.shape[1] // 2
+        image_center_y = image.shape[0] // 2
 
         # draw a rectangle on the image from the center of the image
         x_axis_right = 500
@@ -427,39 +422,23 @@ class WindCableAction(AbstractAction):
         y_axis_bottom = 200
 
         # crop the ROI from the image with the rectangle
-        roi = self.image[
+        roi = image[
             image_center_y - y_axis_top : image_center_y + y_axis_bottom,
             image_center_x - x_axis_left : image_center_x + x_axis_right,
         ]
 
-        cv2.rectangle(
-            roi, (0, 0), (roi.shape[1], roi.shape[0]), (255, 255, 255), 20
+        overlay = self.img_pub.overlay(roi)
+        overlay.rectangle(
+            (0, 0), (roi.shape[1], roi.shape[0]), (255, 255, 255), 20
         )
-
-        roi_copy = roi.copy()
-        roi_copy_2 = roi.copy()
-
-        # convert the image to grayscale
-        gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-        # apply gaussian blur to the image
-        blur = cv2.GaussianBlur(gray, (5, 5), 0)
-        # otsu thresholding
-        # ret, thresh = cv2.threshold(
-        #     blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        ret, blur = cv2.threshold(blur, 100, 255, cv2.THRESH_BINARY)
-        # apply canny edge detection
-        canny = cv2.Canny(blur, 50, 150)
-        # apply dilation
-        kernel = np.ones((3, 3), np.uint8)
-        canny = cv2.dilate(canny, kernel, iterations=1)
+        # grayscale with a white border, blur, threshold, canny and
+        # dilation into the buffers of the previous frame
+        canny = self.wind_cable_pipeline.run(roi)
         # find the contours
         contours, _ = cv2.findContours(
             canny, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE
         )
 
-        # draw the contours on the image
-        cv2.drawContours(roi_copy, contours, -1, (0, 255, 0), 2)
-
         # filter out black contours
         filtered_contours = []
         for contour in contours:
@@ -495,8 +474,8 @@ class WindCableAction(AbstractAction):
                 continue
 
             # draw contours on the image
-            # cv2.drawContours(roi_copy_2, [contour], -1, (0, 255, 0), 2)
-            # cv2.imshow("Contours", roi_copy_2)
+            # cv2.drawContours(roi, [contour], -1, (0, 255, 0), 2)
+            # cv2.imshow("Contours", roi)
             # cv2.waitKey(0)
             # cv2.destroyAllWindows()
 
@@ -506,25 +485,23 @@ class WindCableAction(AbstractAction):
 
         # draw a horizontal line in the middle of the image
         horizontal_line = [
-            (0, roi_copy_2.shape[0] // 2),
-            (roi_copy_2.shape[1], roi_copy_2.shape[0] // 2),
+            (0, roi.shape[0] // 2),
+            (roi.shape[1], roi.shape[0] // 2),
         ]
-        cv2.line(
-            roi_copy_2, horizontal_line[0], horizontal_line[1], (0, 0, 255), 2
-        )
+        overlay.line(horizontal_line[0], horizontal_line[1], (0, 0, 255), 2)
 
         # draw a vertical line in the middle of the image
         vertical_line = [
-            (roi_copy_2.shape[1] // 2, 0),
-            (roi_copy_2.shape[1] // 2, roi_copy_2.shape[0]),
+            (roi.shape[1] // 2, 0),
+            (roi.shape[1] // 2, roi.shape[0]),
         ]
-        cv2.line(roi_copy_2, vertical_line[0], vertical_line[1], (0, 0, 255), 2)
+        overlay.line(vertical_line[0], vertical_line[1], (0, 0, 255), 2)
 
         # NOTE: it should only be one contour
         if len(filtered_contours) > 1:
             print("More than one contour found!")
             print("TODO 1: failure recovery mechanism")
-            return (None, None)
+            return (None,)
 
         elif len(filtered_contours) == 1:
             # get the contour points
@@ -536,8 +513,7 @@ class WindCableAction(AbstractAction):
             ][0]
 
             # draw a circle on the bottom most point
-            cv2.circle(
-                roi_copy_2,
+            overlay.circle(
                 (bottom_most_point[0], bottom_most_point[1]),
                 5,
                 (0, 0, 255),
@@ -548,31 +524,23 @@ class WindCableAction(AbstractAction):
             print("Error: {}".format(error))
 
             # print the error on the image
-            cv2.putText(
-                roi_copy_2,
-                "Error: {}".format(error),
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                1,
-                (0, 0, 255),
-                2,
-            )
+            overlay.text("Error: {}".format(error), (10, 30), (0, 0, 255), 1)
 
             # draw the error line on the image from the centroid to the vertical line
             error_line = [
                 bottom_most_point,
                 (roi.shape[1] // 2, bottom_most_point[1]),
             ]
-            cv2.line(roi_copy_2, error_line[0], error_line[1], (255, 0, 0), 2)
+            overlay.line(error_line[0], error_line[1], (255, 0, 0), 2)
 
-            # publish the debug image
-            self.img_pub.publish(self.bridge.cv2_to_imgmsg(roi_copy_2, "bgr8"))
+            # render and publish the debug image in the background
+            self.img_pub.publish(overlay)
 
-            return (error, None)
+            return (error,)
 
         else:
             print("No contour found!")
-            return (None, None)
+            return (None,)
 
     def find_and_save_tucking_pose(self):
         # current_pose = self.arm.get_current_pose()
@@ -599,6 +567,10 @@ class WindCableAction(AbstractAction):
         success = self.run_visual_servoing(
             self.detect_probe_holder_horizontal, True, error_thresholds=[5, 10]
         )
+        if not success:
+            rospy.logwarn(
+                "[wind_cable] probe holder alignment did not converge"
+            )
         pose_for_tucking = self.arm.get_current_pose()
         if pose_for_tucking.theta_z_deg > 0:
             pose_for_tucking.theta_z_deg -= 180.0
@@ -606,107 +578,84 @@ class WindCableAction(AbstractAction):
             pose_for_tucking.theta_z_deg += 180.0
         return pose_for_tucking
 
-    def model_params(self):
-        self.model.conf = 0.25  # NMS confidence threshold
-        self.model.iou = 0.45  # NMS IoU threshold
-        self.model.agnostic = False  # NMS class-agnostic
-        self.model.multi_label = False  # NMS multiple labels per box
-        self.model.max_det = 1000  # maximum number of detections per image
+    @property
+    def detector(self):
+        if self._detector is None:
+            detector = create_roi_detector(
+                get_detector(self.model_name),
+                rospy.get_param("~roi_inference", {}),
+            )
+            self._detector = create_tracking_detector(
+                detector, rospy.get_param("~tracking", {})
+            )
+        return self._detector
 
+    @per_frame_cache
     def detect_probe_holder_horizontal(self, save_image=False):
         if save_image:
             self.save_debug_image()
 
-        image_copy = self.image.copy()
+        image = self.image
 
-        results = self.model(self.image, size=640)  # try 480, 512, 640
+        # (N, 6) array of x1, y1, x2, y2, score, class, highest score first
+        detections = self.detector.detect(image)
+        if len(detections) == 0:
+            print("No predictions")
+            return (None,)
 
-        # handle the error with try and except
-        try:
-            if results.pred[0] is not None:  # if there are any detections
-                predictions = results.pred[0]
-                if predictions[:, 4]:
-                    # TODO: add some conditions to avoid wrong detections, eg. like the area of the bounding box
-                    boxes = predictions[:, :4]  # x1, y1, x2, y2
+        # TODO: add some conditions to avoid wrong detections, eg. like the area of the bounding box
+        box = detections[detections[:, 4].argmax(), :4]  # x1, y1, x2, y2
 
-                    # find the center of the image
-                    center = (image_copy.shape[1] / 2, image_copy.shape[0] / 2)
+        # recorded only while the debug topic has subscribers
+        overlay = self.img_pub.overlay(image)
 
-                    # draw vertical line at the center of the image
-                    cv2.line(
-                        image_copy,
-                        (int(center[0]), 0),
-                        (int(center[0]), image_copy.shape[0]),
-                        (0, 0, 255),
-                        1,
-                    )
+        # find the center of the image
+        center = (image.shape[1] / 2, image.shape[0] / 2)
 
-                    # find the center of the bounding box
-                    center_box = (boxes[0][0] + boxes[0][2]) / 2, (
-                        boxes[0][1] + boxes[0][3]
-                    ) / 2
-
-                    # show the center of the bounding box on the image
-                    cv2.circle(
-                        image_copy,
-                        (int(center_box[0]), int(center_box[1])),
-                        4,
-                        (255, 255, 0),
-                        1,
-                    )
+        # draw vertical line at the center of the image
+        overlay.line(
+            (int(center[0]), 0),
+            (int(center[0]), image.shape[0]),
+            (0, 0, 255),
+            1,
+        )
 
-                    # TODO: Check if the probe can be picked near the tip
-                    # find the error in x direction
-                    error_x = (
-                        center[0] - center_box[0] + 27.0
-                    )  # magic number for aligning the tip of probe to the center
-
-                    # print the error on the image on the top left corner of the image
-                    cv2.putText(
-                        image_copy,
-                        "Error: " + str(error_x.numpy()),
-                        (10, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        1,
-                        (255, 255, 0),
-                        2,
-                    )
+        # find the center of the bounding box
+        center_box = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
 
-                    # draw the error line from the center of bounding box to the y axis of the image
-                    cv2.line(
-                        image_copy,
-                        (int(center_box[0]), int(center_box[1])),
-                        (int(center_box[0] + error_x), int(center_box[1])),
-                        (0, 255, 0),
-                        2,
-                    )
+        # show the center of the bounding box on the image
+        overlay.circle(
+            (int(center_box[0]), int(center_box[1])),
+            4,
+            (255, 255, 0),
+            1,
+        )
 
-                    # publish the debug image
-                    self.img_pub.publish(
-                        self.bridge.cv2_to_imgmsg(image_copy, "bgr8")
-                    )
+        # TODO: Check if the probe can be picked near the tip
+        # find the error in x direction
+        error_x = float(
+            center[0] - center_box[0] + 27.0
+        )  # magic number for aligning the tip of probe to the center
+
+        # print the error on the image on the top left corner of the image
+        overlay.text("Error: " + str(error_x), (10, 30), (255, 255, 0), 1)
+
+        # draw the error line from the center of bounding box to the y axis of the image
+        overlay.line(
+            (int(center_box[0]), int(center_box[1])),
+            (int(center_box[0] + error_x), int(center_box[1])),
+            (0, 255, 0),
+            2,
+        )
 
-                return error_x.numpy(), None  # error in x direction
-            else:
-                print("No predictions")
-                return None, None
-        except:
-            print("No predictions")
-            return None, None
+        # render and publish the debug image in the background
+        self.img_pub.publish(overlay)
+
+        return (error_x,)  # error in x direction only
 
     def save_debug_image(self):
-        # get the current date and time
-        now = datetime.datetime.now()
-
-        # check if the directory exists
-        if not os.path.exists(self.save_debug_image_dir):
-            os.makedirs(self.save_debug_image_dir)
-
-        if self.image is not None:
-            cv2.imwrite(
-                os.path.join(
-                    self.save_debug_image_dir,
-                    "WindCable_debug_image_{}.png".format(now),
-                ),
-                self.image,
-            )
+        # encoded and written in the background, the directory is created
+        # on the first write
+        get_debug_image_writer(self.save_debug_image_dir).save(
+            self.image, "WindCable_debug_image"
+        )
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Pinhole model of the wrist camera for converting between pixel errors and
+# tool motion in the servo loops.
+#
+# The camera looks straight down along the tool z axis during visual
+# servoing, so a tool translation d (m) parallel to the board moves the
+# target by f / distance * d pixels, where distance is the height of the
+# camera above the board. Image x / y are aligned with tool x / y such that a
+# positive tool velocity reduces a positive pixel error (the convention of
+# all target error functions).
+
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+import rospy
+from sensor_msgs.msg import CameraInfo
+
+DEFAULT_CAMERA_INFO_TOPIC = "/camera/color/camera_info"
+
+
+class CameraModel(object):
+    """
+    Usage:
+        camera = get_camera_model()
+        ppm_x, ppm_y = camera.pixels_per_meter(tool_height)
+    """
+
+    def __init__(
+        self,
+        info_topic: str = DEFAULT_CAMERA_INFO_TOPIC,
+        fx: float = 910.0,
+        fy: float = 910.0,
+        cx: float = 640.0,
+        cy: float = 360.0,
+        plane_height: float = 0.1157,
+        camera_offset: float = 0.1,
+        min_distance: float = 0.05,
+    ):
+        """
+        input: info_topic: camera_info topic the intrinsics are read from
+               fx, fy, cx, cy: intrinsics used until camera_info is received
+               plane_height: height of the board surface in base_link (m)
+               camera_offset: height of the camera above the tool frame (m)
+               min_distance: lower bound of the camera to board distance (m)
+        """
+        self.fx, self.fy, self.cx, self.cy = fx, fy, cx, cy
+        self.plane_height = plane_height
+        self.camera_offset = camera_offset
+        self.min_distance = min_distance
+        self.from_camera_info = False
+        self._lock = threading.Lock()
+        self._sub = rospy.Subscriber(
+            info_topic, CameraInfo, self._info_cb, queue_size=1
+        )
+
+    def _info_cb(self, msg):
+        # the intrinsics do not change, one message is enough
+        with self._lock:
+            self.fx, self.fy = msg.K[0], msg.K[4]
+            self.cx, self.cy = msg.K[2], msg.K[5]
+            self.from_camera_info = True
+        self._sub.unregister()
+
+    def distance(self, tool_height: float) -> float:
+        """
+        Camera to board distance for a tool height in base_link (m)
+        """
+        return max(
+            self.min_distance,
+            tool_height + self.camera_offset - self.plane_height,
+        )
+
+    def pixels_per_meter(self, tool_height: float) -> Tuple[float, float]:
+        """
+        Image motion in pixels per meter of tool motion along x and y
+        """
+        distance = self.distance(tool_height)
+        with self._lock:
+            return self.fx / distance, self.fy / distance
+
+    def pixels_to_meters(
+        self, error_px: np.ndarray, tool_height: float
+    ) -> np.ndarray:
+        """
+        Tool translation (m, tool x / y) that removes a pixel error
+        """
+        ppm = np.array(self.pixels_per_meter(tool_height))
+        return np.asarray(error_px, dtype=float) / ppm
+
+
+_camera_model: Optional[CameraModel] = None
+
+
+def get_camera_model() -> CameraModel:
+    """
+    Process-wide camera model configured from the ~camera_model parameter
+    dict (see CameraModel for the keys); plane_height defaults to
+    /board_height
+    """
+    global _camera_model
+    if _camera_model is None:
+        params = dict(rospy.get_param("~camera_model", {}))
+        params.setdefault(
+            "plane_height", rospy.get_param("/board_height", 0.1157)
+        )
+        _camera_model = CameraModel(**params)
+    return _camera_model
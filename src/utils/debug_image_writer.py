@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# Asynchronous writer for the debug images saved during visual servoing.
+#
+# Encoding a 720p PNG takes tens of milliseconds, which used to block the
+# servo loop on every iteration with save_debug_images=True. save() only
+# rate-limits, copies the frame and enqueues it; a small pool of worker
+# threads encodes (JPEG or PNG) and writes the files. The queue is bounded and
+# drops the oldest frame when full, and nothing more is written once the
+# directory exceeds its disk quota.
+
+import datetime
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+import rospy
+
+# image format -> file extension
+FORMATS = {"jpg": ".jpg", "png": ".png"}
+
+
+def directory_size(directory: str) -> int:
+    """
+    Total size in bytes of the files directly in directory
+    """
+    if not os.path.isdir(directory):
+        return 0
+    return sum(
+        entry.stat().st_size
+        for entry in os.scandir(directory)
+        if entry.is_file()
+    )
+
+
+class DebugImageWriter(object):
+    """
+    Usage:
+        writer = get_debug_image_writer(self.save_debug_image_dir)
+        writer.save(self.image, "DoorKnob_debug_image")
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        image_format: str = "jpg",
+        jpeg_quality: int = 90,
+        png_compression: int = 1,
+        max_queue: int = 8,
+        num_workers: int = 2,
+        max_rate: float = 5.0,
+        max_disk_mb: float = 500.0,
+    ):
+        """
+        input: directory: output directory, created if it does not exist
+               image_format: "jpg" or "png"
+               jpeg_quality: JPEG quality (0-100)
+               png_compression: PNG compression level (0-9)
+               max_queue: frames waiting to be written; the oldest is dropped
+               num_workers: encoding / writing threads
+               max_rate: maximum saved frames per second, 0 for no limit
+               max_disk_mb: stop writing once directory holds this many MB
+        """
+        if image_format not in FORMATS:
+            raise ValueError(
+                "unknown debug image format '%s', expected one of %s"
+                % (image_format, sorted(FORMATS))
+            )
+        self.directory = directory
+        self.extension = FORMATS[image_format]
+        if image_format == "jpg":
+            self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        else:
+            self.encode_params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._queue = deque(maxlen=max_queue)
+        self._last_save = None
+        self._disk_bytes = None
+        self._num_writing = 0
+
+        self.num_saved = 0
+        self.num_written = 0
+        self.num_dropped = 0
+        self.num_rate_limited = 0
+        self.num_over_quota = 0
+
+        self._workers = [
+            threading.Thread(
+                target=self._run,
+                name="debug_image_writer_%d" % i,
+                daemon=True,
+            )
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def save(self, image: Optional[np.ndarray], prefix: str) -> bool:
+        """
+        Queues a copy of image to be written as <prefix>_<date time>.<ext>;
+        returns False if it was skipped by the rate limit
+        """
+        if image is None:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if (
+                self._last_save is not None
+                and now - self._last_save < self.min_interval
+            ):
+                self.num_rate_limited += 1
+                return False
+            self._last_save = now
+        # frames from the frame hub may be recycled, the copy is cheap
+        # compared to encoding
+        image = image.copy()
+        stamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S.%f")
+        path = os.path.join(
+            self.directory, "%s_%s%s" % (prefix, stamp, self.extension)
+        )
+        with self._lock:
+            if len(self._queue) == self._queue.maxlen:
+                # deque drops the oldest entry on append
+                self.num_dropped += 1
+            self._queue.append((path, image))
+            self.num_saved += 1
+            self._not_empty.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._not_empty.wait()
+                path, image = self._queue.popleft()
+                self._num_writing += 1
+            try:
+                self._write(path, image)
+            except Exception as e:
+                rospy.logerr_throttle(
+                    5.0, "[debug_image_writer] cannot write %s: %s" % (path, e)
+                )
+            finally:
+                with self._lock:
+                    self._num_writing -= 1
+
+    def _write(self, path: str, image: np.ndarray):
+        ok, data = cv2.imencode(self.extension, image, self.encode_params)
+        if not ok:
+            raise RuntimeError("encoding failed")
+        with self._lock:
+            if self._disk_bytes is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._disk_bytes = directory_size(self.directory)
+            if self._disk_bytes + len(data) > self.max_disk_bytes:
+                self.num_over_quota += 1
+                rospy.logwarn_throttle(
+                    10.0,
+                    "[debug_image_writer] %s exceeds %d MB, not saving"
+                    % (self.directory, self.max_disk_bytes // (1024 * 1024)),
+                )
+                return
+            self._disk_bytes += len(data)
+        with open(path, "wb") as f:
+            f.write(data.tobytes())
+        with self._lock:
+            self.num_written += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """
+        Waits until all queued images are written; False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._queue and self._num_writing == 0:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def stats(self) -> str:
+        with self._lock:
+            return (
+                "saved: %d, written: %d, dropped: %d, rate limited: %d, "
+                "over quota: %d"
+                % (
+                    self.num_saved,
+                    self.num_written,
+                    self.num_dropped,
+                    self.num_rate_limited,
+                    self.num_over_quota,
+                )
+            )
+
+
+_writers: Dict[str, DebugImageWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_debug_image_writer(directory: str) -> DebugImageWriter:
+    """
+    Process-wide writer for directory, configured from the ~debug_images
+    parameter dict (see DebugImageWriter for the keys)
+    """
+    with _writers_lock:
+        if directory not in _writers:
+            params = rospy.get_param("~debug_images", {})
+            _writers[directory] = DebugImageWriter(directory, **params)
+        return _writers[directory]
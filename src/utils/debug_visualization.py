@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# Subscriber-aware debug images.
+#
+# The detectors used to copy the frame, draw on it and convert it with
+# cv_bridge on every servo iteration, whether anyone was watching or not.
+# Instead they record their lines, circles and text on an Overlay, which only
+# references the frame. The DebugImagePublisher hands out an inactive overlay
+# (recording nothing) if the topic has no subscribers; otherwise the overlay
+# is rendered, optionally downscaled, and published on a background thread.
+# Only the latest pending overlay is kept, older ones are dropped. The frames
+# of the frame hub are never reused, so the referenced frame is unchanged
+# when the overlay is rendered.
+
+import threading
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+import rospy
+from sensor_msgs.msg import Image
+
+from utils.image_conversion import ndarray_to_imgmsg
+
+DEFAULT_DEBUG_TOPIC = "/visual_servoing_debug_img"
+
+
+class Overlay(object):
+    """
+    Drawing primitives on top of a frame, rendered later by render().
+    Coordinates are in pixels of the frame; the frame is not modified.
+
+    Usage:
+        overlay = debug_pub.overlay(image)
+        overlay.circle((cx, cy), 4, (255, 255, 0))
+        debug_pub.publish(overlay)
+    """
+
+    def __init__(self, image: np.ndarray, encoding: str = "bgr8"):
+        self.image = image
+        self.encoding = encoding
+        self.primitives = []
+
+    def __bool__(self):
+        return True
+
+    def line(self, pt1, pt2, color, thickness=1):
+        self.primitives.append(("line", (pt1, pt2), color, thickness, None))
+
+    def arrow(self, pt1, pt2, color, thickness=1):
+        self.primitives.append(("arrow", (pt1, pt2), color, thickness, None))
+
+    def circle(self, center, radius, color, thickness=1):
+        self.primitives.append(
+            ("circle", (center,), color, thickness, radius)
+        )
+
+    def rectangle(self, pt1, pt2, color, thickness=1):
+        self.primitives.append(
+            ("rectangle", (pt1, pt2), color, thickness, None)
+        )
+
+    def text(self, text, org, color, scale=0.6, thickness=2):
+        self.primitives.append(
+            ("text", (org,), color, thickness, (text, scale))
+        )
+
+    def contours(self, contours, color, thickness=1):
+        contours = [np.asarray(c) for c in contours]
+        self.primitives.append(("contours", (), color, thickness, contours))
+
+    def render(self, scale: float = 1.0) -> np.ndarray:
+        """
+        Copy of the frame (resized by scale) with the primitives drawn on it
+        """
+        if scale != 1.0:
+            image = cv2.resize(
+                self.image,
+                None,
+                fx=scale,
+                fy=scale,
+                interpolation=cv2.INTER_AREA,
+            )
+        else:
+            image = self.image.copy()
+
+        def px(point):
+            return int(round(point[0] * scale)), int(round(point[1] * scale))
+
+        for kind, points, color, thickness, extra in self.primitives:
+            points = [px(p) for p in points]
+            if kind == "line":
+                cv2.line(image, points[0], points[1], color, thickness)
+            elif kind == "arrow":
+                cv2.arrowedLine(image, points[0], points[1], color, thickness)
+            elif kind == "circle":
+                radius = max(1, int(round(extra * scale)))
+                cv2.circle(image, points[0], radius, color, thickness)
+            elif kind == "rectangle":
+                cv2.rectangle(image, points[0], points[1], color, thickness)
+            elif kind == "text":
+                text, text_scale = extra
+                cv2.putText(
+                    image,
+                    text,
+                    points[0],
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    text_scale * max(scale, 0.5),
+                    color,
+                    thickness,
+                )
+            elif kind == "contours":
+                contours = [
+                    np.round(c * scale).astype(np.int32) for c in extra
+                ]
+                cv2.drawContours(image, contours, -1, color, thickness)
+        return image
+
+
+class _InactiveOverlay(Overlay):
+    """
+    Returned when nobody is subscribed; records nothing
+    """
+
+    def __init__(self):
+        super().__init__(None)
+
+    def __bool__(self):
+        return False
+
+    def line(self, *args, **kwargs):
+        pass
+
+    arrow = circle = rectangle = text = contours = line
+
+
+_INACTIVE_OVERLAY = _InactiveOverlay()
+
+
+class DebugImagePublisher(object):
+    """
+    Publishes debug overlays on a topic from a background thread, only while
+    the topic has subscribers
+    """
+
+    def __init__(
+        self,
+        topic: str = DEFAULT_DEBUG_TOPIC,
+        scale: Optional[float] = None,
+        queue_size: int = 1,
+    ):
+        """
+        input: topic: image topic to publish on
+               scale: output scale factor; ~debug_image_scale if None
+               queue_size: publisher queue size
+        """
+        self.topic = topic
+        if scale is None:
+            scale = rospy.get_param("~debug_image_scale", 1.0)
+        self.scale = scale
+        self.pub = rospy.Publisher(topic, Image, queue_size=queue_size)
+        self._lock = threading.Lock()
+        self._pending = threading.Condition(self._lock)
+        self._overlay: Optional[Overlay] = None
+        self._thread = None
+        self.num_published = 0
+        self.num_dropped = 0
+
+    @property
+    def active(self) -> bool:
+        return self.pub.get_num_connections() > 0
+
+    def overlay(self, image: np.ndarray, encoding: str = "bgr8") -> Overlay:
+        """
+        Overlay to draw on for image; an inactive (falsy) overlay that
+        records nothing if the topic has no subscribers
+        """
+        if not self.active:
+            return _INACTIVE_OVERLAY
+        return Overlay(image, encoding)
+
+    def publish_image(self, image: np.ndarray, encoding: str = "bgr8"):
+        """
+        Publishes image as-is (after scaling) if anyone is subscribed
+        """
+        if self.active:
+            self.publish(Overlay(image, encoding))
+
+    def publish(self, overlay: Overlay):
+        """
+        Queues overlay for rendering; does nothing for inactive overlays
+        """
+        if not overlay:
+            return
+        with self._lock:
+            if self._overlay is not None:
+                self.num_dropped += 1
+            self._overlay = overlay
+            self._pending.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name="debug_image_publisher",
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def _run(self):
+        while not rospy.is_shutdown():
+            with self._lock:
+                while self._overlay is None:
+                    self._pending.wait(timeout=1.0)
+                    if rospy.is_shutdown():
+                        return
+                overlay, self._overlay = self._overlay, None
+            try:
+                image = overlay.render(self.scale)
+                self.pub.publish(ndarray_to_imgmsg(image, overlay.encoding))
+                self.num_published += 1
+            except Exception as e:
+                rospy.logerr_throttle(
+                    5.0, "[debug_visualization] %s: %s" % (self.topic, e)
+                )
+
+
+_publishers: Dict[str, DebugImagePublisher] = {}
+_publishers_lock = threading.Lock()
+
+
+def get_debug_publisher(
+    topic: str = DEFAULT_DEBUG_TOPIC,
+) -> DebugImagePublisher:
+    """
+    Process-wide debug image publisher for topic
+    """
+    with _publishers_lock:
+        if topic not in _publishers:
+            _publishers[topic] = DebugImagePublisher(topic)
+        return _publishers[topic]
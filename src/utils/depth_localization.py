@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+# Depth based localization of servo targets, to replace most of a visual
+# servoing run by one Cartesian motion.
+#
+# The servo target functions return target_pixel - object_pixel, where
+# target_pixel is where the object appears once the tool is aligned. With
+# the depth Z of the object from the aligned depth image, both pixels are
+# deprojected into the camera frame; the camera (and the rigidly attached
+# tool) has to move by R * Z * (ray(object) - ray(target)), with R the
+# rotation of the camera frame in base_link, for the object to appear at
+# target_pixel. Only the x / y components are applied, the tool keeps its
+# height. Visual servoing can follow as a short final refinement. The depth
+# topic is only subscribed while an alignment runs.
+
+import time
+from typing import Callable, Optional, Sequence, Tuple
+
+import numpy as np
+import rospy
+import tf2_ros
+from scipy.spatial.transform import Rotation
+
+from utils.camera_model import CameraModel, get_camera_model
+from utils.frame_hub import get_frame_hub
+
+DEFAULT_DEPTH_TOPIC = "/camera/depth_registered/image_rect"
+
+
+class DepthLocalizer(object):
+    """
+    Usage:
+        localizer = get_depth_localizer()
+        with localizer.depth_hub.perception():
+            offset = localizer.tool_offset(target_pixel, (error_x, error_y))
+        if offset is not None:
+            pose.x += offset[0]
+            pose.y += offset[1]
+    """
+
+    def __init__(
+        self,
+        depth_topic: str = DEFAULT_DEPTH_TOPIC,
+        base_frame: str = "base_link",
+        patch_size: int = 7,
+        min_depth: float = 0.05,
+        max_depth: float = 1.5,
+        max_offset: float = 0.1,
+        tf_timeout: float = 0.5,
+        camera: Optional[CameraModel] = None,
+        tf_buffer: Optional[tf2_ros.Buffer] = None,
+    ):
+        """
+        input: depth_topic: depth image registered to the color image
+               base_frame: frame of the returned offsets
+               patch_size: side of the pixel patch the depth median is
+                           taken over (px)
+               min_depth, max_depth: valid depth range (m)
+               max_offset: larger offsets are rejected as wrong
+                           detections or depth (m)
+               tf_timeout: wait for the camera transform (s)
+               camera: camera model for the intrinsics
+        """
+        self.depth_hub = get_frame_hub(depth_topic)
+        self.base_frame = base_frame
+        self.patch_size = patch_size
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.max_offset = max_offset
+        self.tf_timeout = tf_timeout
+        self.camera = camera or get_camera_model()
+        if tf_buffer is None:
+            tf_buffer = tf2_ros.Buffer()
+            self._tf_listener = tf2_ros.TransformListener(tf_buffer)
+        self.tf_buffer = tf_buffer
+
+    def depth_at(self, pixel: Sequence[float]) -> Optional[float]:
+        """
+        Median depth (m) of the valid pixels in a patch around pixel, None
+        if no depth image is available or the patch has no valid depth; the
+        depth hub has to be active (see FrameHub.perception)
+        """
+        msg = self.depth_hub.latest_msg()
+        if msg is None:
+            return None
+        depth = self.depth_hub.get_frame(msg.encoding, msg)
+        half = self.patch_size // 2
+        u, v = int(round(pixel[0])), int(round(pixel[1]))
+        patch = depth[
+            max(0, v - half) : v + half + 1, max(0, u - half) : u + half + 1
+        ].astype(np.float32)
+        if msg.encoding == "16UC1":
+            # millimeters
+            patch *= 1e-3
+        patch = patch[
+            np.isfinite(patch)
+            & (patch >= self.min_depth)
+            & (patch <= self.max_depth)
+        ]
+        if patch.size == 0:
+            return None
+        return float(np.median(patch))
+
+    def ray(self, pixel: Sequence[float]) -> np.ndarray:
+        """
+        Point at unit depth on the ray through pixel, camera optical frame
+        """
+        camera = self.camera
+        return np.array(
+            [
+                (pixel[0] - camera.cx) / camera.fx,
+                (pixel[1] - camera.cy) / camera.fy,
+                1.0,
+            ]
+        )
+
+    def camera_rotation(self, camera_frame: str) -> Optional[Rotation]:
+        try:
+            transform = self.tf_buffer.lookup_transform(
+                self.base_frame,
+                camera_frame,
+                rospy.Time(0),
+                rospy.Duration(self.tf_timeout),
+            )
+        except (
+            tf2_ros.LookupException,
+            tf2_ros.ConnectivityException,
+            tf2_ros.ExtrapolationException,
+        ) as error:
+            rospy.logwarn("[depth_localization] %s" % error)
+            return None
+        q = transform.transform.rotation
+        return Rotation.from_quat([q.x, q.y, q.z, q.w])
+
+    def tool_offset(
+        self,
+        target_pixel: Sequence[float],
+        errors: Sequence[Optional[float]],
+    ) -> Optional[Tuple[float, float]]:
+        """
+        input: target_pixel: pixel (full image) the object is servoed to
+               errors: (error_x, error_y) = target_pixel - object pixel, as
+                       returned by the servo target functions
+        output: (dx, dy) tool translation in base_frame (m) that brings the
+                object to target_pixel, None if the object was not found or
+                there is no valid depth / transform
+        The depth hub has to be active, see depth_at.
+        """
+        if errors is None or any(e is None for e in errors):
+            return None
+        object_pixel = (
+            target_pixel[0] - errors[0],
+            target_pixel[1] - errors[1],
+        )
+        depth = self.depth_at(object_pixel)
+        msg = self.depth_hub.latest_msg()
+        if depth is None or msg is None:
+            rospy.logwarn("[depth_localization] no valid depth at target")
+            return None
+        rotation = self.camera_rotation(msg.header.frame_id)
+        if rotation is None:
+            return None
+        offset = rotation.apply(
+            depth * (self.ray(object_pixel) - self.ray(target_pixel))
+        )
+        if np.hypot(offset[0], offset[1]) > self.max_offset:
+            rospy.logwarn(
+                "[depth_localization] rejecting offset (%.3f, %.3f) m"
+                % (offset[0], offset[1])
+            )
+            return None
+        return float(offset[0]), float(offset[1])
+
+
+class DepthAlignment(object):
+    """
+    Aligns the tool with a servo target by one Cartesian motion to the depth
+    localized target, optionally refined by visual servoing, and logs the
+    time each step took.
+
+    Usage:
+        alignment = DepthAlignment(self.arm, "probe_action")
+        alignment.align(target_fn, target_pixel, servo_fn)
+    """
+
+    def __init__(self, arm, name: str, localizer=None):
+        """
+        input: arm: FullArmMovement
+               name: prefix of the log messages
+        """
+        params = rospy.get_param("~depth_localization", {})
+        self.arm = arm
+        self.name = name
+        self.enabled = params.get("enabled", False)
+        self.refine = params.get("refine", True)
+        self._localizer = localizer
+
+    @property
+    def localizer(self) -> DepthLocalizer:
+        if self._localizer is None:
+            self._localizer = get_depth_localizer()
+        return self._localizer
+
+    def move_to_target(self, target_fn: Callable, target_pixel) -> bool:
+        """
+        input: target_fn: servo target function, called once on the latest
+                          frame
+        output: True if the tool was moved onto the target
+        """
+        offset = self.localizer.tool_offset(target_pixel, target_fn())
+        if offset is None:
+            return False
+        pose = self.arm.get_current_pose()
+        pose.x += offset[0]
+        pose.y += offset[1]
+        return self.arm.send_cartesian_pose(pose)
+
+    def align(
+        self, target_fn: Callable, target_pixel, servo_fn: Callable
+    ) -> bool:
+        """
+        input: target_fn: servo target function without arguments
+               target_pixel: pixel (full image) the target is servoed to;
+                             None servos only
+               servo_fn: runs the visual servoing, returns a ServoResult
+        output: True if aligned
+        """
+        if not self.enabled or target_pixel is None:
+            return self._align(target_fn, None, servo_fn)
+        # one depth subscription for the whole alignment
+        with self.localizer.depth_hub.perception():
+            return self._align(target_fn, target_pixel, servo_fn)
+
+    def _align(
+        self, target_fn: Callable, target_pixel, servo_fn: Callable
+    ) -> bool:
+        start = time.monotonic()
+        moved = False
+        if target_pixel is not None:
+            moved = self.move_to_target(target_fn, target_pixel)
+        move_time = time.monotonic() - start
+        result = None
+        if not moved or self.refine:
+            result = servo_fn()
+        rospy.loginfo(
+            "[%s] alignment took %.2f s (depth move %s, servo %s)"
+            % (
+                self.name,
+                time.monotonic() - start,
+                "%.2f s" % move_time if moved else "not used",
+                "skipped"
+                if result is None
+                else "%.2f s, %d iterations"
+                % (result.time_to_converge, result.iterations),
+            )
+        )
+        return True if result is None else result.converged
+
+
+_depth_localizer: Optional[DepthLocalizer] = None
+
+
+def get_depth_localizer() -> DepthLocalizer:
+    """
+    Process-wide localizer configured from the ~depth_localization
+    parameter dict (see DepthLocalizer for the keys; "enabled" and
+    "refine" are read by the actions)
+    """
+    global _depth_localizer
+    if _depth_localizer is None:
+        params = dict(rospy.get_param("~depth_localization", {}))
+        params.pop("enabled", None)
+        params.pop("refine", None)
+        _depth_localizer = DepthLocalizer(**params)
+    return _depth_localizer
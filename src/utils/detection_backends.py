@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+# Inference backends for the YOLOv5 detection models.
+#
+# Every backend exposes detect(image, size=None) -> (N, 6) float32 array of
+# [x1, y1, x2, y2, confidence, class] rows in image pixel coordinates, sorted
+# by decreasing confidence, so callers do not depend on the torch results
+# object. size is the inference size (longest side); models exported with a
+# static input shape ignore it. The ONNX backends run models exported by
+# scripts/export_onnx_models.py; pre- and post-processing mirror what the
+# yolov5 AutoShape wrapper does for the torch models.
+
+import abc
+
+import cv2
+import numpy as np
+
+# backend name -> (class name, ONNX file suffix)
+BACKENDS = {
+    "torch": ("TorchDetector", None),
+    "onnxruntime": ("OnnxRuntimeDetector", ".onnx"),
+    "onnxruntime_int8": ("OnnxRuntimeDetector", "_int8.onnx"),
+    "opencv": ("OpenCvDnnDetector", ".onnx"),
+}
+
+# static input size (height, width) of the exported models; the 16:9 camera
+# frames letterboxed to 640 px width, as AutoShape does for size=640
+ONNX_INPUT_SHAPE = (384, 640)
+
+# letterbox padding value used by yolov5
+PAD_VALUE = (114, 114, 114)
+
+# network stride, input sizes are rounded up to a multiple of it
+STRIDE = 32
+
+# offset added to boxes per class so NMS is done per class
+_MAX_WH = 7680
+
+
+def letterbox(image, shape):
+    """
+    Resizes image to fit shape (height, width) keeping the aspect ratio and
+    pads the remainder
+
+    output: padded image, scale factor, (left, top) padding
+    """
+    h, w = image.shape[:2]
+    ratio = min(shape[0] / h, shape[1] / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    if (new_w, new_h) != (w, h):
+        image = cv2.resize(
+            image, (new_w, new_h), interpolation=cv2.INTER_LINEAR
+        )
+    dw = (shape[1] - new_w) / 2.0
+    dh = (shape[0] - new_h) / 2.0
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    image = cv2.copyMakeBorder(
+        image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=PAD_VALUE
+    )
+    return image, ratio, (left, top)
+
+
+def inference_shape(image_shape, size):
+    """
+    Network input shape (height, width) for an image scaled so that its
+    longest side is size, rounded up to the stride (as AutoShape does)
+    """
+    h, w = image_shape[:2]
+    gain = size / max(h, w)
+    return tuple(int(np.ceil(x * gain / STRIDE) * STRIDE) for x in (h, w))
+
+
+def non_max_suppression(
+    prediction,
+    conf_thres=0.25,
+    iou_thres=0.45,
+    agnostic=False,
+    max_det=1000,
+):
+    """
+    NMS on raw YOLOv5 output of shape (num_boxes, 5 + num_classes) with
+    [cx, cy, w, h, objectness, class scores...] rows
+
+    output: (N, 6) array of [x1, y1, x2, y2, confidence, class]
+    """
+    prediction = prediction[prediction[:, 4] > conf_thres]
+    if not len(prediction):
+        return np.zeros((0, 6), dtype=np.float32)
+    scores = prediction[:, 5:] * prediction[:, 4:5]
+    classes = scores.argmax(axis=1)
+    confidences = scores[np.arange(len(scores)), classes]
+    keep = confidences > conf_thres
+    prediction, classes, confidences = (
+        prediction[keep],
+        classes[keep],
+        confidences[keep],
+    )
+    if not len(prediction):
+        return np.zeros((0, 6), dtype=np.float32)
+
+    boxes = np.empty((len(prediction), 4), dtype=np.float32)
+    boxes[:, :2] = prediction[:, :2] - prediction[:, 2:4] / 2
+    boxes[:, 2:] = prediction[:, :2] + prediction[:, 2:4] / 2
+
+    offsets = 0 if agnostic else classes[:, None] * _MAX_WH
+    nms_boxes = boxes + offsets
+    # NMSBoxes expects (x, y, w, h)
+    nms_boxes[:, 2:] -= nms_boxes[:, :2]
+    indices = cv2.dnn.NMSBoxes(
+        nms_boxes.tolist(), confidences.tolist(), conf_thres, iou_thres
+    )
+    indices = np.array(indices, dtype=np.int64).reshape(-1)[:max_det]
+    return np.concatenate(
+        [
+            boxes[indices],
+            confidences[indices, None],
+            classes[indices, None].astype(np.float32),
+        ],
+        axis=1,
+    ).astype(np.float32)
+
+
+def box_iou(a, b):
+    x1 = max(a[0], b[0])
+    y1 = max(a[1], b[1])
+    x2 = min(a[2], b[2])
+    y2 = min(a[3], b[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1])
+    return intersection / (union - intersection + 1e-9)
+
+
+def detections_match(reference, detections, iou_threshold):
+    """
+    True if every reference detection has a detection of the same class
+    with IoU above iou_threshold and the number of detections is equal
+    """
+    if len(reference) != len(detections):
+        return False
+    for ref in reference:
+        ious = [
+            box_iou(ref, det) for det in detections if det[5] == ref[5]
+        ]
+        if not ious or max(ious) < iou_threshold:
+            return False
+    return True
+
+
+class TorchDetector(object):
+    """
+    The yolov5 PyTorch model, as used before the ONNX backends
+    """
+
+    def __init__(self, model, size=640):
+        self.model = model
+        self.size = size
+
+    def detect(self, image, size=None):
+        results = self.model(image, size=size or self.size)
+        return results.pred[0].cpu().numpy().astype(np.float32)
+
+
+class _OnnxDetector(abc.ABC):
+    def __init__(
+        self,
+        conf=0.25,
+        iou=0.45,
+        agnostic=False,
+        max_det=1000,
+        input_shape=ONNX_INPUT_SHAPE,
+        size=640,
+    ):
+        """
+        input_shape: static network input (height, width), None if the model
+                     was exported with dynamic axes
+        size: default inference size for dynamic models
+        """
+        self.conf = conf
+        self.iou = iou
+        self.agnostic = agnostic
+        self.max_det = max_det
+        self.input_shape = input_shape
+        self.size = size
+
+    @abc.abstractmethod
+    def forward(self, blob):
+        """
+        output: raw network output for the NCHW blob
+        """
+
+    def detect(self, image, size=None):
+        shape = self.input_shape
+        if shape is None:
+            shape = inference_shape(image.shape, size or self.size)
+        padded, ratio, (left, top) = letterbox(image, shape)
+        # same input as AutoShape: channels as given, scaled to [0, 1], NCHW
+        blob = cv2.dnn.blobFromImage(padded, 1.0 / 255.0)
+        prediction = self.forward(blob)
+        prediction = prediction.reshape(-1, prediction.shape[-1])
+        detections = non_max_suppression(
+            prediction, self.conf, self.iou, self.agnostic, self.max_det
+        )
+        detections[:, [0, 2]] = (detections[:, [0, 2]] - left) / ratio
+        detections[:, [1, 3]] = (detections[:, [1, 3]] - top) / ratio
+        detections[:, [0, 2]] = detections[:, [0, 2]].clip(0, image.shape[1])
+        detections[:, [1, 3]] = detections[:, [1, 3]].clip(0, image.shape[0])
+        return detections
+
+
+class OnnxRuntimeDetector(_OnnxDetector):
+    def __init__(self, path, num_threads=0, **kwargs):
+        import onnxruntime
+
+        super().__init__(**kwargs)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        if not all(isinstance(d, int) for d in model_input.shape[2:]):
+            # exported with dynamic height and width
+            self.input_shape = None
+
+    def forward(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenCvDnnDetector(_OnnxDetector):
+    """
+    Runs on the OpenCV thread pool, which is shared by the whole process; it
+    is not resized here
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.net = cv2.dnn.readNetFromONNX(path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def forward(self, blob):
+        self.net.setInput(blob)
+        return self.net.forward()
+
+
+def onnx_path(model_path, backend):
+    """
+    Path of the exported ONNX file for a .pt model and backend
+    """
+    suffix = BACKENDS[backend][1]
+    if suffix is None:
+        return model_path
+    return model_path.rsplit(".", 1)[0] + suffix
+
+
+def create_detector(model_path, backend="torch", model_params=None, **kwargs):
+    """
+    Creates a detector for the .pt model at model_path
+
+    input: model_path: path of the yolov5 .pt weights
+           backend: one of BACKENDS
+           model_params: NMS parameters (conf, iou, agnostic, max_det, ...)
+    """
+    if backend not in BACKENDS:
+        raise ValueError(
+            "unknown detection backend '%s', expected one of %s"
+            % (backend, ", ".join(sorted(BACKENDS)))
+        )
+    model_params = dict(model_params or {})
+    if backend == "torch":
+        import yolov5
+
+        model = yolov5.load(model_path)
+        for key, value in model_params.items():
+            setattr(model, key, value)
+        return TorchDetector(model, **kwargs)
+
+    model_params.pop("multi_label", None)
+    cls = globals()[BACKENDS[backend][0]]
+    return cls(onnx_path(model_path, backend), **model_params, **kwargs)
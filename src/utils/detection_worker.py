@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# Runs a detection function on a background thread, decoupled from the
+# visual servoing loop.
+#
+# The worker waits for a frame newer than the one it last processed, runs the
+# detection function with that frame pinned (see FrameHub.pin) and stores the
+# result with its stamp. The
+# servo loop reads the latest result without blocking and uses its age to
+# decide whether it is still usable.
+
+import threading
+from collections import namedtuple
+from typing import Callable, Optional
+
+import rospy
+
+from utils.frame_hub import FrameHub, get_frame_hub
+
+# stamp: stamp of the frame the detection ran on
+# value: return value of the detection function, e.g. (error_x, error_y)
+# duration: time the detection took, in seconds
+DetectionResult = namedtuple("DetectionResult", ["stamp", "value", "duration"])
+
+
+class DetectionWorker(object):
+    """
+    Usage:
+        with DetectionWorker(self.get_door_knob_error_2) as worker:
+            while ...:
+                error_x, error_y = worker.latest_value(0.5, (None, None))
+    """
+
+    def __init__(
+        self,
+        detect_fn: Callable,
+        frame_hub: Optional[FrameHub] = None,
+        name: str = "detection_worker",
+    ):
+        self.detect_fn = detect_fn
+        self.frame_hub = frame_hub or get_frame_hub()
+        self.name = name
+        self._lock = threading.Lock()
+        self._result: Optional[DetectionResult] = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.num_detections = 0
+
+    def start(self):
+        self.frame_hub.activate()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=self.name, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.frame_hub.deactivate()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self):
+        last_stamp = None
+        while not self._stop.is_set() and not rospy.is_shutdown():
+            if not self.frame_hub.wait_for_frame(
+                timeout=0.1, newer_than=last_stamp
+            ):
+                continue
+            start = rospy.get_time()
+            # the detection reads the frame itself, pin the message so that
+            # the frame and the stamp belong together
+            with self.frame_hub.pin() as msg:
+                if msg is None:
+                    continue
+                stamp = msg.header.stamp
+                try:
+                    value = self.detect_fn()
+                except Exception as e:
+                    rospy.logerr_throttle(
+                        1.0, "[%s] detection failed: %s" % (self.name, e)
+                    )
+                    value = None
+            result = DetectionResult(stamp, value, rospy.get_time() - start)
+            with self._lock:
+                self._result = result
+                self.num_detections += 1
+            last_stamp = stamp
+
+    def latest(self) -> Optional[DetectionResult]:
+        """
+        Latest detection result, None until the first detection finished
+        """
+        with self._lock:
+            return self._result
+
+    def age(self, result: DetectionResult) -> float:
+        """
+        Time in seconds since the frame of result was captured
+        """
+        return (rospy.Time.now() - result.stamp).to_sec()
+
+    def latest_fresh(self, max_age: float) -> Optional[DetectionResult]:
+        """
+        Latest result if its frame is at most max_age seconds old and the
+        detection did not fail, None otherwise
+        """
+        result = self.latest()
+        if result is None or result.value is None:
+            return None
+        if self.age(result) > max_age:
+            rospy.logwarn_throttle(
+                1.0,
+                "[%s] latest detection is %.2fs old"
+                % (self.name, self.age(result)),
+            )
+            return None
+        return result
+
+    def latest_value(self, max_age: float, default=None):
+        """
+        Value of the latest fresh result (see latest_fresh), default if
+        there is none
+        """
+        result = self.latest_fresh(max_age)
+        return default if result is None else result.value
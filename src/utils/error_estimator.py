@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+# Robust multi-frame estimate of the servo target error.
+#
+# Single-frame errors of the contour and YOLO detections are noisy by a few
+# pixels, which makes the servo loops hop in and out of the deadband. The
+# estimator keeps the per-frame errors of the last max_age seconds (at most
+# window of them) and combines them with a median, a trimmed mean or a
+# Kalman filter, after rejecting outliers. Every axis is combined over the
+# frames that measured it, so targets that only measure some axes (None for
+# the others) are estimated as well. Since the tool moves while the
+# samples are collected, every sample (and the Kalman state) is first moved
+# to the current tool pose by a correction function, normally the latency
+# compensation; without it, combining samples lags behind the motion by
+# about half the window, which is reported as added_latency.
+
+from collections import deque
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+# normalizes the median absolute deviation to the standard deviation
+_MAD_TO_STD = 1.4826
+
+
+def _to_sec(stamp) -> float:
+    return stamp.to_sec() if hasattr(stamp, "to_sec") else float(stamp)
+
+
+def _to_array(errors) -> np.ndarray:
+    """
+    Errors per axis with NaN for unmeasured (None) axes
+    """
+    return np.array(
+        [np.nan if e is None else e for e in errors], dtype=float
+    )
+
+
+def _to_list(errors: np.ndarray) -> list:
+    return [float(e) if np.isfinite(e) else None for e in errors]
+
+
+class ErrorEstimator(object):
+    """
+    Usage:
+        estimator = ErrorEstimator(method="median", window=5, max_age=0.5)
+        estimator.add(stamp, (error_x, error_y))
+        error_x, error_y = estimator.estimate(rospy.Time.now())
+    """
+
+    METHODS = ("median", "trimmed_mean", "kalman")
+
+    def __init__(
+        self,
+        method: str = "median",
+        window: int = 5,
+        max_age: float = 0.5,
+        outlier_threshold: float = 3.0,
+        min_spread: float = 2.0,
+        trim: float = 0.2,
+        process_noise: float = 20.0,
+        measurement_noise: float = 4.0,
+        max_rejections: int = 3,
+    ):
+        """
+        input: method: median, trimmed_mean or kalman
+               window: maximum number of frames combined
+               max_age: frames older than this (s) are dropped
+               outlier_threshold: samples further than this many standard
+                                  deviations (MAD based; innovation based for
+                                  kalman) from the estimate are rejected
+               min_spread: lower bound of the standard deviation (px), so
+                           consistent samples are never rejected
+               trim: fraction cut from each end for trimmed_mean
+               process_noise: kalman error variance growth (px^2 / s)
+               measurement_noise: kalman per-frame variance (px^2)
+               max_rejections: kalman restarts from the measurement after
+                               this many consecutive rejections
+        """
+        if method not in self.METHODS:
+            raise ValueError(
+                "unknown estimation method '%s', expected one of %s"
+                % (method, self.METHODS)
+            )
+        self.method = method
+        self.window = window
+        self.max_age = max_age
+        self.outlier_threshold = outlier_threshold
+        self.min_spread = min_spread
+        self.trim = trim
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.max_rejections = max_rejections
+        self.reset()
+
+    def reset(self):
+        self._samples = deque(maxlen=self.window)
+        # kalman state, referenced to the tool pose at _state_time
+        # per axis, NaN until the axis is measured
+        self._state = None
+        self._variance = None
+        self._state_time = None
+        self._last_update = None
+        self._rejections = None
+        self._gain = None
+        self._intervals = deque(maxlen=self.window)
+        self.added_latency = 0.0
+        # outliers rejected by the last estimate
+        self.num_rejected = 0
+
+    @property
+    def latest_stamp(self):
+        """
+        Capture stamp of the newest frame, None if there is none
+        """
+        return self._samples[-1][0] if self._samples else None
+
+    def add(self, stamp, errors: Sequence[Optional[float]]):
+        """
+        input: stamp: capture stamp of the frame (rospy.Time or seconds)
+               errors: per-frame error per axis, None for an axis the
+                       frame did not measure; frames without any measured
+                       axis and repeated stamps are ignored
+        """
+        if errors is None or all(e is None for e in errors):
+            return
+        if self._samples and self._samples[-1][0] == stamp:
+            return
+        if self._samples:
+            self._intervals.append(
+                _to_sec(stamp) - _to_sec(self._samples[-1][0])
+            )
+        self._samples.append((stamp, _to_array(errors)))
+
+    def estimate(
+        self, now, correct_fn: Optional[Callable] = None
+    ) -> Optional[list]:
+        """
+        input: now: current time (rospy.Time or seconds)
+               correct_fn: correct_fn(errors, stamp) returns the errors of
+                           a frame captured at stamp at the current pose
+        output: estimated error per axis (None for an axis no frame within
+                max_age measured), None if there is no frame within max_age
+        """
+        now_sec = _to_sec(now)
+        while (
+            self._samples
+            and now_sec - _to_sec(self._samples[0][0]) > self.max_age
+        ):
+            self._samples.popleft()
+        self.num_rejected = 0
+        if not self._samples:
+            return None
+        if self.method == "kalman":
+            return self._kalman_estimate(now, correct_fn)
+
+        stamps = np.array([_to_sec(s) for s, _ in self._samples])
+        errors = np.array(
+            [
+                e
+                if correct_fn is None
+                else _to_array(correct_fn(_to_list(e), s))
+                for s, e in self._samples
+            ],
+            dtype=float,
+        )
+        # every axis is combined over the frames that measured it
+        estimate = np.full(errors.shape[1], np.nan)
+        used = np.zeros(len(errors), dtype=bool)
+        for axis in range(errors.shape[1]):
+            measured = np.flatnonzero(np.isfinite(errors[:, axis]))
+            if len(measured) == 0:
+                continue
+            values = errors[measured, axis]
+            inliers = self._inliers(values)
+            self.num_rejected += int(np.sum(~inliers))
+            values = values[inliers]
+            used[measured[inliers]] = True
+            if self.method == "median":
+                estimate[axis] = np.median(values)
+            else:
+                estimate[axis] = self._trimmed_mean(values)
+        # stamp the combined samples effectively represent
+        stamps = stamps[used]
+        self.added_latency = float(stamps.max() - stamps.mean())
+        return _to_list(estimate)
+
+    def _inliers(self, values: np.ndarray) -> np.ndarray:
+        """
+        input: values: the measured errors of one axis
+        """
+        if len(values) < 3:
+            return np.ones(len(values), dtype=bool)
+        deviation = np.abs(values - np.median(values))
+        spread = max(_MAD_TO_STD * np.median(deviation), self.min_spread)
+        return deviation <= self.outlier_threshold * spread
+
+    def _trimmed_mean(self, values: np.ndarray) -> float:
+        cut = int(len(values) * self.trim)
+        values = np.sort(values)
+        return values[cut : len(values) - cut].mean()
+
+    def _kalman_update(self, measurement, stamp_sec):
+        """
+        Updates the axes measurement has a value for; the variance of the
+        other axes only grows
+        """
+        if self._state is None:
+            num_axes = len(measurement)
+            self._state = np.full(num_axes, np.nan)
+            self._variance = np.full(num_axes, np.nan)
+            self._rejections = np.zeros(num_axes, dtype=int)
+            self._gain = np.ones(num_axes)
+        dt = 0.0
+        if self._last_update is not None:
+            dt = max(0.0, stamp_sec - self._last_update)
+        variance = self._variance + self.process_noise * dt
+        measured = np.isfinite(measurement)
+
+        # axes measured for the first time start from the measurement
+        first = measured & ~np.isfinite(self._state)
+        self._state[first] = measurement[first]
+        variance[first] = self.measurement_noise
+        update = measured & ~first
+
+        innovation = measurement - self._state
+        limit = self.outlier_threshold * np.maximum(
+            np.sqrt(variance + self.measurement_noise), self.min_spread
+        )
+        outlier = update & (np.abs(innovation) > limit)
+        self.num_rejected += int(np.sum(outlier))
+        self._rejections[outlier] += 1
+        # the target moved, restart from the measurement
+        restart = outlier & (self._rejections >= self.max_rejections)
+        self._state[restart] = measurement[restart]
+        variance[restart] = self.measurement_noise
+        self._rejections[restart] = 0
+
+        accept = update & ~outlier
+        self._rejections[accept] = 0
+        gain = variance[accept] / (variance[accept] + self.measurement_noise)
+        self._gain[accept] = gain
+        self._state[accept] += gain * innovation[accept]
+        variance[accept] *= 1.0 - gain
+        self._variance = variance
+
+    def _kalman_estimate(self, now, correct_fn):
+        def correct(errors, stamp):
+            if correct_fn is None:
+                return errors
+            return _to_array(correct_fn(_to_list(errors), stamp))
+
+        if self._state is not None:
+            # move the state to the current tool pose
+            self._state = correct(self._state, self._state_time)
+        for stamp, errors in self._samples:
+            stamp_sec = _to_sec(stamp)
+            if self._last_update is not None:
+                if stamp_sec <= self._last_update:
+                    continue
+            self._kalman_update(correct(errors, stamp), stamp_sec)
+            self._last_update = stamp_sec
+        self._state_time = now
+        # lag of a first order filter: (1 - K) / K sample intervals
+        interval = np.mean(self._intervals) if self._intervals else 0.0
+        gain = max(float(np.min(self._gain)), 1e-3)
+        self.added_latency = float((1.0 - gain) / gain * interval)
+        return _to_list(self._state)
+
+
+def create_error_estimator(params=None) -> Optional[ErrorEstimator]:
+    """
+    ErrorEstimator configured from params (e.g. the ~error_estimator
+    parameter dict); None if disabled there
+    """
+    params = dict(params or {})
+    if not params.pop("enabled", True):
+        return None
+    return ErrorEstimator(**params)
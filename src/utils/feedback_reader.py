@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+
+# Lightweight reader for the kortex BaseCyclic_Feedback stream.
+#
+# The full message carries the base feedback, one ActuatorFeedback per joint
+# and the interconnect/gripper feedback, and genpy deserializes all of it in
+# Python for every subscriber at 1 kHz. Most consumers only need the tool pose
+# and the external wrench, so this reader subscribes with rospy.AnyMsg and
+# pulls the required fields out of the raw buffer with offsets computed once
+# from the message definitions.
+#
+# Processes that do not need the full 1 kHz stream can instead subscribe to
+# the decimated compact topic published by scripts/feedback_relay.py; use
+# feedback_subscriber() to pick the source based on /use_compact_feedback.
+
+import struct
+import threading
+from collections import namedtuple
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import roslib.message
+import rospy
+from kinova_apps.msg import CompactFeedback
+
+FEEDBACK_TOPIC = "/my_gen3/base_feedback"
+FEEDBACK_TYPE = "kortex_driver/BaseCyclic_Feedback"
+COMPACT_FEEDBACK_TOPIC = "/my_gen3/compact_feedback"
+
+TOOL_POSE_FIELDS = [
+    "tool_pose_x",
+    "tool_pose_y",
+    "tool_pose_z",
+    "tool_pose_theta_x",
+    "tool_pose_theta_y",
+    "tool_pose_theta_z",
+]
+COMMANDED_TOOL_POSE_FIELDS = ["commanded_" + f for f in TOOL_POSE_FIELDS]
+WRENCH_FIELDS = [
+    "tool_external_wrench_force_x",
+    "tool_external_wrench_force_y",
+    "tool_external_wrench_force_z",
+    "tool_external_wrench_torque_x",
+    "tool_external_wrench_torque_y",
+    "tool_external_wrench_torque_z",
+]
+
+# little-endian numpy formats for the ROS primitive types
+_PRIMITIVES = {
+    "bool": "u1",
+    "byte": "i1",
+    "char": "u1",
+    "int8": "i1",
+    "uint8": "u1",
+    "int16": "<i2",
+    "uint16": "<u2",
+    "int32": "<i4",
+    "uint32": "<u4",
+    "int64": "<i8",
+    "uint64": "<u8",
+    "float32": "<f4",
+    "float64": "<f8",
+    "time": "<u8",
+    "duration": "<i8",
+}
+
+_UINT32 = struct.Struct("<I")
+
+FeedbackSample = namedtuple(
+    "FeedbackSample",
+    [
+        "stamp",
+        "base",
+        "tool_pose",
+        "commanded_tool_pose",
+        "wrench",
+        "joint_angles",
+        "gripper_position",
+    ],
+)
+FeedbackSample.__doc__ = """
+Subset of a BaseCyclic_Feedback message.
+
+    stamp: receipt time (the feedback message has no header)
+    base: numpy record with every field of msg.base
+    tool_pose, commanded_tool_pose: [x, y, z, theta_x, theta_y, theta_z] (m, deg)
+    wrench: [fx, fy, fz, tx, ty, tz] external wrench at the tool
+    joint_angles: actuator positions in degrees (None if not requested)
+    gripper_position: first gripper motor position (None if not requested)
+"""
+
+
+def _split_type(slot_type: str):
+    """
+    Split a ROS slot type into (base_type, array_length).
+
+    array_length is None for scalars, -1 for variable length arrays
+    """
+    if not slot_type.endswith("]"):
+        return slot_type, None
+    base_type, length = slot_type[:-1].split("[")
+    return base_type, int(length) if length else -1
+
+
+def _message_class(msg_type: str):
+    msg_class = roslib.message.get_message_class(msg_type)
+    if msg_class is None:
+        raise ValueError("Unknown message type: %s" % msg_type)
+    return msg_class
+
+
+def _fixed_size(slot_type: str) -> Optional[int]:
+    """
+    Size in bytes of a serialized slot, or None if it has variable length
+    """
+    base_type, length = _split_type(slot_type)
+    if length == -1 or base_type == "string":
+        return None
+    if base_type in _PRIMITIVES:
+        size = np.dtype(_PRIMITIVES[base_type]).itemsize
+    else:
+        size = 0
+        for sub_type in _message_class(base_type)._slot_types:
+            sub_size = _fixed_size(sub_type)
+            if sub_size is None:
+                return None
+            size += sub_size
+    return size if length is None else size * length
+
+
+def _fixed_dtype(msg_type: str) -> np.dtype:
+    """
+    Structured dtype of a fixed size message with primitive fields only
+    """
+    msg_class = _message_class(msg_type)
+    names, formats, offsets = [], [], []
+    offset = 0
+    for name, slot_type in zip(msg_class.__slots__, msg_class._slot_types):
+        base_type, length = _split_type(slot_type)
+        if base_type not in _PRIMITIVES or length is not None:
+            raise ValueError(
+                "%s.%s is not a primitive field" % (msg_type, name)
+            )
+        names.append(name)
+        formats.append(_PRIMITIVES[base_type])
+        offsets.append(offset)
+        offset += np.dtype(_PRIMITIVES[base_type]).itemsize
+    return np.dtype(
+        {
+            "names": names,
+            "formats": formats,
+            "offsets": offsets,
+            "itemsize": offset,
+        }
+    )
+
+
+def _skip_ops(slot_type: str) -> List[tuple]:
+    """
+    Ops that advance the offset past one serialized slot of slot_type
+    """
+    size = _fixed_size(slot_type)
+    if size is not None:
+        return [("fixed", size)]
+    base_type, length = _split_type(slot_type)
+    if base_type == "string" and length is None:
+        return [("array", 1)]
+    if length is None:
+        ops = []
+        for sub_type in _message_class(base_type)._slot_types:
+            ops.extend(_skip_ops(sub_type))
+        return ops
+    elem_size = _fixed_size(base_type)
+    if elem_size is not None:
+        return [("array", elem_size)]
+    return [("array_var", _merge_ops(_skip_ops(base_type)))]
+
+
+def _merge_ops(ops: List[tuple]) -> List[tuple]:
+    merged = []
+    for op in ops:
+        if op[0] == "fixed" and merged and merged[-1][0] == "fixed":
+            merged[-1] = ("fixed", merged[-1][1] + op[1])
+        else:
+            merged.append(op)
+    return merged
+
+
+def compile_path(msg_type: str, path: Sequence) -> Tuple[List[tuple], str]:
+    """
+    Compile a field path into ops locating that field in a serialized message.
+
+    path: sequence of slot names and array indices,
+          e.g. ["interconnect", "oneof_tool_feedback", "gripper_feedback", 0]
+    returns: (ops, type of the located field)
+    """
+    ops = []
+    current_type = msg_type
+    path = list(path)
+    while path:
+        name = path.pop(0)
+        msg_class = _message_class(current_type)
+        if name not in msg_class.__slots__:
+            raise ValueError("%s has no field %s" % (current_type, name))
+        for slot, slot_type in zip(msg_class.__slots__, msg_class._slot_types):
+            if slot == name:
+                break
+            ops.extend(_skip_ops(slot_type))
+        base_type, length = _split_type(slot_type)
+        if length is not None:
+            if not path or not isinstance(path[0], int):
+                raise ValueError("Array field %s needs an index" % name)
+            index = path.pop(0)
+            ops.append(("enter", index, length, _fixed_size(base_type),
+                        _merge_ops(_skip_ops(base_type))))
+        current_type = base_type
+    return _merge_ops(ops), current_type
+
+
+def run_ops(buf, ops: List[tuple], offset: int = 0) -> Optional[int]:
+    """
+    Execute compiled ops on buf; returns the offset or None if an array
+    index is out of range
+    """
+    for op in ops:
+        kind = op[0]
+        if kind == "fixed":
+            offset += op[1]
+        elif kind == "array":
+            (count,) = _UINT32.unpack_from(buf, offset)
+            offset += 4 + count * op[1]
+        elif kind == "array_var":
+            (count,) = _UINT32.unpack_from(buf, offset)
+            offset += 4
+            for _ in range(count):
+                offset = run_ops(buf, op[1], offset)
+        else:  # enter
+            _, index, length, elem_size, elem_ops = op
+            if length == -1:
+                (count,) = _UINT32.unpack_from(buf, offset)
+                offset += 4
+            else:
+                count = length
+            if index >= count:
+                return None
+            if elem_size is not None:
+                offset += index * elem_size
+            else:
+                for _ in range(index):
+                    offset = run_ops(buf, elem_ops, offset)
+    return offset
+
+
+class BaseFeedbackReader(object):
+    """
+    Subscribes to the base feedback as rospy.AnyMsg and extracts only the
+    base feedback (and optionally joint angles and gripper position).
+
+    Usage:
+        reader = BaseFeedbackReader(callback=self.feedback_cb)
+        ...
+        def feedback_cb(self, sample):
+            force_z = sample.wrench[2]
+    """
+
+    def __init__(
+        self,
+        topic: str = FEEDBACK_TOPIC,
+        callback: Callable[[FeedbackSample], None] = None,
+        joint_angles: bool = False,
+        gripper_position: bool = False,
+        subscribe: bool = True,
+    ):
+        self.topic = topic
+        self.callback = callback
+        self.latest: Optional[FeedbackSample] = None
+        self._lock = threading.Lock()
+
+        feedback_class = _message_class(FEEDBACK_TYPE)
+        slots = feedback_class.__slots__
+        types = dict(zip(slots, feedback_class._slot_types))
+
+        # msg.base is the first field and has a fixed size, so every base field
+        # lives at a constant offset from the start of the buffer, followed by
+        # the actuators array
+        if list(slots[:2]) != ["base", "actuators"]:
+            raise ValueError("Unexpected %s layout" % FEEDBACK_TYPE)
+        self._base_dtype = _fixed_dtype(types["base"])
+        words = self._base_dtype.itemsize // 4
+        self._n_base_words = words
+        field_index = {
+            name: self._base_dtype.fields[name][1] // 4
+            for name in self._base_dtype.names
+        }
+        self._tool_pose_idx = [field_index[f] for f in TOOL_POSE_FIELDS]
+        self._commanded_pose_idx = [
+            field_index[f] for f in COMMANDED_TOOL_POSE_FIELDS
+        ]
+        self._wrench_idx = [field_index[f] for f in WRENCH_FIELDS]
+
+        self._actuator_dtype = None
+        if joint_angles:
+            actuator_type, _ = _split_type(types["actuators"])
+            full_dtype = _fixed_dtype(actuator_type)
+            self._actuator_dtype = np.dtype(
+                {
+                    "names": ["position"],
+                    "formats": ["<f4"],
+                    "offsets": [full_dtype.fields["position"][1]],
+                    "itemsize": full_dtype.itemsize,
+                }
+            )
+
+        self._gripper_ops = None
+        if gripper_position:
+            self._gripper_ops, _ = compile_path(
+                FEEDBACK_TYPE,
+                [
+                    "interconnect",
+                    "oneof_tool_feedback",
+                    "gripper_feedback",
+                    0,
+                    "motor",
+                    0,
+                    "position",
+                ],
+            )
+
+        self._sub = None
+        if subscribe:
+            self._sub = rospy.Subscriber(topic, rospy.AnyMsg, self._feedback_cb)
+
+    def parse(self, buf, stamp=None) -> FeedbackSample:
+        """
+        Extract the requested fields from a serialized BaseCyclic_Feedback
+        """
+        words = np.frombuffer(buf, dtype="<f4", count=self._n_base_words)
+        base = np.frombuffer(buf, dtype=self._base_dtype, count=1)[0]
+
+        joint_angles = None
+        if self._actuator_dtype is not None:
+            offset = self._base_dtype.itemsize
+            (count,) = _UINT32.unpack_from(buf, offset)
+            joint_angles = np.frombuffer(
+                buf, dtype=self._actuator_dtype, count=count, offset=offset + 4
+            )["position"]
+
+        gripper = None
+        if self._gripper_ops is not None:
+            offset = run_ops(buf, self._gripper_ops)
+            if offset is not None:
+                gripper = struct.unpack_from("<f", buf, offset)[0]
+
+        return FeedbackSample(
+            stamp=stamp,
+            base=base,
+            tool_pose=words[self._tool_pose_idx],
+            commanded_tool_pose=words[self._commanded_pose_idx],
+            wrench=words[self._wrench_idx],
+            joint_angles=joint_angles,
+            gripper_position=gripper,
+        )
+
+    def _feedback_cb(self, msg):
+        sample = self.parse(msg._buff, rospy.get_rostime())
+        with self._lock:
+            self.latest = sample
+        if self.callback is not None:
+            self.callback(sample)
+
+    def wait_for_sample(self, timeout: float = None) -> FeedbackSample:
+        """
+        Returns the next sample, like rospy.wait_for_message but without
+        deserializing the full message
+        """
+        msg = rospy.wait_for_message(self.topic, rospy.AnyMsg, timeout=timeout)
+        return self.parse(msg._buff, rospy.get_rostime())
+
+    def unregister(self):
+        if self._sub is not None:
+            self._sub.unregister()
+            self._sub = None
+
+
+class CompactFeedbackSubscriber(object):
+    """
+    Subscribes to the compact feedback published by feedback_relay.py and
+    delivers the same FeedbackSample as BaseFeedbackReader (base is None).
+    """
+
+    def __init__(
+        self,
+        topic: str = COMPACT_FEEDBACK_TOPIC,
+        callback: Callable[[FeedbackSample], None] = None,
+    ):
+        self.topic = topic
+        self.callback = callback
+        self.latest: Optional[FeedbackSample] = None
+        self._lock = threading.Lock()
+        self._sub = rospy.Subscriber(topic, CompactFeedback, self._feedback_cb)
+
+    @staticmethod
+    def to_sample(msg: CompactFeedback) -> FeedbackSample:
+        return FeedbackSample(
+            stamp=msg.header.stamp,
+            base=None,
+            tool_pose=np.array(msg.tool_pose, dtype=np.float32),
+            commanded_tool_pose=np.array(
+                msg.commanded_tool_pose, dtype=np.float32
+            ),
+            wrench=np.array(msg.wrench, dtype=np.float32),
+            joint_angles=np.array(msg.joint_angles, dtype=np.float32),
+            gripper_position=msg.gripper_position,
+        )
+
+    def _feedback_cb(self, msg):
+        sample = self.to_sample(msg)
+        with self._lock:
+            self.latest = sample
+        if self.callback is not None:
+            self.callback(sample)
+
+    def wait_for_sample(self, timeout: float = None) -> FeedbackSample:
+        msg = rospy.wait_for_message(self.topic, CompactFeedback, timeout=timeout)
+        return self.to_sample(msg)
+
+    def unregister(self):
+        if self._sub is not None:
+            self._sub.unregister()
+            self._sub = None
+
+
+def feedback_subscriber(
+    callback: Callable[[FeedbackSample], None] = None,
+    robot_name: str = "my_gen3",
+):
+    """
+    Subscribes to the arm feedback and calls callback with a FeedbackSample.
+
+    If the /use_compact_feedback parameter is set, the decimated compact topic
+    of feedback_relay.py is used instead of the full base feedback
+    """
+    if rospy.get_param("/use_compact_feedback", False):
+        return CompactFeedbackSubscriber(
+            "/" + robot_name + "/compact_feedback", callback=callback
+        )
+    return BaseFeedbackReader("/" + robot_name + "/base_feedback", callback=callback)
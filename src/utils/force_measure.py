@@ -18,6 +18,7 @@ import numpy as np
 
 from kortex_driver.srv import *
 from kortex_driver.msg import *
+from utils.feedback_reader import feedback_subscriber
 
 class ForceMeasurmement:
 
@@ -26,7 +27,7 @@ class ForceMeasurmement:
     """
 
     def __init__(self, force_threshold: list = [10,10, 10], topic_name: String = "None"):
-        self._force_subscriber = rospy.Subscriber("/my_gen3/base_feedback", kortex_driver.msg.BaseCyclic_Feedback, self._force_callback)
+        self._force_subscriber = feedback_subscriber(callback=self._force_callback)
         self.cartesian_velocity_pub = rospy.Publisher('/my_gen3/in/cartesian_velocity', TwistCommand, queue_size=1)
         self._force = {'x': [], 
                        'y': [], 
@@ -38,13 +39,13 @@ class ForceMeasurmement:
         self.force_limit_flag = False
         self.accumulated_force = None
 
-    def _force_callback(self, msg):
+    def _force_callback(self, sample):
 
-        self._force['x'].append(msg.base.tool_external_wrench_force_x)
-        self._force['y'].append(msg.base.tool_external_wrench_force_y)
-        self._force['z'].append(msg.base.tool_external_wrench_force_z)
+        self._force['x'].append(sample.wrench[0])
+        self._force['y'].append(sample.wrench[1])
+        self._force['z'].append(sample.wrench[2])
 
-        self._force['t_z'].append(msg.base.tool_external_wrench_torque_z)
+        self._force['t_z'].append(sample.wrench[5])
 
         if len(self._force['x']) > 15:
             self._force['x'].pop(0)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+# Process-wide access to the latest camera frame.
+#
+# The actions used to subscribe to the camera individually and convert every
+# frame with cv_bridge, even while idle. The hub keeps only the latest raw
+# message, decodes it when a consumer asks for a frame (once per stamp and
+# encoding), and only subscribes while at least one consumer is in a
+# perception phase. Frames are read-only views of the message or read-only
+# arrays decoded once per message and encoding (see utils.image_conversion)
+# that are never reused, so a frame stays valid as long as it is referenced.
+# A detector that reads the frame itself is run in a pin() block, so its
+# frame and the stamp its result is stored under come from the same message
+# even if a newer one arrives meanwhile.
+
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import numpy as np
+import rospy
+from sensor_msgs.msg import Image
+
+from utils.image_conversion import imgmsg_to_ndarray
+
+DEFAULT_IMAGE_TOPIC = "/camera/color/image_raw"
+
+
+class FrameHub(object):
+    """
+    Latest-frame cache for one image topic.
+
+    Usage:
+        hub = get_frame_hub()
+        with hub.perception():
+            image = hub.get_frame("bgr8")
+    """
+
+    def __init__(self, topic: str = DEFAULT_IMAGE_TOPIC):
+        self.topic = topic
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._msg: Optional[Image] = None
+        # encoding -> (message, decoded frame); a message is one stamp
+        self._decoded: Dict[str, tuple] = {}
+        self._sub = None
+        self._num_active = 0
+        # message pinned by the calling thread, see pin
+        self._pinned = threading.local()
+
+    def _image_cb(self, msg):
+        with self._lock:
+            self._msg = msg
+            self._new_frame.notify_all()
+
+    def activate(self):
+        """
+        Start a perception phase; subscribes to the camera if this is the
+        first active consumer
+        """
+        with self._lock:
+            self._num_active += 1
+            if self._sub is None:
+                self._sub = rospy.Subscriber(
+                    self.topic, Image, self._image_cb, queue_size=1
+                )
+
+    def deactivate(self):
+        """
+        End a perception phase; unsubscribes once no consumer is active so
+        idle frames are neither received nor decoded
+        """
+        with self._lock:
+            self._num_active = max(0, self._num_active - 1)
+            if self._num_active == 0 and self._sub is not None:
+                self._sub.unregister()
+                self._sub = None
+                # do not hand out a stale frame after resuming
+                self._msg = None
+                self._decoded.clear()
+
+    @contextmanager
+    def perception(self, wait: bool = True, timeout: float = 5.0):
+        """
+        Keeps the subscription active for the duration of the block and
+        optionally waits for the first frame
+        """
+        self.activate()
+        try:
+            if wait and not self.wait_for_frame(timeout):
+                rospy.logwarn(
+                    "[frame_hub] no image received on %s within %.1fs"
+                    % (self.topic, timeout)
+                )
+            yield self
+        finally:
+            self.deactivate()
+
+    @contextmanager
+    def pin(self, msg: Optional[Image] = None):
+        """
+        Within the block, latest_msg, latest_stamp and get_frame of the
+        calling thread return msg (the latest message by default) instead of
+        newer messages; yields msg, None if no frame has been received
+        """
+        if msg is None:
+            msg = self.latest_msg()
+        previous = getattr(self._pinned, "msg", None)
+        self._pinned.msg = msg
+        try:
+            yield msg
+        finally:
+            self._pinned.msg = previous
+
+    @property
+    def active(self) -> bool:
+        return self._num_active > 0
+
+    def wait_for_frame(self, timeout: float = 5.0, newer_than=None) -> bool:
+        """
+        Blocks until a frame (newer than the given stamp, if any) is available
+        """
+        deadline = rospy.get_time() + timeout
+        with self._lock:
+            while not rospy.is_shutdown():
+                if self._msg is not None and (
+                    newer_than is None or self._msg.header.stamp > newer_than
+                ):
+                    return True
+                remaining = deadline - rospy.get_time()
+                if remaining <= 0:
+                    return False
+                self._new_frame.wait(min(remaining, 0.1))
+        return False
+
+    def latest_msg(self) -> Optional[Image]:
+        pinned = getattr(self._pinned, "msg", None)
+        if pinned is not None:
+            return pinned
+        with self._lock:
+            return self._msg
+
+    def latest_stamp(self) -> Optional[rospy.Time]:
+        msg = self.latest_msg()
+        return None if msg is None else msg.header.stamp
+
+    def get_frame(
+        self, encoding: str = "bgr8", msg: Optional[Image] = None
+    ) -> Optional[np.ndarray]:
+        """
+        Returns the latest frame (or that of msg) decoded to encoding, or
+        None if no frame has been received; repeated calls for the same
+        stamp reuse the decoded frame, which is read-only and must be copied
+        before drawing on it
+        """
+        if msg is None:
+            msg = getattr(self._pinned, "msg", None)
+        with self._lock:
+            if msg is None:
+                msg = self._msg
+            cached = self._decoded.get(encoding)
+        if msg is None:
+            return None
+        if cached is not None and cached[0] is msg:
+            return cached[1]
+
+        frame = imgmsg_to_ndarray(msg, encoding)
+        with self._lock:
+            if self._msg is msg:
+                self._decoded[encoding] = (msg, frame)
+        return frame
+
+
+_hubs: Dict[str, FrameHub] = {}
+_hubs_lock = threading.Lock()
+
+
+def get_frame_hub(topic: str = DEFAULT_IMAGE_TOPIC) -> FrameHub:
+    """
+    Returns the process-wide hub for topic
+    """
+    with _hubs_lock:
+        if topic not in _hubs:
+            _hubs[topic] = FrameHub(topic)
+        return _hubs[topic]
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Multi-class HSV color segmentation in one lookup table pass.
+#
+# Every color class is one or more HSV boxes (lower / upper bounds per
+# channel, inclusive, as for cv2.inRange; e.g. red needs two boxes around the
+# hue wrap). A box is a product of per-channel intervals, so the 256^3 table
+# pixel -> boxes containing it factors into one 256 entry table per channel:
+# entry v of channel c has bit i set if box i contains v on channel c. One
+# cv2.LUT pass over the HSV image and two bitwise ands give every pixel the
+# bit set of the boxes containing it, from which all class masks follow.
+# The tables are compiled once and only rebuilt when the ranges change.
+# Given a dst, a mask is written into it and the intermediate images go to
+# scratch buffers of the calling thread, so a pipeline stage reusing its
+# buffer allocates nothing after the first frame.
+
+import threading
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+# the ranges of a class: {"lower": [h, s, v], "upper": [h, s, v]} or a list
+# of such boxes
+Ranges = Dict[str, object]
+
+
+def _boxes(ranges) -> List[tuple]:
+    if isinstance(ranges, dict):
+        ranges = [ranges]
+    return [(tuple(box["lower"]), tuple(box["upper"])) for box in ranges]
+
+
+class HsvClassifier(object):
+    """
+    Usage:
+        classifier = HsvClassifier(rospy.get_param("clutter/hsv_ranges"))
+        masks = classifier.masks(bgr_image)
+        red_mask = masks["red"]
+    """
+
+    def __init__(self, ranges: Optional[Ranges] = None):
+        """
+        input: ranges: class name -> box or list of boxes, in class order
+        """
+        self.classes = []
+        self._ranges = None
+        self._lut = None
+        self._class_bits = {}
+        # per thread: scratch buffer name -> image
+        self._scratch = threading.local()
+        self.update(ranges or {})
+
+    def update(self, ranges: Ranges) -> bool:
+        """
+        Sets the ranges, recompiling the tables only if they changed.
+        output: True if the tables were rebuilt
+        """
+        compiled = [(name, _boxes(boxes)) for name, boxes in ranges.items()]
+        if compiled == self._ranges:
+            return False
+        num_boxes = sum(len(boxes) for _, boxes in compiled)
+        if num_boxes > 31:
+            raise ValueError(
+                "at most 31 HSV boxes are supported, got %d" % num_boxes
+            )
+        if num_boxes <= 8:
+            dtype = np.uint8
+        elif num_boxes <= 16:
+            dtype = np.uint16
+        else:
+            dtype = np.int32
+
+        values = np.arange(256)
+        lut = np.zeros((256, 1, 3), dtype=dtype)
+        class_bits = {}
+        bit = 0
+        for name, boxes in compiled:
+            class_bits[name] = 0
+            for lower, upper in boxes:
+                for channel in range(3):
+                    inside = (values >= lower[channel]) & (
+                        values <= upper[channel]
+                    )
+                    lut[inside, 0, channel] |= dtype(1 << bit)
+                class_bits[name] |= 1 << bit
+                bit += 1
+
+        self.classes = [name for name, _ in compiled]
+        self._ranges = compiled
+        self._lut = lut
+        self._class_bits = class_bits
+        return True
+
+    def _buffer(self, name: str, fn, *args):
+        """
+        output: fn(*args, dst=buffer) with the thread's scratch buffer name,
+                which is reallocated by OpenCV when the size changes
+        """
+        buffers = self._scratch.__dict__
+        buffers[name] = fn(*args, dst=buffers.get(name))
+        return buffers[name]
+
+    def classify(
+        self,
+        image: np.ndarray,
+        hsv: bool = False,
+        dst: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        input: image: BGR image, or HSV image if hsv is True
+               dst: output buffer, a new array if None
+        output: per pixel bit set of the boxes containing it
+        """
+        if not hsv:
+            image = self._buffer(
+                "hsv", cv2.cvtColor, image, cv2.COLOR_BGR2HSV
+            )
+        table = self._buffer("table", cv2.LUT, image, self._lut)
+        h = self._buffer("h", cv2.extractChannel, table, 0)
+        s = self._buffer("s", cv2.extractChannel, table, 1)
+        v = self._buffer("v", cv2.extractChannel, table, 2)
+        hs = cv2.bitwise_and(h, s, dst=h)
+        return cv2.bitwise_and(hs, v, dst=dst)
+
+    def mask_from_codes(
+        self,
+        codes: np.ndarray,
+        name: str,
+        dst: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        input: dst: output buffer, a new array if None
+        output: 0 / 255 mask of class name, as returned by cv2.inRange
+        """
+        bits = self._buffer(
+            "bits", cv2.bitwise_and, codes, int(self._class_bits[name])
+        )
+        return cv2.compare(bits, 0, cv2.CMP_NE, dst=dst)
+
+    def masks(self, image: np.ndarray, hsv: bool = False) -> dict:
+        """
+        input: image: BGR image, or HSV image if hsv is True
+        output: class name -> 0 / 255 mask; classes may overlap
+        """
+        codes = self.classify(image, hsv)
+        return {
+            name: self.mask_from_codes(codes, name) for name in self.classes
+        }
+
+    def mask(
+        self,
+        image: np.ndarray,
+        name: str,
+        hsv: bool = False,
+        dst: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        input: dst: output buffer, a new array if None
+        output: 0 / 255 mask of class name
+        """
+        codes = self._buffer("codes", self.classify, image, hsv)
+        return self.mask_from_codes(codes, name, dst=dst)
+
+    def labels(self, image: np.ndarray, hsv: bool = False) -> np.ndarray:
+        """
+        output: label image, 0 for no class and i + 1 for classes[i]; the
+                first matching class wins where classes overlap
+        """
+        codes = self.classify(image, hsv)
+        labels = np.zeros(codes.shape, dtype=np.uint8)
+        for index in reversed(range(len(self.classes))):
+            mask = self.mask_from_codes(codes, self.classes[index])
+            labels[mask > 0] = index + 1
+        return labels
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# sensor_msgs/Image to numpy conversion without the copies made by cv_bridge.
+#
+# imgmsg_to_ndarray wraps msg.data with a strided view; the result is
+# read-only since msg.data is an immutable bytes object. Channel reordering
+# (e.g. rgb8 -> bgr8) is one cv2.cvtColor into a new array, which is made
+# read-only as well: decoded frames are shared between threads (see
+# FrameHub) and must never be written to. ndarray_to_imgmsg is the reverse
+# direction, used for the debug images.
+
+import cv2
+import numpy as np
+from sensor_msgs.msg import Image
+
+# encoding -> (dtype, channels)
+ENCODINGS = {
+    "rgb8": (np.uint8, 3),
+    "bgr8": (np.uint8, 3),
+    "rgba8": (np.uint8, 4),
+    "bgra8": (np.uint8, 4),
+    "mono8": (np.uint8, 1),
+    "mono16": (np.uint16, 1),
+    "8UC1": (np.uint8, 1),
+    "8UC3": (np.uint8, 3),
+    "8UC4": (np.uint8, 4),
+    "16UC1": (np.uint16, 1),
+    "32FC1": (np.float32, 1),
+}
+
+# (source encoding, desired encoding) -> cv2 color conversion code
+COLOR_CONVERSIONS = {
+    ("rgb8", "bgr8"): cv2.COLOR_RGB2BGR,
+    ("bgr8", "rgb8"): cv2.COLOR_BGR2RGB,
+    ("rgba8", "bgr8"): cv2.COLOR_RGBA2BGR,
+    ("bgra8", "bgr8"): cv2.COLOR_BGRA2BGR,
+    ("rgb8", "mono8"): cv2.COLOR_RGB2GRAY,
+    ("bgr8", "mono8"): cv2.COLOR_BGR2GRAY,
+    ("rgba8", "mono8"): cv2.COLOR_RGBA2GRAY,
+    ("bgra8", "mono8"): cv2.COLOR_BGRA2GRAY,
+    ("mono8", "bgr8"): cv2.COLOR_GRAY2BGR,
+    ("mono8", "rgb8"): cv2.COLOR_GRAY2RGB,
+}
+
+
+def _wrap(msg) -> np.ndarray:
+    """
+    Read-only view of msg.data with the message's row stride
+    """
+    if msg.encoding not in ENCODINGS:
+        raise ValueError("unsupported image encoding '%s'" % msg.encoding)
+    dtype, channels = ENCODINGS[msg.encoding]
+    dtype = np.dtype(dtype).newbyteorder(">" if msg.is_bigendian else "<")
+    data = msg.data
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data)
+    image = np.ndarray(
+        shape=(msg.height, msg.width, channels),
+        dtype=dtype,
+        buffer=data,
+        strides=(msg.step, channels * dtype.itemsize, dtype.itemsize),
+    )
+    if not dtype.isnative:
+        image = image.astype(dtype.newbyteorder("="))
+    if channels == 1:
+        image = image[:, :, 0]
+    image.flags.writeable = False
+    return image
+
+
+def imgmsg_to_ndarray(
+    msg, desired_encoding: str = "passthrough"
+) -> np.ndarray:
+    """
+    Converts a sensor_msgs/Image to a read-only numpy array
+
+    input: msg: sensor_msgs/Image
+           desired_encoding: "passthrough" or one of ENCODINGS
+    output: HxW or HxWxC array; a view on msg.data if no conversion is
+            needed, a new array otherwise
+    """
+    image = _wrap(msg)
+    if desired_encoding in ("passthrough", msg.encoding):
+        return image
+    code = COLOR_CONVERSIONS.get((msg.encoding, desired_encoding))
+    if code is None:
+        raise ValueError(
+            "cannot convert image from '%s' to '%s'"
+            % (msg.encoding, desired_encoding)
+        )
+    dtype, channels = ENCODINGS[desired_encoding]
+    shape = image.shape[:2] if channels == 1 else image.shape[:2] + (channels,)
+    out = np.empty(shape, dtype=dtype)
+    cv2.cvtColor(image, code, dst=out)
+    out.flags.writeable = False
+    return out
+
+
+def ndarray_to_imgmsg(image: np.ndarray, encoding: str, header=None) -> Image:
+    """
+    Converts a numpy array to a sensor_msgs/Image (one copy into msg.data)
+
+    input: image: HxW or HxWxC array matching encoding
+           encoding: one of ENCODINGS
+           header: std_msgs/Header to copy stamp and frame_id from
+    """
+    dtype, channels = ENCODINGS[encoding]
+    image = np.ascontiguousarray(image, dtype=dtype)
+    if (image.ndim == 2 and channels != 1) or (
+        image.ndim == 3 and image.shape[2] != channels
+    ):
+        raise ValueError(
+            "array of shape %s does not match encoding '%s'"
+            % (image.shape, encoding)
+        )
+    msg = Image()
+    if header is not None:
+        msg.header = header
+    msg.height, msg.width = image.shape[:2]
+    msg.encoding = encoding
+    msg.is_bigendian = 0
+    msg.step = image.strides[0]
+    msg.data = image.tobytes()
+    return msg
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# Process-wide registry of the YOLOv5 detection models.
+#
+# Models are resolved relative to the models/ directory of the kinova_apps
+# package, loaded at most once per process and backend (optionally on a
+# background thread while the arm is moving) and warmed up with dummy
+# inferences so the first visual servoing iteration runs at steady-state
+# speed. The inference backend of each model is selected with the
+# ~detection_backends parameter, see utils.detection_backends.
+
+import os
+import threading
+from typing import Dict
+
+import numpy as np
+import rospkg
+import rospy
+
+from utils.detection_backends import create_detector
+
+# model name -> path relative to the package models/ directory
+MODELS = {
+    "door_knob": "door_knob/door_knob_nano_ver1.pt",
+    "probe_holder_horizontal_v1": "probe_holder_horizontal/probe_holder_horizontal_nano_ver1.pt",
+    "probe_holder_horizontal_v2": "probe_holder_horizontal/probe_holder_horizontal_nano_ver2.pt",
+}
+
+# NMS parameters applied to every model after loading
+MODEL_PARAMS = {
+    "conf": 0.25,  # NMS confidence threshold
+    "iou": 0.45,  # NMS IoU threshold
+    "agnostic": False,  # NMS class-agnostic
+    "multi_label": False,  # NMS multiple labels per box
+    "max_det": 1000,  # maximum number of detections per image
+}
+
+# warm-up input, same shape as the camera frames used at run time
+WARMUP_IMAGE_SHAPE = (720, 1280, 3)
+WARMUP_ITERATIONS = 2
+
+
+def get_models_dir() -> str:
+    return os.path.join(rospkg.RosPack().get_path("kinova_apps"), "models")
+
+
+def get_model_path(name: str) -> str:
+    """
+    Absolute path of a registered model
+    """
+    if name not in MODELS:
+        raise KeyError(
+            "unknown model '%s', known models: %s"
+            % (name, ", ".join(sorted(MODELS)))
+        )
+    return os.path.join(get_models_dir(), MODELS[name])
+
+
+def warmup_detector(detector, iterations: int = WARMUP_ITERATIONS):
+    """
+    Runs dummy inferences so lazy initialization happens before the first
+    real frame
+    """
+    image = np.zeros(WARMUP_IMAGE_SHAPE, dtype=np.uint8)
+    for _ in range(iterations):
+        detector.detect(image)
+
+
+def get_backend(name: str) -> str:
+    """
+    Backend configured for model name in ~detection_backends, torch if unset
+    """
+    return rospy.get_param("~detection_backends", {}).get(name, "torch")
+
+
+class _ModelEntry(object):
+    def __init__(self):
+        self.detector = None
+        self.error = None
+        self.loaded = threading.Event()
+        self.thread = None
+
+
+class ModelRegistry(object):
+    """
+    Loads each model once per backend and hands out the shared detector.
+
+    Usage:
+        registry.preload("door_knob")         # returns immediately
+        ...
+        detector = registry.get("door_knob")  # blocks until loaded
+        detections = detector.detect(image)
+    """
+
+    def __init__(self, warmup_iterations: int = WARMUP_ITERATIONS):
+        self.warmup_iterations = warmup_iterations
+        self._lock = threading.Lock()
+        self._entries: Dict[tuple, _ModelEntry] = {}
+
+    def _entry(
+        self, name: str, backend: str, background: bool
+    ) -> _ModelEntry:
+        """
+        Returns the entry for (name, backend), starting the load if it is the
+        first request; loads synchronously unless background is set
+        """
+        with self._lock:
+            entry = self._entries.get((name, backend))
+            if entry is not None:
+                return entry
+            entry = _ModelEntry()
+            self._entries[(name, backend)] = entry
+            if background:
+                entry.thread = threading.Thread(
+                    target=self._load,
+                    args=(name, backend, entry),
+                    daemon=True,
+                )
+                entry.thread.start()
+                return entry
+        self._load(name, backend, entry)
+        return entry
+
+    def _load(self, name: str, backend: str, entry: _ModelEntry):
+        try:
+            start = rospy.get_time()
+            detector = create_detector(
+                get_model_path(name), backend, model_params=MODEL_PARAMS
+            )
+            loaded = rospy.get_time()
+            warmup_detector(detector, self.warmup_iterations)
+            rospy.loginfo(
+                "[model_registry] loaded %s (%s) in %.2fs, warm-up %.2fs"
+                % (name, backend, loaded - start, rospy.get_time() - loaded)
+            )
+            entry.detector = detector
+        except Exception as e:
+            rospy.logerr(
+                "[model_registry] failed to load %s (%s): %s"
+                % (name, backend, e)
+            )
+            entry.error = e
+        finally:
+            entry.loaded.set()
+
+    def preload(self, name: str, backend: str = None):
+        """
+        Starts loading name on a background thread if it is not loaded yet
+        """
+        self._entry(name, backend or get_backend(name), background=True)
+
+    def get(self, name: str, backend: str = None, timeout: float = None):
+        """
+        Returns the loaded detector, waiting for a background load if needed
+
+        Raises RuntimeError if loading failed or did not finish in time
+        """
+        backend = backend or get_backend(name)
+        entry = self._entry(name, backend, background=False)
+        if not entry.loaded.wait(timeout):
+            raise RuntimeError("timed out waiting for model '%s'" % name)
+        if entry.error is not None:
+            raise RuntimeError(
+                "model '%s' (%s) could not be loaded: %s"
+                % (name, backend, entry.error)
+            )
+        return entry.detector
+
+
+_registry = ModelRegistry()
+
+
+def preload_detector(name: str, backend: str = None):
+    _registry.preload(name, backend)
+
+
+def get_detector(name: str, backend: str = None, timeout: float = None):
+    return _registry.get(name, backend, timeout)
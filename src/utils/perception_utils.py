@@ -1,40 +1,29 @@
+import functools
+import threading
+
 import cv2
 import numpy as np
 
+from utils.pipeline import Pipeline, get_kernel
+
 def dilate(img, dilation_size=1):
-    dilation_shape = cv2.MORPH_RECT
-    element = cv2.getStructuringElement(dilation_shape, (2 * dilation_size + 1, 2 * dilation_size + 1),
-                                       (dilation_size, dilation_size))
-    img = cv2.dilate(img, element)
-    return img
+    return cv2.dilate(img, get_kernel(2 * dilation_size + 1))
 
 def erode(img, erosion_size=1):
-    erosion_shape = cv2.MORPH_RECT
-    element = cv2.getStructuringElement(erosion_shape, (2 * erosion_size + 1, 2 * erosion_size + 1),
-                                       (erosion_size, erosion_size))
-    img = cv2.erode(img, element)
-    return img
+    return cv2.erode(img, get_kernel(2 * erosion_size + 1))
 
 def get_uppermost_contour(img):
-    contours, hierarchy = cv2.findContours(img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if len(contours) == 0:
+    """
+    Centroid (x, y) of the uppermost blob of a binary mask larger than 10
+    pixels, (None, None) if there is none
+    """
+    blobs = blob_stats(img)
+    blobs = blobs[blobs["area"] > 10]
+    if len(blobs) == 0:
         print('no contours')
         return None, None
-    lowest_y = img.shape[0]
-    selected_cx = 0
-    selected_cy = 0
-    idx = 0
-    for idx, contour in enumerate(contours):
-        M = cv2.moments(contour)
-        if M["m00"] > 0:
-            cX = int(M["m10"] / M["m00"])
-            cY = int(M["m01"] / M["m00"])
-            if cY < lowest_y and cv2.contourArea(contour) > 10:
-                lowest_y = cY
-                selected_cx = cX
-                selected_cy = cY
-                sidx = idx
-    return selected_cx, selected_cy
+    uppermost = blobs[np.argmin(blobs["cy"])]
+    return int(uppermost["cx"]), int(uppermost["cy"])
 
 def get_contours(img):
     contours, hierarchy = cv2.findContours(img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -50,3 +39,303 @@ def detect_door_circle(img):
         return detected_circles[0]
     else:
         return None
+
+
+def door_edges_pipeline():
+    """
+    Pipeline of the edge image of a BGR door image, as used by the door
+    circle detection
+    """
+    return (
+        Pipeline("door_edges")
+        .gray()
+        .blur(3)
+        .canny(80, 200)
+        .dilate(3)
+        .erode(3)
+    )
+
+
+_door_edges_pipeline = door_edges_pipeline()
+_door_edges_lock = threading.Lock()
+
+
+def door_edges(image):
+    """
+    Edge image of a BGR door image, as used by the door circle detection; a
+    copy, detectors running every frame keep their own door_edges_pipeline
+    """
+    with _door_edges_lock:
+        return _door_edges_pipeline.run(image).copy()
+
+
+# Fast door circle localization.
+#
+# detect_door_circle fills all contours into a full-size image and runs
+# HoughCircles over the whole frame. find_door_circle first scores every
+# contour of a plausible size directly: the minimum enclosing circle gives
+# the center and radius, the fitted ellipse the roundness, and the fraction
+# of angular bins covered by contour points on the circle how complete the
+# outline is. Only if no contour scores high enough does it fall back to the
+# Hough transform, on a pyramid-downscaled window around the previous circle
+# (or the whole image without one); if the window has no circle, the whole
+# image is searched, so a wrong or outdated prior cannot hide the circle.
+
+# number of angular bins of the outline coverage
+_COVERAGE_BINS = 16
+
+
+def _score_circle(contour, min_radius, max_radius, tolerance):
+    """
+    output: ((cx, cy, r), score in [0, 1]) of the contour as a circle, None
+            if its enclosing circle is not within the radius range
+    """
+    if len(contour) < 5:
+        return None
+    (cx, cy), r = cv2.minEnclosingCircle(contour)
+    if not min_radius <= r <= max_radius:
+        return None
+    _, axes, _ = cv2.fitEllipse(contour)
+    roundness = min(axes) / max(max(axes), 1e-6)
+    points = contour.reshape(-1, 2).astype(np.float64) - (cx, cy)
+    distance = np.hypot(points[:, 0], points[:, 1])
+    on_circle = np.abs(distance - r) < tolerance * r
+    angles = np.arctan2(points[on_circle, 1], points[on_circle, 0])
+    bins = ((angles + np.pi) * _COVERAGE_BINS / (2 * np.pi)).astype(int)
+    coverage = len(np.unique(np.minimum(bins, _COVERAGE_BINS - 1)))
+    return (cx, cy, r), roundness * coverage / _COVERAGE_BINS
+
+
+def _hough_door_circles(
+    img, contours, min_radius, max_radius, roi, pyramid_levels
+):
+    x0, y0, x1, y1 = roi
+    plain_img = np.full((y1 - y0, x1 - x0), 255, dtype=np.uint8)
+    cv2.drawContours(plain_img, contours, -1, 0, -1, offset=(-x0, -y0))
+    for _ in range(pyramid_levels):
+        plain_img = cv2.pyrDown(plain_img)
+    scale = 2**pyramid_levels
+    detected_circles = cv2.HoughCircles(
+        plain_img,
+        cv2.HOUGH_GRADIENT,
+        1,
+        60 / scale,
+        param1=70,
+        param2=max(20 / scale, 5),
+        minRadius=int(min_radius / scale),
+        maxRadius=int(np.ceil(max_radius / scale)),
+    )
+    if detected_circles is None:
+        return None
+    circles = detected_circles[0] * scale
+    circles[:, 0] += x0
+    circles[:, 1] += y0
+    return circles
+
+
+def find_door_circle(
+    img,
+    prior=None,
+    min_radius=50,
+    max_radius=70,
+    min_score=0.7,
+    tolerance=0.1,
+    pyramid_levels=1,
+):
+    """
+    input: img: edge image (see door_edges)
+           prior: (x, y, r) of the circle in the previous frame, or None;
+                  the whole image is searched if there is no circle near it
+           min_score: lowest contour score accepted without Hough fallback
+           tolerance: relative distance from the circle of outline points
+           pyramid_levels: downscaling of the Hough fallback
+    output: (N, 3) float array of x, y, r like detect_door_circle (one row
+            from the contour path), None if no circle was found
+    """
+    contours = get_contours(img)
+    best, best_score = None, min_score
+    for contour in contours:
+        scored = _score_circle(contour, min_radius, max_radius, tolerance)
+        if scored is not None and scored[1] >= best_score:
+            best, best_score = scored
+    if best is not None:
+        return np.array([best], dtype=np.float32)
+
+    height, width = img.shape[:2]
+    if prior is None:
+        roi = (0, 0, width, height)
+    else:
+        margin = 2 * max_radius
+        roi = (
+            max(0, int(prior[0] - margin)),
+            max(0, int(prior[1] - margin)),
+            min(width, int(prior[0] + margin)),
+            min(height, int(prior[1] + margin)),
+        )
+        if roi[2] <= roi[0] or roi[3] <= roi[1]:
+            roi = (0, 0, width, height)
+    circles = _hough_door_circles(
+        img, contours, min_radius, max_radius, roi, pyramid_levels
+    )
+    if circles is None and roi != (0, 0, width, height):
+        circles = _hough_door_circles(
+            img,
+            contours,
+            min_radius,
+            max_radius,
+            (0, 0, width, height),
+            pyramid_levels,
+        )
+    return circles
+
+
+# Blob analytics on label images.
+#
+# All statistics are computed for every blob at once with np.bincount over a
+# label image, so the cost is one pass over the frame regardless of the
+# number of candidates (no full-frame mask per contour). The results are
+# numpy struct arrays of BLOB_DTYPE that can be filtered with boolean
+# indexing, e.g. blobs[(blobs["area"] > 3000) & (blobs["circularity"] > 0.8)].
+
+BLOB_DTYPE = np.dtype(
+    [
+        ("label", np.int32),  # label in the label image (contour index + 1)
+        ("area", np.float64),  # pixels
+        ("cx", np.float64),  # centroid
+        ("cy", np.float64),
+        ("x", np.int32),  # bounding box
+        ("y", np.int32),
+        ("w", np.int32),
+        ("h", np.int32),
+        ("perimeter", np.float64),
+        ("circularity", np.float64),  # 4 * pi * area / perimeter^2
+        ("mean_color", np.float64, (3,)),  # per channel, 0 without image
+    ]
+)
+
+# (row shift, column shift, line spacing) of the Crofton perimeter estimate
+_CROFTON_DIRECTIONS = (
+    (0, 1, 1.0),
+    (1, 0, 1.0),
+    (1, 1, 1.0 / np.sqrt(2.0)),
+    (1, -1, 1.0 / np.sqrt(2.0)),
+)
+
+
+def _crofton_perimeter(labels, num_labels):
+    """
+    Perimeter per label from the number of label changes along 4 directions
+    (Cauchy-Crofton formula); exact on average for disks, about 5% short for
+    axis-aligned squares
+    """
+    padded = np.pad(labels, 1)
+    height, width = labels.shape
+    perimeter = np.zeros(num_labels)
+    for dy, dx, spacing in _CROFTON_DIRECTIONS:
+        a = padded[1 : height + 2, max(0, -dx) : width + 2 - max(0, dx)]
+        b = padded[
+            1 - dy : height + 2 - dy, max(0, dx) : width + 2 - max(0, -dx)
+        ]
+        changed = a != b
+        crossings = np.bincount(a[changed], minlength=num_labels)
+        crossings += np.bincount(b[changed], minlength=num_labels)
+        perimeter += crossings[:num_labels] * spacing
+    return perimeter * np.pi / 8.0
+
+
+@functools.lru_cache(maxsize=4)
+def _pixel_coordinates(shape):
+    """
+    Flattened column and row index of every pixel, cached per image shape
+    """
+    rows, cols = np.indices(shape, dtype=np.float64)
+    return cols.ravel(), rows.ravel()
+
+
+def _mean_colors(labels, num_labels, counts, image):
+    means = np.zeros((num_labels, 3))
+    if image is None:
+        return means
+    flat_labels = labels.ravel()
+    channels = image.reshape(-1, image.shape[2] if image.ndim == 3 else 1)
+    for c in range(min(3, channels.shape[1])):
+        sums = np.bincount(
+            flat_labels, weights=channels[:, c], minlength=num_labels
+        )
+        means[:, c] = sums[:num_labels] / np.maximum(counts, 1)
+    return means
+
+
+def blob_stats(mask, image=None, connectivity=8):
+    """
+    Statistics of the connected components of a binary mask.
+
+    input: mask: uint8 mask, non-zero pixels are foreground
+           image: optional image (same size) for the mean colors
+    output: struct array of BLOB_DTYPE, one entry per blob (background
+            excluded); the perimeter is a Crofton estimate
+    """
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(
+        mask, connectivity=connectivity, ltype=cv2.CV_32S
+    )
+    blobs = np.zeros(num_labels, dtype=BLOB_DTYPE)
+    blobs["label"] = np.arange(num_labels)
+    blobs["area"] = stats[:, cv2.CC_STAT_AREA]
+    blobs["cx"] = centroids[:, 0]
+    blobs["cy"] = centroids[:, 1]
+    blobs["x"] = stats[:, cv2.CC_STAT_LEFT]
+    blobs["y"] = stats[:, cv2.CC_STAT_TOP]
+    blobs["w"] = stats[:, cv2.CC_STAT_WIDTH]
+    blobs["h"] = stats[:, cv2.CC_STAT_HEIGHT]
+    blobs["perimeter"] = _crofton_perimeter(labels, num_labels)
+    blobs["mean_color"] = _mean_colors(
+        labels, num_labels, blobs["area"], image
+    )
+    blobs = blobs[1:]
+    blobs["circularity"] = (
+        4 * np.pi * blobs["area"] / np.maximum(blobs["perimeter"], 1e-6) ** 2
+    )
+    return blobs
+
+
+def contour_stats(contours, shape, image=None):
+    """
+    Statistics of filled contours, e.g. from cv2.findContours with
+    RETR_EXTERNAL; the contours are rasterized into one label image.
+
+    input: contours: list of contours
+           shape: image shape (height, width)
+           image: optional image for the mean colors
+    output: struct array of BLOB_DTYPE in contour order (label = index + 1);
+            area and perimeter are those of the contour polygon
+            (cv2.contourArea / cv2.arcLength), so the circularity matches
+            the per-contour computation, the centroid and mean colors are
+            over the filled pixels
+    """
+    num_labels = len(contours) + 1
+    labels = np.zeros(shape[:2], dtype=np.int32)
+    for i, contour in enumerate(contours):
+        cv2.drawContours(labels, contours, i, i + 1, -1)
+
+    flat_labels = labels.ravel()
+    counts = np.bincount(flat_labels, minlength=num_labels)
+    cols, rows = _pixel_coordinates(labels.shape)
+    sum_x = np.bincount(flat_labels, weights=cols, minlength=num_labels)
+    sum_y = np.bincount(flat_labels, weights=rows, minlength=num_labels)
+
+    blobs = np.zeros(num_labels, dtype=BLOB_DTYPE)
+    blobs["label"] = np.arange(num_labels)
+    blobs["cx"] = sum_x / np.maximum(counts, 1)
+    blobs["cy"] = sum_y / np.maximum(counts, 1)
+    blobs["mean_color"] = _mean_colors(labels, num_labels, counts, image)
+    blobs = blobs[1:]
+    if len(contours):
+        boxes = np.array([cv2.boundingRect(c) for c in contours])
+        blobs["x"], blobs["y"] = boxes[:, 0], boxes[:, 1]
+        blobs["w"], blobs["h"] = boxes[:, 2], boxes[:, 3]
+        blobs["area"] = [cv2.contourArea(c) for c in contours]
+        blobs["perimeter"] = [cv2.arcLength(c, True) for c in contours]
+    blobs["circularity"] = (
+        4 * np.pi * blobs["area"] / np.maximum(blobs["perimeter"], 1e-6) ** 2
+    )
+    return blobs
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+# Image preprocessing pipelines with reused buffers and per-stage timing.
+#
+# The detectors ran their gray / blur / threshold / Canny / morphology chain
+# with fresh output arrays on every frame and rebuilt their kernels and CLAHE
+# objects on every call. A Pipeline declares the chain once: every stage
+# writes into its own dst buffer, which OpenCV reuses as long as the input
+# (the ROI) keeps its size, so after the first frame the chain allocates
+# nothing; a custom stage such as the HsvClassifier mask of mask_pipeline
+# has to write into its dst as well. Kernels are shared through get_kernel,
+# CLAHE instances are created with their stage. The duration of every stage
+# is accumulated for stats(). Detectors crop their ROI (a view) before the
+# first stage, so the colour conversion only touches the ROI.
+#
+# The returned image (and every stage output) is a buffer of the pipeline
+# that the next run overwrites: copy it to keep it, and use one pipeline per
+# detector and thread.
+
+import functools
+import time
+from typing import Callable, Sequence
+
+import cv2
+import numpy as np
+
+
+@functools.lru_cache(maxsize=None)
+def get_kernel(size: int, shape: int = cv2.MORPH_RECT) -> np.ndarray:
+    """
+    Structuring element of size x size, created once (read-only)
+    """
+    kernel = cv2.getStructuringElement(shape, (size, size))
+    kernel.setflags(write=False)
+    return kernel
+
+
+class Pipeline(object):
+    """
+    Usage:
+        pipeline = (
+            Pipeline("black_port")
+            .gray()
+            .clahe(3.0, (15, 15))
+            .blur(5)
+            .threshold(0, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            .canny(50, 150)
+        )
+        edges = pipeline.run(image[min_y:max_y, min_x:max_x])
+        rospy.loginfo(pipeline.stats())
+    """
+
+    def __init__(self, name: str = "pipeline"):
+        self.name = name
+        # (name, fn(src, dst) -> output, in_place)
+        self._stages = []
+        self._buffers = []
+        # stage name -> [runs, total s, max s]
+        self._timings = {}
+        self.outputs = {}
+
+    def __len__(self):
+        return len(self._stages)
+
+    def stage(self, name: str, fn: Callable, in_place: bool = False):
+        """
+        Appends a stage
+        input: fn: fn(src, dst) -> output; dst is the buffer of the previous
+                   run (None at first), to be passed as dst to OpenCV
+               in_place: fn(src) modifies src, a buffer of the previous
+                         stage, and has no buffer of its own
+        """
+        unique, index = name, 1
+        while unique in self._timings:
+            index += 1
+            unique = "%s_%d" % (name, index)
+        if in_place:
+            self._stages.append((unique, lambda src, dst: fn(src), True))
+        else:
+            self._stages.append((unique, fn, False))
+        self._buffers.append(None)
+        self._timings[unique] = [0, 0.0, 0.0]
+        return self
+
+    def gray(self):
+        return self.stage(
+            "gray",
+            lambda src, dst: cv2.cvtColor(src, cv2.COLOR_BGR2GRAY, dst=dst),
+        )
+
+    def hsv(self):
+        return self.stage(
+            "hsv",
+            lambda src, dst: cv2.cvtColor(src, cv2.COLOR_BGR2HSV, dst=dst),
+        )
+
+    def clahe(self, clip_limit: float, tile_grid_size: Sequence[int]):
+        clahe = cv2.createCLAHE(
+            clipLimit=clip_limit, tileGridSize=tuple(tile_grid_size)
+        )
+        return self.stage("clahe", lambda src, dst: clahe.apply(src, dst=dst))
+
+    def blur(self, ksize: int, sigma: float = 0):
+        return self.stage(
+            "blur",
+            lambda src, dst: cv2.GaussianBlur(
+                src, (ksize, ksize), sigma, dst=dst
+            ),
+        )
+
+    def threshold(self, thresh: float, type: int, maxval: float = 255):
+        def threshold(src, dst):
+            _, dst = cv2.threshold(src, thresh, maxval, type, dst=dst)
+            return dst
+
+        return self.stage("threshold", threshold)
+
+    def adaptive_threshold(
+        self,
+        method: int,
+        type: int,
+        block_size: int,
+        C: float,
+        maxval: float = 255,
+    ):
+        return self.stage(
+            "adaptive_threshold",
+            lambda src, dst: cv2.adaptiveThreshold(
+                src, maxval, method, type, block_size, C, dst=dst
+            ),
+        )
+
+    def box_blur(self, ksize: int):
+        return self.stage(
+            "box_blur",
+            lambda src, dst: cv2.blur(src, (ksize, ksize), dst=dst),
+        )
+
+    def canny(self, threshold1: float, threshold2: float):
+        return self.stage(
+            "canny",
+            lambda src, dst: cv2.Canny(
+                src, threshold1, threshold2, edges=dst
+            ),
+        )
+
+    def invert(self):
+        return self.stage(
+            "invert", lambda src, dst: cv2.bitwise_not(src, dst=dst)
+        )
+
+    def dilate(self, size: int, iterations: int = 1):
+        kernel = get_kernel(size)
+        return self.stage(
+            "dilate",
+            lambda src, dst: cv2.dilate(
+                src, kernel, dst=dst, iterations=iterations
+            ),
+        )
+
+    def erode(self, size: int, iterations: int = 1):
+        kernel = get_kernel(size)
+        return self.stage(
+            "erode",
+            lambda src, dst: cv2.erode(
+                src, kernel, dst=dst, iterations=iterations
+            ),
+        )
+
+    def morphology(self, op: int, size: int, iterations: int = 1):
+        """
+        input: op: cv2.MORPH_OPEN, cv2.MORPH_CLOSE, ...
+               size: of the rectangular kernel
+        """
+        kernel = get_kernel(size)
+        name = {cv2.MORPH_OPEN: "open", cv2.MORPH_CLOSE: "close"}.get(
+            op, "morphology"
+        )
+        return self.stage(
+            name,
+            lambda src, dst: cv2.morphologyEx(
+                src, op, kernel, dst=dst, iterations=iterations
+            ),
+        )
+
+    def run(self, image: np.ndarray, keep: bool = False) -> np.ndarray:
+        """
+        input: image: input of the first stage, e.g. the ROI of the frame
+               keep: also keep every stage output in self.outputs (by stage
+                     name), e.g. for the debug images
+        output: output of the last stage, a buffer overwritten by the next
+                run
+        """
+        if keep:
+            self.outputs = {}
+        result = image
+        for i, (name, fn, in_place) in enumerate(self._stages):
+            start = time.perf_counter()
+            result = fn(result, self._buffers[i])
+            duration = time.perf_counter() - start
+            if not in_place:
+                self._buffers[i] = result
+            timing = self._timings[name]
+            timing[0] += 1
+            timing[1] += duration
+            timing[2] = max(timing[2], duration)
+            if keep:
+                self.outputs[name] = result
+        return result
+
+    def timings(self) -> dict:
+        """
+        output: stage name -> (mean, max) duration in ms
+        """
+        return {
+            name: (
+                total / runs * 1e3 if runs else 0.0,
+                longest * 1e3,
+            )
+            for name, (runs, total, longest) in self._timings.items()
+        }
+
+    def stats(self) -> str:
+        timings = self.timings()
+        return "%s: %s, total %.2f ms" % (
+            self.name,
+            ", ".join(
+                "%s %.2f ms" % (name, mean)
+                for name, (mean, _) in timings.items()
+            ),
+            sum(mean for mean, _ in timings.values()),
+        )
+
+    def reset_stats(self):
+        for timing in self._timings.values():
+            timing[:] = [0, 0.0, 0.0]
+
+
+def mask_pipeline(
+    name: str, mask_fn: Callable, size: int = 5
+) -> Pipeline:
+    """
+    A color mask cleaned up by an open and a close, as in the HSV detectors
+    input: mask_fn: mask_fn(image, dst) -> 0 / 255 mask written to dst,
+                    e.g. HsvClassifier.mask
+           size: of the rectangular kernels
+    """
+    return (
+        Pipeline(name)
+        .stage("mask", mask_fn)
+        .morphology(cv2.MORPH_OPEN, size)
+        .morphology(cv2.MORPH_CLOSE, size)
+    )
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Tool pose history from the arm feedback, for latency compensation.
+#
+# A pixel error measured on a camera frame describes where the target was
+# when the frame was captured; by the time the detection is available the
+# tool has kept moving. The history keeps the last few seconds of tool poses
+# so the servo loops can look up the pose at the image stamp and correct the
+# error by the tool motion since capture.
+
+import threading
+from bisect import bisect_left
+from collections import deque
+from typing import Optional
+
+import numpy as np
+import rospy
+from scipy.spatial.transform import Rotation
+
+from utils.camera_model import CameraModel, get_camera_model
+from utils.feedback_reader import feedback_subscriber
+
+
+def _to_sec(stamp) -> float:
+    return stamp.to_sec() if hasattr(stamp, "to_sec") else float(stamp)
+
+
+class PoseHistory(object):
+    """
+    Ring buffer of (time, tool pose) samples.
+
+    Usage:
+        history = get_pose_history()
+        displacement = history.tool_displacement_since(image_stamp)
+    """
+
+    def __init__(
+        self,
+        max_age: float = 2.0,
+        min_interval: float = 0.005,
+        subscribe: bool = True,
+    ):
+        """
+        input: max_age: seconds of history to keep
+               min_interval: samples closer than this (s) are skipped, the
+                             feedback arrives at up to 1 kHz
+               subscribe: feed the history from the arm feedback
+        """
+        self.max_age = max_age
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._times = deque()
+        self._poses = deque()
+        self._sub = None
+        if subscribe:
+            self._sub = feedback_subscriber(callback=self._feedback_cb)
+
+    def _feedback_cb(self, sample):
+        self.add(sample.stamp, sample.tool_pose)
+
+    def add(self, stamp, tool_pose):
+        """
+        input: stamp: rospy.Time or seconds
+               tool_pose: [x, y, z, theta_x, theta_y, theta_z] (m, deg)
+        """
+        t = _to_sec(stamp)
+        with self._lock:
+            if self._times and t < self._times[-1] + self.min_interval:
+                return
+            self._times.append(t)
+            self._poses.append(np.array(tool_pose, dtype=float))
+            while self._times and self._times[0] < t - self.max_age:
+                self._times.popleft()
+                self._poses.popleft()
+
+    def latest(self) -> Optional[np.ndarray]:
+        with self._lock:
+            return self._poses[-1].copy() if self._poses else None
+
+    def pose_at(self, stamp) -> Optional[np.ndarray]:
+        """
+        Tool pose at stamp, linearly interpolated in position (orientation
+        of the nearest sample); None if stamp is outside the history
+        """
+        t = _to_sec(stamp)
+        with self._lock:
+            if not self._times or t < self._times[0]:
+                return None
+            if t >= self._times[-1]:
+                return self._poses[-1].copy()
+            i = bisect_left(self._times, t)
+            t0, t1 = self._times[i - 1], self._times[i]
+            p0, p1 = self._poses[i - 1], self._poses[i]
+        alpha = (t - t0) / (t1 - t0)
+        pose = p0 if alpha < 0.5 else p1
+        pose = pose.copy()
+        pose[:3] = (1 - alpha) * p0[:3] + alpha * p1[:3]
+        return pose
+
+    def tool_displacement_since(self, stamp) -> Optional[np.ndarray]:
+        """
+        Translation of the tool since stamp, expressed in the current tool
+        frame (m); None if stamp is not covered by the history
+        """
+        then = self.pose_at(stamp)
+        now = self.latest()
+        if then is None or now is None:
+            return None
+        rotation = Rotation.from_euler("xyz", now[3:], degrees=True)
+        return rotation.inv().apply(now[:3] - then[:3])
+
+
+class LatencyCompensator(object):
+    """
+    Corrects pixel errors measured on a frame for the tool motion between
+    the capture of the frame and now.
+
+    Usage:
+        compensator = LatencyCompensator()
+        error_x, error_y = compensator.compensate(error_x, error_y, stamp)
+    """
+
+    def __init__(
+        self,
+        pose_history: Optional[PoseHistory] = None,
+        camera: Optional[CameraModel] = None,
+        enabled: bool = True,
+    ):
+        self.pose_history = pose_history or get_pose_history()
+        self.camera = camera or get_camera_model()
+        self.enabled = enabled
+        self.last_latency = None
+        self.last_correction = (0.0, 0.0)
+
+    def compensate(self, error_x, error_y, stamp):
+        """
+        input: error_x, error_y: pixel errors measured on the frame (or None)
+               stamp: capture stamp of the frame
+        output: corrected (error_x, error_y); unchanged if disabled, the
+                stamp is unknown or not covered by the pose history
+        """
+        self.last_latency = None
+        self.last_correction = (0.0, 0.0)
+        if stamp is None:
+            return error_x, error_y
+        self.last_latency = (rospy.Time.now() - stamp).to_sec()
+        if not self.enabled:
+            return error_x, error_y
+        displacement = self.pose_history.tool_displacement_since(stamp)
+        now = self.pose_history.latest()
+        if displacement is None or now is None:
+            return error_x, error_y
+        ppm_x, ppm_y = self.camera.pixels_per_meter(now[2])
+        # moving the tool along +x / +y reduces a positive error
+        correction_x = ppm_x * displacement[0]
+        correction_y = ppm_y * displacement[1]
+        self.last_correction = (correction_x, correction_y)
+        if error_x is not None:
+            error_x = error_x - correction_x
+        if error_y is not None:
+            error_y = error_y - correction_y
+        return error_x, error_y
+
+
+_pose_history: Optional[PoseHistory] = None
+
+
+def get_pose_history() -> PoseHistory:
+    """
+    Process-wide pose history fed from the arm feedback
+    """
+    global _pose_history
+    if _pose_history is None:
+        _pose_history = PoseHistory()
+    return _pose_history
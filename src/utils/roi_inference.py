@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# ROI-adaptive inference for the detection backends.
+#
+# Once the target has been found, the detector only looks at a window around
+# the previous box, at a smaller inference size (a 320 px window at size 320
+# is inferred at native resolution, while the full 1280 px frame at size 640
+# is downscaled by two). The window grows on every miss, and after
+# max_misses misses the full frame is searched again. A backend with a fixed
+# input shape (a static ONNX export) letterboxes every window to that shape,
+# so ROI inference is disabled for it.
+
+import numpy as np
+import rospy
+
+
+class RoiDetector(object):
+    """
+    Has the same detect(image, size=None) -> (N, 6) interface as the
+    detection backends; boxes are in full-frame coordinates.
+
+    Usage:
+        detector = RoiDetector(get_detector("door_knob"))
+        detector.reset()  # at the start of every servoing run
+        detections = detector.detect(image)
+    """
+
+    def __init__(
+        self,
+        detector,
+        roi_size=320,
+        padding=1.0,
+        growth=1.5,
+        max_misses=2,
+        full_frame_size=640,
+    ):
+        """
+        input: detector: backend with detect(image, size) -> (N, 6)
+               roi_size: minimum window side and inference size in the ROI
+               padding: window padding on each side as fraction of box size
+               growth: window scale factor per consecutive miss
+               max_misses: misses in the ROI before searching the full frame
+               full_frame_size: inference size for full-frame search
+        """
+        self.detector = detector
+        self.roi_size = roi_size
+        self.padding = padding
+        self.growth = growth
+        self.max_misses = max_misses
+        self.full_frame_size = full_frame_size
+        self.reset()
+
+    def reset(self):
+        self.last_box = None
+        self.misses = 0
+        self.num_roi_inferences = 0
+        self.num_full_frame_inferences = 0
+
+    def window(self, image_shape):
+        """
+        Search window (x1, y1, x2, y2) around the last box
+        """
+        x1, y1, x2, y2 = self.last_box
+        cx, cy = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+        scale = self.growth**self.misses
+        w = max(self.roi_size, (x2 - x1) * (1 + 2 * self.padding)) * scale
+        h = max(self.roi_size, (y2 - y1) * (1 + 2 * self.padding)) * scale
+        height, width = image_shape[:2]
+        w, h = min(w, width), min(h, height)
+        wx1 = int(np.clip(cx - w / 2, 0, width - w))
+        wy1 = int(np.clip(cy - h / 2, 0, height - h))
+        return wx1, wy1, wx1 + int(w), wy1 + int(h)
+
+    def _full_frame(self, image):
+        self.num_full_frame_inferences += 1
+        detections = self.detector.detect(image, size=self.full_frame_size)
+        self._update(detections)
+        return detections
+
+    def _update(self, detections):
+        if len(detections) == 0:
+            self.last_box = None
+            return
+        self.misses = 0
+        self.last_box = detections[detections[:, 4].argmax(), :4].copy()
+
+    def detect(self, image, size=None):
+        if self.last_box is None:
+            return self._full_frame(image)
+
+        x1, y1, x2, y2 = self.window(image.shape)
+        self.num_roi_inferences += 1
+        # the inference size grows with the window, up to the full-frame size
+        size = min(
+            size or self.full_frame_size,
+            int(round(self.roi_size * self.growth**self.misses)),
+        )
+        detections = self.detector.detect(image[y1:y2, x1:x2], size=size)
+        if len(detections) == 0:
+            self.misses += 1
+            if self.misses > self.max_misses:
+                self.misses = 0
+                return self._full_frame(image)
+            return detections
+
+        detections = detections.copy()
+        detections[:, [0, 2]] += x1
+        detections[:, [1, 3]] += y1
+        self._update(detections)
+        return detections
+
+    def stats(self):
+        return "ROI inferences: %d, full-frame inferences: %d" % (
+            self.num_roi_inferences,
+            self.num_full_frame_inferences,
+        )
+
+
+def create_roi_detector(detector, params=None):
+    """
+    Wraps detector in a RoiDetector configured from params (e.g. the
+    ~roi_inference parameter dict); returns detector unchanged if ROI
+    inference is disabled there or the detector has a fixed input shape
+    """
+    params = dict(params or {})
+    if not params.pop("enabled", True):
+        return detector
+    input_shape = getattr(detector, "input_shape", None)
+    if input_shape is not None:
+        rospy.logwarn(
+            "[roi_inference] disabled, the %s has a fixed input shape %s; "
+            "export the model with _dynamic:=true to use it"
+            % (type(detector).__name__, tuple(input_shape))
+        )
+        return detector
+    return RoiDetector(detector, **params)
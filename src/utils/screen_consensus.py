@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+# Multi-frame reading of the multimeter screen with a vote over the frames.
+#
+# A single reading of one frame fails or misreads when a segment flickers or
+# the screen reflects. The consensus reader grabs up to num_frames
+# consecutive frames, crops the screen in the calling process and reads the
+# crops in parallel in a process pool (seven-segment reader, Tesseract as
+# the fallback of a frame). Every successful read is a vote for its text; as
+# soon as quorum frames agree the pending reads are cancelled and the
+# reading is returned, otherwise the most voted reading is returned once all
+# frames are read or the timeout expires. The pool is started once and kept
+# warm, since spawning a worker (importing cv2) takes longer than a read.
+
+import importlib.util
+import multiprocessing
+import time
+from collections import namedtuple
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from typing import Optional, Sequence
+
+import numpy as np
+import rospy
+
+from utils.frame_hub import FrameHub, get_frame_hub
+from utils.seven_segment import (
+    create_seven_segment_reader,
+    crop_screen,
+    read_with_tesseract,
+    screen_mask,
+)
+
+# text: the reading most frames agree on
+# votes: number of frames that read text
+# num_read: number of frames read (successfully or not)
+# agreement: votes / num_read
+# confidence: mean seven-segment confidence of the votes (1.0 for tesseract)
+# quorum: True if votes reached the quorum
+# mask: lit segments of a frame that read text, for debugging
+ConsensusReading = namedtuple(
+    "ConsensusReading",
+    [
+        "text",
+        "votes",
+        "num_read",
+        "agreement",
+        "confidence",
+        "quorum",
+        "mask",
+    ],
+)
+
+# reader of the worker process, created by _init_worker
+_reader = None
+_tesseract = False
+
+
+def _init_worker(reader_params, tesseract):
+    global _reader, _tesseract
+    import cv2
+
+    # the workers already run in parallel
+    cv2.setNumThreads(1)
+    _reader = create_seven_segment_reader(reader_params)
+    _tesseract = tesseract
+
+
+def _ready():
+    return True
+
+
+def _read(screen: np.ndarray, reader, tesseract: bool):
+    """
+    Reads one cropped screen
+    input: reader: SevenSegmentReader, None to only use Tesseract
+    output: text (None if it could not be read), confidence, mask
+    """
+    mask = screen_mask(screen)
+    if reader is not None:
+        reading = reader.read(mask)
+        if reading is not None and reading.text:
+            return reading.text, reading.confidence, mask
+    if tesseract:
+        text, _ = read_with_tesseract(mask)
+        if text:
+            return text, 1.0, mask
+    return None, 0.0, mask
+
+
+def _read_screen(screen: np.ndarray):
+    """
+    Reads one cropped screen in a worker process, see _read
+    """
+    return _read(screen, _reader, _tesseract)
+
+
+class ScreenConsensus(object):
+    """
+    Usage:
+        consensus = ScreenConsensus(roi, angle, flip=True, reader_params=...)
+        consensus.start()  # optional, spawns the workers ahead of time
+        reading = consensus.read()
+        if reading is not None and reading.quorum:
+            value = reading.text
+    """
+
+    def __init__(
+        self,
+        roi: Sequence[int],
+        angle: float = 0.0,
+        flip: bool = False,
+        reader_params: Optional[dict] = None,
+        num_frames: int = 5,
+        quorum: int = 3,
+        num_workers: int = 3,
+        timeout: float = 3.0,
+        tesseract: bool = True,
+        frame_hub: Optional[FrameHub] = None,
+    ):
+        """
+        input: roi, angle, flip: screen crop, see crop_screen
+               reader_params: ~seven_segment parameters of the reader
+               num_frames: most consecutive frames read
+               quorum: agreeing frames to return early
+               num_workers: worker processes; 0 reads in this process
+               timeout: s, the most voted reading so far is returned after
+               tesseract: fall back to Tesseract for frames the reader
+                          rejects (if pytesseract is installed)
+        """
+        if quorum > num_frames:
+            raise ValueError(
+                "quorum %d exceeds num_frames %d" % (quorum, num_frames)
+            )
+        self.roi = roi
+        self.angle = angle
+        self.flip = flip
+        self.reader_params = dict(reader_params or {})
+        self.num_frames = num_frames
+        self.quorum = quorum
+        self.num_workers = num_workers
+        self.timeout = timeout
+        self.tesseract = (
+            tesseract and importlib.util.find_spec("pytesseract") is not None
+        )
+        self.frame_hub = frame_hub or get_frame_hub()
+        self._pool = None
+        # reader of the in-process reading (num_workers 0); the OpenCV
+        # threads of the node are left as they are
+        self._reader = None
+        if num_workers <= 0:
+            self._reader = create_seven_segment_reader(self.reader_params)
+
+    def start(self):
+        """
+        Starts the worker processes if they are not running
+        """
+        if self._pool is not None or self.num_workers <= 0:
+            return
+        # spawn, forking the node would copy the rospy threads and locks
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.reader_params, self.tesseract),
+        )
+        # the executor spawns workers on demand, one task each spawns all
+        for _ in range(self.num_workers):
+            self._pool.submit(_ready)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _submit(self, screen):
+        if self._pool is not None:
+            return self._pool.submit(_read_screen, screen)
+        # in-process reading: a future that is already done
+        future = Future()
+        future.set_result(_read(screen, self._reader, self.tesseract))
+        return future
+
+    def read(self) -> Optional[ConsensusReading]:
+        """
+        output: the reading most frames agree on, None if no frame could be
+                read before the timeout
+        """
+        self.start()
+        deadline = time.monotonic() + self.timeout
+        votes = {}
+        num_read = 0
+        num_submitted = 0
+        pending = set()
+        last_stamp = None
+        with self.frame_hub.perception(wait=False):
+            while time.monotonic() < deadline and not rospy.is_shutdown():
+                grabbing = num_submitted < self.num_frames
+                if grabbing and self.frame_hub.wait_for_frame(
+                    timeout=0.02, newer_than=last_stamp
+                ):
+                    msg = self.frame_hub.latest_msg()
+                    screen = crop_screen(
+                        self.frame_hub.get_frame("bgr8", msg),
+                        self.roi,
+                        self.angle,
+                        self.flip,
+                    )
+                    last_stamp = msg.header.stamp
+                    pending.add(self._submit(screen))
+                    num_submitted += 1
+                if not pending:
+                    if grabbing:
+                        continue
+                    break
+                done, pending = wait(
+                    pending,
+                    timeout=0
+                    if grabbing
+                    else max(deadline - time.monotonic(), 0),
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    text, confidence, mask = future.result()
+                    num_read += 1
+                    if text is not None:
+                        votes.setdefault(text, []).append((confidence, mask))
+                if any(len(v) >= self.quorum for v in votes.values()):
+                    break
+        for future in pending:
+            future.cancel()
+
+        if not votes:
+            return None
+        text = max(votes, key=lambda t: len(votes[t]))
+        confidences = [confidence for confidence, _ in votes[text]]
+        return ConsensusReading(
+            text=text,
+            votes=len(confidences),
+            num_read=num_read,
+            agreement=len(confidences) / float(num_read),
+            confidence=float(np.mean(confidences)),
+            quorum=len(confidences) >= self.quorum,
+            mask=votes[text][0][1],
+        )
+
+
+def create_screen_consensus(
+    params=None, **kwargs
+) -> Optional[ScreenConsensus]:
+    """
+    ScreenConsensus configured from params (e.g. the ~screen_consensus
+    parameter dict) and kwargs (the screen crop); None if disabled there
+    """
+    params = dict(params or {})
+    if not params.pop("enabled", True):
+        return None
+    params.update(kwargs)
+    return ScreenConsensus(**params)
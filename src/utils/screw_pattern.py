@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+# Matching of a known point layout (e.g. the screws around a port) to noisy
+# circle detections.
+#
+# The layout is given by its points in pixels at a reference tool height.
+# A detection is the similarity transform p' = s * R * p + t of the layout,
+# written with complex numbers as z' = a * z + b (|a| = s, arg(a) = the
+# rotation). The expected scale follows from the tool height with the camera
+# model, and the rotation is bounded, so only candidate pairs whose distance
+# matches a layout pair are hypotheses: they are found with a KD-tree
+# (query_pairs) instead of a full distance matrix, each determines a, b, and
+# all hypotheses are verified together by looking up the transformed layout
+# points in the same tree (with more than max_hypotheses, a random subset as
+# in RANSAC). The hypothesis of the lowest truncated squared distances
+# (MSAC), biased towards the predicted scale and the previous fit, is refined
+# by least squares on its matches. The fit of the previous frame is verified
+# first and kept, refined, if it still matches every layout point, so the
+# search only runs when tracking is lost.
+
+from collections import namedtuple
+from typing import Optional, Sequence
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from utils.camera_model import CameraModel, get_camera_model
+
+# scale, rotation: of the layout in the image (rotation in radians)
+# translation: (tx, ty) in pixels
+# points: (M, 2) layout points in the image
+# matches: (M,) index of the candidate matched to each layout point, -1 if
+#          none
+# residual: RMS distance of the matched candidates to the layout (px)
+ScrewPatternPose = namedtuple(
+    "ScrewPatternPose",
+    ["scale", "rotation", "translation", "points", "matches", "residual"],
+)
+
+
+def _to_complex(points) -> np.ndarray:
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points[:, 0] + 1j * points[:, 1]
+
+
+def _to_points(z: np.ndarray) -> np.ndarray:
+    return np.stack([z.real, z.imag], axis=-1)
+
+
+def _fit_similarity(src: np.ndarray, dst: np.ndarray):
+    """
+    Least squares a, b with dst ~ a * src + b (complex, at least 2 points)
+    """
+    src_mean, dst_mean = src.mean(), dst.mean()
+    src_c, dst_c = src - src_mean, dst - dst_mean
+    norm = max(np.sum(np.abs(src_c) ** 2), 1e-9)
+    a = np.sum(np.conj(src_c) * dst_c) / norm
+    return a, dst_mean - a * src_mean
+
+
+class ScrewPatternMatcher(object):
+    """
+    Usage:
+        matcher = ScrewPatternMatcher(layout, layout_height=0.148)
+        pose = matcher.match(circles[:, :2], tool_height)
+        if pose is not None:
+            screw_x, screw_y = pose.points[0]
+    """
+
+    def __init__(
+        self,
+        layout: Sequence[Sequence[float]],
+        layout_height: Optional[float] = None,
+        inlier_threshold: float = 6.0,
+        min_inliers: int = 3,
+        scale_tolerance: float = 0.15,
+        max_rotation: float = 0.35,
+        max_hypotheses: int = 2000,
+        prior_radius: float = 30.0,
+        camera: Optional[CameraModel] = None,
+        seed: int = 0,
+    ):
+        """
+        input: layout: (M, 2) layout points in pixels at layout_height
+               layout_height: tool height (m) the layout was measured at;
+                              None disables the scale prediction
+               inlier_threshold: distance (px) of a candidate to a layout
+                                 point to be matched
+               min_inliers: fewest matched layout points of a fit
+               scale_tolerance: relative deviation of the scale from the
+                                predicted one
+               max_rotation: largest rotation of the layout (rad)
+               max_hypotheses: random subset verified if there are more
+               prior_radius: typical motion (px) of the layout between
+                             frames, for preferring fits near the previous
+        """
+        self.layout = _to_complex(layout)
+        if len(self.layout) < 2:
+            raise ValueError("a layout needs at least 2 points")
+        self.layout_height = layout_height
+        self.inlier_threshold = inlier_threshold
+        self.min_inliers = min_inliers
+        self.scale_tolerance = scale_tolerance
+        self.max_rotation = max_rotation
+        self.max_hypotheses = max_hypotheses
+        self.prior_radius = prior_radius
+        self.camera = camera
+        self.rng = np.random.default_rng(seed)
+        i, j = np.triu_indices(len(self.layout), k=1)
+        self._pairs = np.stack([i, j], axis=1)
+        self._pair_vectors = self.layout[j] - self.layout[i]
+        self.prior = None
+
+    def reset(self):
+        self.prior = None
+
+    def expected_scale(self, tool_height: Optional[float]) -> float:
+        if tool_height is None or self.layout_height is None:
+            return 1.0
+        camera = self.camera or get_camera_model()
+        return (
+            camera.pixels_per_meter(tool_height)[0]
+            / camera.pixels_per_meter(self.layout_height)[0]
+        )
+
+    def match(
+        self, candidates, tool_height: Optional[float] = None
+    ) -> Optional[ScrewPatternPose]:
+        """
+        input: candidates: (N, 2) detected points (e.g. circle centers)
+               tool_height: current tool height (m) for the scale
+        output: pose of the layout, None if fewer than min_inliers layout
+                points could be matched
+        """
+        points = _to_complex(candidates)
+        if len(points) < min(self.min_inliers, len(self.layout)):
+            return None
+        tree = cKDTree(_to_points(points))
+
+        if self.prior is not None:
+            a, b = self.prior
+            pose = self._refine(a, b, points, tree)
+            if pose is not None and np.all(pose.matches >= 0):
+                return pose
+
+        hypotheses = self._hypotheses(points, tree, tool_height)
+        if len(hypotheses) == 0:
+            return None
+        a, b = self._best(
+            hypotheses, tree, self.expected_scale(tool_height)
+        )
+        pose = self._refine(a, b, points, tree)
+        if pose is None:
+            self.prior = None
+        return pose
+
+    def _hypotheses(self, points, tree, tool_height):
+        """
+        output: (H, 2) complex a, b of the transforms mapping a layout pair
+                onto a candidate pair of matching length
+        """
+        scale = self.expected_scale(tool_height)
+        min_scale = scale * (1.0 - self.scale_tolerance)
+        max_scale = scale * (1.0 + self.scale_tolerance)
+        max_length = np.abs(self._pair_vectors).max() * max_scale
+        pairs = tree.query_pairs(
+            max_length + self.inlier_threshold, output_type="ndarray"
+        )
+        if len(pairs) == 0:
+            return np.empty((0, 2), dtype=np.complex128)
+        # both orientations of every candidate pair
+        pairs = np.concatenate([pairs, pairs[:, ::-1]])
+        vectors = points[pairs[:, 1]] - points[pairs[:, 0]]
+
+        # a for every (candidate pair, layout pair) combination
+        a = vectors[:, None] / self._pair_vectors[None, :]
+        valid = (
+            (np.abs(a) >= min_scale)
+            & (np.abs(a) <= max_scale)
+            & (np.abs(np.angle(a)) <= self.max_rotation)
+        )
+        candidate_idx, layout_idx = np.nonzero(valid)
+        a = a[candidate_idx, layout_idx]
+        b = (
+            points[pairs[candidate_idx, 0]]
+            - a * self.layout[self._pairs[layout_idx, 0]]
+        )
+        hypotheses = np.stack([a, b], axis=1)
+        if len(hypotheses) > self.max_hypotheses:
+            keep = self.rng.choice(
+                len(hypotheses), self.max_hypotheses, replace=False
+            )
+            hypotheses = hypotheses[keep]
+        return hypotheses
+
+    def _best(self, hypotheses, tree, scale):
+        """
+        Hypothesis of the lowest cost: the truncated squared distances of
+        the layout points to their nearest candidates (MSAC), plus the
+        squared deviation from the predicted scale and the (truncated)
+        motion from the previous fit, relative to their tolerances
+        """
+        projected = (
+            hypotheses[:, :1] * self.layout[None, :] + hypotheses[:, 1:]
+        )
+        distances, _ = tree.query(
+            _to_points(projected.ravel()),
+            distance_upper_bound=self.inlier_threshold,
+        )
+        distances = np.minimum(
+            distances.reshape(projected.shape), self.inlier_threshold
+        )
+        threshold_sq = self.inlier_threshold**2
+        cost = np.sum(distances**2, axis=1)
+        scale_deviation = (np.abs(hypotheses[:, 0]) / scale - 1.0) / (
+            self.scale_tolerance
+        )
+        cost += threshold_sq * scale_deviation**2
+        if self.prior is not None:
+            a, b = self.prior
+            motion = np.abs(projected - (a * self.layout + b)).mean(axis=1)
+            # bounded, the prior only decides between similar fits
+            motion = np.minimum(motion / self.prior_radius, 1.0)
+            cost += threshold_sq * motion**2
+        return hypotheses[np.argmin(cost)]
+
+    def _refine(self, a, b, points, tree):
+        matches = None
+        for _ in range(2):
+            projected = a * self.layout + b
+            distances, matches = tree.query(
+                _to_points(projected),
+                distance_upper_bound=self.inlier_threshold,
+            )
+            matched = np.isfinite(distances)
+            if matched.sum() < min(self.min_inliers, len(self.layout)):
+                return None
+            a, b = _fit_similarity(
+                self.layout[matched], points[matches[matched]]
+            )
+        projected = a * self.layout + b
+        matched = np.isfinite(distances)
+        residual = np.abs(projected[matched] - points[matches[matched]])
+        self.prior = (a, b)
+        return ScrewPatternPose(
+            scale=float(np.abs(a)),
+            rotation=float(np.angle(a)),
+            translation=(float(b.real), float(b.imag)),
+            points=_to_points(projected),
+            matches=np.where(matched, matches, -1),
+            residual=float(np.sqrt(np.mean(residual**2))),
+        )
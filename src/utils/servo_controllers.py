@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+# Controllers mapping the pixel errors of the servo target functions to tool
+# velocities (tool frame, m/s).
+#
+# BangBangController is the original fixed step: +-0.005 m/s, halved below
+# 10 px, zero below 3 px. Closing a 200 px error at 0.3 m tool height takes
+# over ten seconds with it.
+#
+# ImageJacobianController inverts the image Jacobian of a point on the board
+# for a camera looking straight down (see CameraModel): a tool velocity v
+# moves the target by f / Z * v px/s, so v = gain * error * Z / f closes the
+# error exponentially with rate gain (1/s) at any tool height. Large errors
+# are bounded by max_speed (scaling both axes together keeps the direction),
+# small ones are lifted to min_speed so the error reaches the deadband in a
+# bounded number of iterations instead of only approaching it. Below
+# slow_zone the lower fine_gain is used to avoid overshooting the deadband on
+# detection noise and latency.
+#
+# With loop period dt the iterations to converge are bounded by
+#   |e0| / (ppm * max_speed * dt) + log(slow_zone / deadband) / (gain * dt)
+#   + slow_zone / (ppm * min_speed * dt)
+# which are a few dozen at 10 Hz for the default parameters.
+
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+
+from utils.camera_model import CameraModel, get_camera_model
+from utils.pose_history import get_pose_history
+
+Thresholds = Union[float, Sequence[float]]
+
+# tool height used if none is given and there is no arm feedback (m)
+DEFAULT_TOOL_HEIGHT = 0.3
+
+
+def _per_axis(value: Thresholds, num_axes: int) -> np.ndarray:
+    return np.broadcast_to(np.asarray(value, dtype=float), (num_axes,))
+
+
+class BangBangController(object):
+    """
+    Fixed speed controller, the baseline of all servo loops.
+
+    Usage:
+        controller = BangBangController()
+        vel_x, vel_y = controller.compute((error_x, error_y))
+    """
+
+    def __init__(
+        self,
+        speed: float = 0.005,
+        deadband: Thresholds = 3.0,
+        slow_zone: Thresholds = 10.0,
+        slow_factor: float = 0.5,
+    ):
+        """
+        input: speed: tool speed per axis (m/s)
+               deadband: errors below this (px) command zero velocity
+               slow_zone: errors below this (px) use speed * slow_factor
+        """
+        self.speed = speed
+        self.deadband = deadband
+        self.slow_zone = slow_zone
+        self.slow_factor = slow_factor
+
+    def compute(
+        self,
+        errors: Sequence[Optional[float]],
+        tool_height: Optional[float] = None,
+        deadband: Optional[Thresholds] = None,
+        slow_zone: Optional[Thresholds] = None,
+    ) -> List[float]:
+        """
+        input: errors: pixel error per axis (None if not measured)
+               tool_height: unused, for the controller interface
+               deadband, slow_zone: per-call override (scalar or per axis)
+        output: tool velocity per axis (m/s), zero for missing errors
+        """
+        deadband = _per_axis(
+            self.deadband if deadband is None else deadband, len(errors)
+        )
+        slow_zone = _per_axis(
+            self.slow_zone if slow_zone is None else slow_zone, len(errors)
+        )
+        velocities = []
+        for error, db, slow in zip(errors, deadband, slow_zone):
+            if error is None or abs(error) < db:
+                velocities.append(0.0)
+                continue
+            velocity = np.copysign(self.speed, error)
+            if abs(error) < slow:
+                velocity *= self.slow_factor
+            velocities.append(float(velocity))
+        return velocities
+
+
+class ImageJacobianController(object):
+    """
+    Proportional image based visual servo controller.
+
+    Usage:
+        controller = ImageJacobianController()
+        vel_x, vel_y = controller.compute((error_x, error_y), tool_height)
+    """
+
+    def __init__(
+        self,
+        gain: float = 1.5,
+        fine_gain: float = 1.0,
+        max_speed: float = 0.02,
+        min_speed: float = 0.001,
+        deadband: Thresholds = 3.0,
+        slow_zone: Thresholds = 10.0,
+        camera: Optional[CameraModel] = None,
+    ):
+        """
+        input: gain: convergence rate of the error (1/s)
+               fine_gain: rate used below slow_zone (1/s)
+               max_speed: saturation of the tool speed per axis (m/s)
+               min_speed: minimum tool speed outside the deadband (m/s)
+               deadband: errors below this (px) command zero velocity
+               slow_zone: errors below this (px) use fine_gain
+               camera: camera model, the process-wide one by default
+        """
+        self.gain = gain
+        self.fine_gain = fine_gain
+        self.max_speed = max_speed
+        self.min_speed = min_speed
+        self.deadband = deadband
+        self.slow_zone = slow_zone
+        self.camera = camera or get_camera_model()
+
+    def compute(
+        self,
+        errors: Sequence[Optional[float]],
+        tool_height: Optional[float] = None,
+        deadband: Optional[Thresholds] = None,
+        slow_zone: Optional[Thresholds] = None,
+    ) -> List[float]:
+        """
+        input: errors: pixel error per axis x, y (None if not measured)
+               tool_height: tool z in base_link (m); from the arm feedback
+                            if not given
+               deadband, slow_zone: per-call override (scalar or per axis)
+        output: tool velocity per axis (m/s), zero for missing errors
+        """
+        if tool_height is None:
+            pose = get_pose_history().latest()
+            tool_height = DEFAULT_TOOL_HEIGHT if pose is None else pose[2]
+        num_axes = len(errors)
+        deadband = _per_axis(
+            self.deadband if deadband is None else deadband, num_axes
+        )
+        slow_zone = _per_axis(
+            self.slow_zone if slow_zone is None else slow_zone, num_axes
+        )
+        measured = np.array([e is not None for e in errors])
+        error = np.array([0.0 if e is None else e for e in errors])
+        active = measured & (np.abs(error) >= deadband)
+
+        gain = np.where(np.abs(error) < slow_zone, self.fine_gain, self.gain)
+        ppm = np.array(self.camera.pixels_per_meter(tool_height))[:num_axes]
+        velocity = np.where(active, gain * error / ppm, 0.0)
+
+        # saturate, keeping the direction of motion
+        peak = np.max(np.abs(velocity)) if num_axes else 0.0
+        if peak > self.max_speed:
+            velocity *= self.max_speed / peak
+        # lift small commands so the deadband is reached in finite time
+        small = active & (np.abs(velocity) < self.min_speed)
+        velocity[small] = np.copysign(self.min_speed, error[small])
+        return velocity.tolist()
+
+
+CONTROLLERS = {
+    "bang_bang": BangBangController,
+    "jacobian": ImageJacobianController,
+}
+
+
+def create_servo_controller(params=None):
+    """
+    Controller configured from params (e.g. the ~servo_controller parameter
+    dict); the "type" key selects one of CONTROLLERS, the remaining keys are
+    passed to its constructor
+    """
+    params = dict(params or {})
+    controller_type = params.pop("type", "jacobian")
+    if controller_type not in CONTROLLERS:
+        raise ValueError(
+            "unknown servo controller '%s', expected one of %s"
+            % (controller_type, sorted(CONTROLLERS))
+        )
+    return CONTROLLERS[controller_type](**params)
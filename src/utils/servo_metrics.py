@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+# Convergence metrics of a visual servoing run.
+#
+# Records the commanded velocity per axis on every iteration and reports
+# the time to converge, the number of iterations and the number of
+# oscillations (sign reversals of the commanded velocity on an axis, i.e.
+# overshooting the deadband), plus the mean age of the measurements used.
+
+import time
+from typing import Optional, Sequence
+
+
+class ServoMetrics(object):
+    """
+    Usage:
+        metrics = ServoMetrics(["x", "y"])
+        while ...:
+            metrics.update((error_x, error_y), (vel_x, vel_y))
+        metrics.finish(converged=True)
+        rospy.loginfo("[probe_action] " + metrics.summary())
+    """
+
+    def __init__(self, axes: Sequence[str] = ("x", "y")):
+        self.axes = list(axes)
+        self.start_time = time.monotonic()
+        self.end_time = None
+        self.converged = False
+        self.iterations = 0
+        self.oscillations = {axis: 0 for axis in self.axes}
+        self.final_error = [None] * len(self.axes)
+        self._last_sign = [0] * len(self.axes)
+        # measurement age per iteration, None where unknown
+        self.latencies = []
+
+    def update(
+        self,
+        errors: Sequence[Optional[float]],
+        velocities: Sequence[float],
+        latency: Optional[float] = None,
+    ):
+        """
+        input: errors: pixel error per axis (None if not measured)
+               velocities: commanded velocity per axis
+               latency: age of the measurement in seconds, if known
+        """
+        self.iterations += 1
+        self.latencies.append(latency)
+        for i, (error, velocity) in enumerate(zip(errors, velocities)):
+            if error is not None:
+                self.final_error[i] = error
+            sign = (velocity > 0) - (velocity < 0)
+            if sign == 0:
+                continue
+            if self._last_sign[i] != 0 and sign != self._last_sign[i]:
+                self.oscillations[self.axes[i]] += 1
+            self._last_sign[i] = sign
+
+    def finish(self, converged: bool):
+        self.end_time = time.monotonic()
+        self.converged = converged
+
+    @property
+    def duration(self) -> float:
+        end = self.end_time if self.end_time is not None else time.monotonic()
+        return end - self.start_time
+
+    @property
+    def mean_latency(self) -> Optional[float]:
+        latencies = [l for l in self.latencies if l is not None]
+        if not latencies:
+            return None
+        return sum(latencies) / len(latencies)
+
+    def summary(self) -> str:
+        errors = ", ".join(
+            "%s: %s" % (axis, "-" if e is None else "%.1f" % e)
+            for axis, e in zip(self.axes, self.final_error)
+        )
+        oscillations = ", ".join(
+            "%s: %d" % (axis, self.oscillations[axis]) for axis in self.axes
+        )
+        summary = (
+            "%s after %.2f s, %d iterations, oscillations (%s), "
+            "final error px (%s)"
+            % (
+                "converged" if self.converged else "stopped",
+                self.duration,
+                self.iterations,
+                oscillations,
+                errors,
+            )
+        )
+        if self.mean_latency is not None:
+            summary += ", mean latency %.0f ms" % (self.mean_latency * 1e3)
+        return summary
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+
+# In-process reader for seven-segment displays (the multimeter screen).
+#
+# The lit segments are thresholded, the italic slant of the digits is
+# sheared out, and the connected components are grouped into characters
+# (components overlapping in x belong to one digit, so gaps between the
+# segments of a digit do not matter). Characters of the full digit height are
+# digits: the fill of the seven segment regions of their bounding box gives
+# the segment pattern, looked up in SEGMENT_DIGITS (a "1" has a narrow box,
+# of which the upper and lower half have to be lit as segments b and c).
+# Small blobs on the baseline are decimal points, short wide blobs at mid
+# height minus signs. The annunciator layout of the multimeter is not
+# configured, so readings have no unit unless unit_regions are given. A
+# reading is rejected (and the caller can fall back to Tesseract) if a
+# pattern is unknown or a segment fill is close to the threshold.
+
+import threading
+from collections import namedtuple
+from typing import Dict, Optional, Sequence
+
+import cv2
+import numpy as np
+
+from utils.perception_utils import blob_stats
+from utils.pipeline import Pipeline
+
+# segment regions (x0, y0, x1, y1) as fractions of the digit bounding box
+#    aaa
+#   f   b
+#    ggg
+#   e   c
+#    ddd
+SEGMENT_REGIONS = {
+    "a": (0.25, 0.0, 0.75, 0.15),
+    "b": (0.7, 0.15, 1.0, 0.42),
+    "c": (0.7, 0.58, 1.0, 0.85),
+    "d": (0.25, 0.85, 0.75, 1.0),
+    "e": (0.0, 0.58, 0.3, 0.85),
+    "f": (0.0, 0.15, 0.3, 0.42),
+    "g": (0.25, 0.42, 0.75, 0.58),
+}
+SEGMENT_ORDER = "abcdefg"
+
+# segment regions of a "1", whose narrow box only holds segments b and c
+ONE_REGIONS = {
+    "b": (0.0, 0.15, 1.0, 0.42),
+    "c": (0.0, 0.58, 1.0, 0.85),
+}
+
+SEGMENT_DIGITS = {
+    "abcdef": "0",
+    "bc": "1",
+    "abdeg": "2",
+    "abcdg": "3",
+    "bcfg": "4",
+    "acdfg": "5",
+    "acdefg": "6",
+    "cdefg": "6",  # without the top segment
+    "abc": "7",
+    "abcf": "7",  # with the upper left segment
+    "abcdefg": "8",
+    "abcdfg": "9",
+    "abcfg": "9",  # without the bottom segment
+}
+
+# text: the reading as printed on the display, e.g. "-0.469"
+# value: text as float, None if it is not a number (e.g. only a sign)
+# unit: name of the lit unit region, None if there is none
+# confidence: smallest distance of a segment fill from the threshold,
+#             relative to the threshold (0: ambiguous, 1: clear)
+SevenSegmentReading = namedtuple(
+    "SevenSegmentReading", ["text", "value", "unit", "confidence"]
+)
+
+
+def crop_screen(
+    image: np.ndarray,
+    roi: Sequence[int],
+    angle: float = 0.0,
+    flip: bool = False,
+) -> np.ndarray:
+    """
+    input: image: BGR camera frame
+           roi: min_x, min_y, max_x, max_y of the screen
+           angle: rotation (degrees, anti-clockwise) straightening the
+                  digit rows
+           flip: the camera looks at the screen upside down
+    output: screen image
+    """
+    min_x, min_y, max_x, max_y = roi
+    screen = image[min_y:max_y, min_x:max_x]
+    if flip:
+        screen = cv2.flip(screen, -1)
+    if angle:
+        h, w = screen.shape[:2]
+        M = cv2.getRotationMatrix2D(((w - 1) / 2.0, (h - 1) / 2.0), angle, 1)
+        screen = cv2.warpAffine(screen, M, (w, h))
+    return screen
+
+
+# grayscale, blur, otsu threshold and opening of screen_mask
+screen_pipeline = (
+    Pipeline("screen")
+    .gray()
+    .blur(5)
+    .threshold(0, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    .morphology(cv2.MORPH_OPEN, 3)
+)
+_screen_lock = threading.Lock()
+
+
+def screen_mask(screen: np.ndarray) -> np.ndarray:
+    """
+    Mask (255) of the lit segments of a screen image with bright digits on
+    a dark background; a copy, the pipeline buffers are reused
+    """
+    with _screen_lock:
+        return screen_pipeline.run(screen).copy()
+
+
+def read_with_tesseract(mask: np.ndarray):
+    """
+    Reads the screen with Tesseract (a separate process per call, slow)
+    input: mask: lit segments of the screen (see screen_mask)
+    output: digits and decimal points read, image passed to Tesseract
+    """
+    import pytesseract
+
+    invert = 255 - mask
+
+    # add padding to the image
+    invert = cv2.copyMakeBorder(
+        invert, 300, 300, 300, 300, cv2.BORDER_CONSTANT, value=255
+    )
+
+    # resize to 640x480
+    invert = cv2.resize(invert, (640, 480))
+
+    # erode the image and dilate the image
+    kernel = np.ones((3, 3), np.uint8)
+    invert = cv2.erode(invert, kernel, iterations=1)
+    invert = cv2.dilate(invert, kernel, iterations=1)
+
+    config = "-l ssd -c tessedit_char_whitelist=0123456789"
+    result = pytesseract.image_to_string(invert, config=config)
+
+    # only keep the numbers
+    result = "".join([c for c in result if c.isdigit() or c == "."])
+    return str(result), invert
+
+
+class SevenSegmentReader(object):
+    """
+    Usage:
+        reader = SevenSegmentReader()
+        reading = reader.read(screen_mask(screen))
+        if reading is not None:
+            text = reading.text
+    """
+
+    def __init__(
+        self,
+        slant: float = 0.15,
+        segment_threshold: float = 0.4,
+        min_confidence: float = 0.25,
+        min_digit_height: float = 0.4,
+        one_width: float = 0.35,
+        min_area: int = 6,
+        unit_regions: Optional[Dict[str, Sequence[float]]] = None,
+    ):
+        """
+        input: slant: horizontal shift of the digit tops per pixel of
+                      height, removed before reading
+               segment_threshold: fill of a segment region to count as lit
+               min_confidence: readings below this are rejected
+               min_digit_height: shortest digit relative to the mask height
+               one_width: width / height below which a digit is a "1"
+               min_area: smaller blobs (px) are noise
+               unit_regions: unit name -> (x0, y0, x1, y1) annunciator
+                             region as fractions of the mask (before
+                             deskewing); the unit with the most filled lit
+                             region is reported
+        """
+        self.slant = slant
+        self.segment_threshold = segment_threshold
+        self.min_confidence = min_confidence
+        self.min_digit_height = min_digit_height
+        self.one_width = one_width
+        self.min_area = min_area
+        self.unit_regions = dict(unit_regions or {})
+
+    def deskew(self, mask: np.ndarray) -> np.ndarray:
+        height, width = mask.shape[:2]
+        shift = int(np.ceil(abs(self.slant) * height))
+        offset = shift if self.slant < 0 else 0
+        M = np.float32([[1, self.slant, offset], [0, 1, 0]])
+        return cv2.warpAffine(
+            mask, M, (width + shift, height), flags=cv2.INTER_NEAREST
+        )
+
+    def read(self, mask: np.ndarray) -> Optional[SevenSegmentReading]:
+        """
+        input: mask: lit segments (nonzero) of the screen, digit rows
+                     horizontal (see screen_mask)
+        output: the reading, None if no digits were found or a digit could
+                not be read with min_confidence
+        """
+        deskewed = self.deskew(mask)
+        blobs = blob_stats(deskewed)
+        blobs = blobs[blobs["area"] >= self.min_area]
+        if len(blobs) == 0:
+            return None
+        boxes = self._group(blobs)
+
+        heights = boxes[:, 3] - boxes[:, 1]
+        digit_height = heights.max()
+        if digit_height < self.min_digit_height * mask.shape[0]:
+            return None
+        digits = heights >= 0.6 * digit_height
+        top = boxes[digits, 1].min()
+        baseline = boxes[digits, 3].max()
+
+        text = []
+        confidence = 1.0
+        for box, is_digit in zip(boxes, digits):
+            x0, y0, x1, y1 = box
+            w, h = x1 - x0, y1 - y0
+            if is_digit:
+                digit, margin = self._read_digit(deskewed, box)
+                if digit is None:
+                    return None
+                text.append(digit)
+                confidence = min(confidence, margin)
+            elif h < 0.3 * digit_height:
+                center_y = (y0 + y1) / 2.0
+                if w < 0.3 * digit_height and y1 >= baseline - 0.2 * (
+                    baseline - top
+                ):
+                    text.append(".")
+                elif w >= 0.3 * digit_height and abs(
+                    center_y - (top + baseline) / 2.0
+                ) < 0.2 * (baseline - top):
+                    text.append("-")
+        if confidence < self.min_confidence:
+            return None
+
+        text = "".join(text).strip(".")
+        try:
+            value = float(text)
+        except ValueError:
+            value = None
+        return SevenSegmentReading(
+            text=text,
+            value=value,
+            unit=self._read_unit(mask),
+            confidence=float(confidence),
+        )
+
+    def _group(self, blobs) -> np.ndarray:
+        """
+        output: (K, 4) x0, y0, x1, y1 of the characters, left to right;
+                blobs overlapping in x by half the narrower one are merged
+        """
+        boxes = np.stack(
+            [
+                blobs["x"],
+                blobs["y"],
+                blobs["x"] + blobs["w"],
+                blobs["y"] + blobs["h"],
+            ],
+            axis=1,
+        )
+        boxes = boxes[np.argsort(boxes[:, 0])]
+        groups = [boxes[0].copy()]
+        for box in boxes[1:]:
+            group = groups[-1]
+            overlap = min(group[2], box[2]) - max(group[0], box[0])
+            narrower = min(group[2] - group[0], box[2] - box[0])
+            if overlap > 0.5 * narrower:
+                group[:2] = np.minimum(group[:2], box[:2])
+                group[2:] = np.maximum(group[2:], box[2:])
+            else:
+                groups.append(box.copy())
+        return np.array(groups)
+
+    def _read_digit(self, mask, box):
+        """
+        output: digit character (None if the pattern is unknown), margin of
+                the segment fills from the threshold relative to it
+        """
+        x0, y0, x1, y1 = box
+        if x1 - x0 < self.one_width * (y1 - y0):
+            lit, margin = self._read_segments(mask, box, ONE_REGIONS)
+            return ("1" if lit == "bc" else None), margin
+        lit, margin = self._read_segments(mask, box, SEGMENT_REGIONS)
+        return SEGMENT_DIGITS.get(lit), margin
+
+    def _read_segments(self, mask, box, regions):
+        """
+        output: lit segments of regions in SEGMENT_ORDER, margin of their
+                fills from the threshold relative to it
+        """
+        x0, y0, x1, y1 = box
+        w, h = x1 - x0, y1 - y0
+        lit = []
+        margin = 1.0
+        for segment in SEGMENT_ORDER:
+            if segment not in regions:
+                continue
+            fx0, fy0, fx1, fy1 = regions[segment]
+            region = mask[
+                y0 + int(fy0 * h) : y0 + max(int(fy1 * h), int(fy0 * h) + 1),
+                x0 + int(fx0 * w) : x0 + max(int(fx1 * w), int(fx0 * w) + 1),
+            ]
+            fill = np.count_nonzero(region) / float(max(region.size, 1))
+            if fill >= self.segment_threshold:
+                lit.append(segment)
+            margin = min(
+                margin,
+                abs(fill - self.segment_threshold) / self.segment_threshold,
+            )
+        return "".join(lit), margin
+
+    def _read_unit(self, mask) -> Optional[str]:
+        height, width = mask.shape[:2]
+        best, best_fill = None, self.segment_threshold
+        for unit, (x0, y0, x1, y1) in self.unit_regions.items():
+            region = mask[
+                int(y0 * height) : int(y1 * height),
+                int(x0 * width) : int(x1 * width),
+            ]
+            fill = np.count_nonzero(region) / float(max(region.size, 1))
+            if fill >= best_fill:
+                best, best_fill = unit, fill
+        return best
+
+
+def create_seven_segment_reader(params=None) -> Optional[SevenSegmentReader]:
+    """
+    SevenSegmentReader configured from params (e.g. the ~seven_segment
+    parameter dict); None if disabled there
+    """
+    params = dict(params or {})
+    if not params.pop("enabled", True):
+        return None
+    return SevenSegmentReader(**params)
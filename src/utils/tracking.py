@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Detect-then-track wrapper for the detection backends.
+#
+# During visual servoing the target moves only a few pixels per frame, so the
+# full detector is run only every redetect_interval frames or when the track
+# is lost. In between, the box is followed by normalized cross-correlation
+# template matching in a small search window around the previous box.
+
+import cv2
+import numpy as np
+
+
+class TrackingDetector(object):
+    """
+    Has the same detect(image, size=None) -> (N, 6) interface as the
+    detection backends; returns at most one box (the tracked one). Between
+    detections the score column holds the template match confidence.
+
+    Usage:
+        tracker = TrackingDetector(get_detector("door_knob"))
+        tracker.reset()  # at the start of every servoing run
+        detections = tracker.detect(image)
+    """
+
+    def __init__(
+        self,
+        detector,
+        redetect_interval=10,
+        min_confidence=0.6,
+        search_margin=0.5,
+        min_search_margin=20,
+    ):
+        """
+        input: detector: backend with detect(image) -> (N, 6)
+               redetect_interval: run the detector every n-th frame
+               min_confidence: match score below which the track is lost
+               search_margin: search window padding as fraction of box size
+               min_search_margin: minimum search window padding in pixels
+        """
+        self.detector = detector
+        self.redetect_interval = redetect_interval
+        self.min_confidence = min_confidence
+        self.search_margin = search_margin
+        self.min_search_margin = min_search_margin
+        self.reset()
+
+    def reset(self):
+        if hasattr(self.detector, "reset"):
+            self.detector.reset()
+        self.template = None
+        self.box = None
+        self.cls = 0.0
+        self.confidence = 0.0
+        self.frames_since_detection = 0
+        self.num_frames = 0
+        self.num_detections = 0
+        self.num_redetections = 0
+
+    @staticmethod
+    def _gray(image):
+        if image.ndim == 2:
+            return image
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    def _clip_box(self, box, shape):
+        x1, y1, x2, y2 = box
+        x1 = int(np.clip(round(x1), 0, shape[1] - 1))
+        y1 = int(np.clip(round(y1), 0, shape[0] - 1))
+        x2 = int(np.clip(round(x2), x1 + 1, shape[1]))
+        y2 = int(np.clip(round(y2), y1 + 1, shape[0]))
+        return x1, y1, x2, y2
+
+    def _detect(self, image):
+        self.num_detections += 1
+        self.frames_since_detection = 0
+        detections = self.detector.detect(image)
+        if len(detections) == 0:
+            self.template = None
+            self.box = None
+            self.confidence = 0.0
+            return detections
+        best = detections[detections[:, 4].argmax()]
+        x1, y1, x2, y2 = self._clip_box(best[:4], image.shape)
+        self.template = self._gray(image[y1:y2, x1:x2]).copy()
+        self.box = np.array([x1, y1, x2, y2], dtype=np.float32)
+        self.cls = best[5]
+        self.confidence = float(best[4])
+        return best[None, :]
+
+    def _track(self, image):
+        """
+        Template matching in a window around the previous box; returns None
+        if the match is not good enough
+        """
+        x1, y1, x2, y2 = self.box
+        w, h = x2 - x1, y2 - y1
+        mx = max(self.min_search_margin, self.search_margin * w)
+        my = max(self.min_search_margin, self.search_margin * h)
+        sx1, sy1, sx2, sy2 = self._clip_box(
+            (x1 - mx, y1 - my, x2 + mx, y2 + my), image.shape
+        )
+        th, tw = self.template.shape
+        if sx2 - sx1 < tw or sy2 - sy1 < th:
+            return None
+        window = self._gray(image[sy1:sy2, sx1:sx2])
+        scores = cv2.matchTemplate(
+            window, self.template, cv2.TM_CCOEFF_NORMED
+        )
+        _, max_score, _, (dx, dy) = cv2.minMaxLoc(scores)
+        if max_score < self.min_confidence:
+            return None
+        self.box = np.array(
+            [sx1 + dx, sy1 + dy, sx1 + dx + tw, sy1 + dy + th],
+            dtype=np.float32,
+        )
+        self.confidence = float(max_score)
+        return np.array(
+            [[*self.box, self.confidence, self.cls]], dtype=np.float32
+        )
+
+    def detect(self, image, size=None):
+        self.num_frames += 1
+        if (
+            self.template is None
+            or self.frames_since_detection + 1 >= self.redetect_interval
+        ):
+            return self._detect(image)
+        self.frames_since_detection += 1
+        tracked = self._track(image)
+        if tracked is None:
+            # track lost, fall back to the detector
+            self.num_redetections += 1
+            return self._detect(image)
+        return tracked
+
+    def stats(self):
+        stats = "frames: %d, detector runs: %d, re-detections on loss: %d" % (
+            self.num_frames,
+            self.num_detections,
+            self.num_redetections,
+        )
+        if hasattr(self.detector, "stats"):
+            stats += ", " + self.detector.stats()
+        return stats
+
+
+def create_tracking_detector(detector, params=None):
+    """
+    Wraps detector in a TrackingDetector configured from params (e.g. the
+    ~tracking parameter dict); returns detector unchanged if tracking is
+    disabled there
+    """
+    params = dict(params or {})
+    if not params.pop("enabled", True):
+        return detector
+    return TrackingDetector(detector, **params)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# Visual servoing engine shared by the actions.
+#
+# Every iteration the engine gets the pixel errors of the target, corrects
+# them for the camera latency, combines them with the errors of the last
+# frames (ErrorEstimator, if enabled), maps them to tool velocities with the
+# servo controller and publishes the twist, until the controller commands zero
+# velocity on all axes with all errors measured (the target is inside the
+# deadband), the timeout expires or the node shuts down. The target error
+# function either runs on a DetectionWorker thread (asynchronous, the loop
+# never waits for inference) or is called in the loop on the newest frame.
+
+import time
+from collections import namedtuple
+from typing import Callable, Optional, Sequence
+
+import kortex_driver.msg
+import rospy
+
+from utils.detection_worker import DetectionWorker
+from utils.error_estimator import ErrorEstimator, create_error_estimator
+from utils.frame_hub import FrameHub, get_frame_hub
+from utils.pose_history import LatencyCompensator
+from utils.servo_controllers import create_servo_controller
+from utils.servo_metrics import ServoMetrics
+
+CartesianReferenceFrame = kortex_driver.msg.CartesianReferenceFrame
+TOOL_FRAME = CartesianReferenceFrame.CARTESIAN_REFERENCE_FRAME_TOOL
+MIXED_FRAME = CartesianReferenceFrame.CARTESIAN_REFERENCE_FRAME_MIXED
+
+# converged: the target was reached (False on timeout / shutdown)
+# iterations: number of control iterations
+# time_to_converge: duration of the run in seconds
+# final_error: last measured pixel error per axis (None if never measured)
+# latencies: age of the measurement per iteration in seconds (None if none)
+# oscillations: sign reversals of the commanded velocity per axis
+ServoResult = namedtuple(
+    "ServoResult",
+    [
+        "converged",
+        "iterations",
+        "time_to_converge",
+        "final_error",
+        "latencies",
+        "oscillations",
+    ],
+)
+
+
+class VisualServoing(object):
+    """
+    Usage:
+        servoing = VisualServoing(self.cart_vel_pub, name="probe_action")
+        result = servoing.run(
+            functools.partial(self.get_door_knob_error_2, False)
+        )
+    """
+
+    def __init__(
+        self,
+        velocity_publisher: rospy.Publisher,
+        name: str = "visual_servoing",
+        rate: float = 10.0,
+        reference_frame: int = TOOL_FRAME,
+        controller=None,
+        latency_compensator: Optional[LatencyCompensator] = None,
+        max_detection_age: float = 0.5,
+        frame_hub: Optional[FrameHub] = None,
+        error_estimator: Optional[ErrorEstimator] = None,
+    ):
+        """
+        input: velocity_publisher: publisher of kortex TwistCommand
+               name: prefix of the log messages
+               rate: loop rate in Hz
+               reference_frame: CartesianReferenceFrame of the commands
+               controller: servo controller, ~servo_controller by default
+               latency_compensator: ~latency_compensation by default
+               max_detection_age: older asynchronous results are not used (s)
+               error_estimator: multi-frame estimator, ~error_estimator by
+                                default (None if disabled there)
+        """
+        self.velocity_publisher = velocity_publisher
+        self.name = name
+        self.rate = rate
+        self.reference_frame = reference_frame
+        self.controller = controller or create_servo_controller(
+            rospy.get_param("~servo_controller", {})
+        )
+        self.latency_compensator = latency_compensator or LatencyCompensator(
+            enabled=rospy.get_param("~latency_compensation", True)
+        )
+        self.max_detection_age = max_detection_age
+        self.frame_hub = frame_hub or get_frame_hub()
+        if error_estimator is None:
+            error_estimator = create_error_estimator(
+                rospy.get_param("~error_estimator", {})
+            )
+        self.error_estimator = error_estimator
+
+    def publish_velocity(self, axes: Sequence[str], velocities, frame=None):
+        msg = kortex_driver.msg.TwistCommand()
+        msg.reference_frame = self.reference_frame if frame is None else frame
+        for axis, velocity in zip(axes, velocities):
+            setattr(msg.twist, "linear_" + axis, velocity)
+        self.velocity_publisher.publish(msg)
+
+    def stop(self):
+        msg = kortex_driver.msg.TwistCommand()
+        msg.reference_frame = MIXED_FRAME
+        self.velocity_publisher.publish(msg)
+
+    def run(
+        self,
+        target_fn: Callable,
+        axes: Sequence[str] = ("x", "y"),
+        asynchronous: bool = True,
+        deadband=None,
+        slow_zone=None,
+        timeout: Optional[float] = None,
+        ready_fn: Optional[Callable[[], bool]] = None,
+        publish: bool = True,
+    ) -> ServoResult:
+        """
+        input: target_fn: returns the pixel error per axis (None if the
+                          target is not found), called without arguments
+               axes: tool axes (x, y, z) the errors are servoed along
+               asynchronous: run target_fn on a DetectionWorker thread
+               deadband, slow_zone: controller thresholds (scalar or per
+                                    axis), the controller defaults if None
+               timeout: give up after this many seconds (None: no limit)
+               ready_fn: the loop waits while this returns False
+               publish: False only computes and logs the commands (for
+                        tuning the target functions); never converges
+        output: ServoResult of the run
+        """
+        axes = list(axes)
+        metrics = ServoMetrics(axes)
+        loop_rate = rospy.Rate(self.rate)
+        start_time = time.monotonic()
+        if self.error_estimator is not None:
+            self.error_estimator.reset()
+        worker = None
+        if asynchronous:
+            worker = DetectionWorker(target_fn, self.frame_hub, self.name)
+            worker.start()
+        try:
+            while not rospy.is_shutdown():
+                if (
+                    timeout is not None
+                    and time.monotonic() - start_time > timeout
+                ):
+                    rospy.logwarn(
+                        "[%s] visual servoing timed out after %.1f s"
+                        % (self.name, timeout)
+                    )
+                    break
+                if ready_fn is not None and not ready_fn():
+                    loop_rate.sleep()
+                    continue
+                if worker is not None and worker.latest() is None:
+                    rospy.loginfo_throttle(
+                        1.0, "[%s] waiting for detection" % self.name
+                    )
+                    loop_rate.sleep()
+                    continue
+
+                errors, stamp = self._measure(target_fn, worker)
+                if self.error_estimator is None:
+                    errors = self._compensate(errors, axes, stamp)
+                    latency = self.latency_compensator.last_latency
+                else:
+                    errors, latency = self._estimate(errors, axes, stamp)
+                velocities = self.controller.compute(
+                    errors, deadband=deadband, slow_zone=slow_zone
+                )
+                rospy.logdebug(
+                    "[%s] errors %s, velocities %s"
+                    % (self.name, errors, velocities)
+                )
+                metrics.update(errors, velocities, latency)
+                if publish:
+                    self.publish_velocity(axes, velocities)
+                    if all(v == 0.0 for v in velocities) and all(
+                        e is not None for e in errors
+                    ):
+                        metrics.finish(converged=True)
+                        break
+                loop_rate.sleep()
+        finally:
+            if worker is not None:
+                worker.stop()
+            self.stop()
+        if metrics.end_time is None:
+            metrics.finish(converged=False)
+        rospy.loginfo(
+            "[%s] visual servoing %s" % (self.name, metrics.summary())
+        )
+        return ServoResult(
+            converged=metrics.converged,
+            iterations=metrics.iterations,
+            time_to_converge=metrics.duration,
+            final_error=list(metrics.final_error),
+            latencies=list(metrics.latencies),
+            oscillations=dict(metrics.oscillations),
+        )
+
+    def _measure(self, target_fn, worker):
+        if worker is not None:
+            result = worker.latest_fresh(self.max_detection_age)
+            if result is None:
+                return None, None
+            return result.value, result.stamp
+        with self.frame_hub.pin() as msg:
+            return target_fn(), None if msg is None else msg.header.stamp
+
+    def _estimate(self, errors, axes, stamp):
+        """
+        output: estimated errors at the current pose, age of the newest
+                frame plus the latency added by the estimator
+        """
+        estimator = self.error_estimator
+        now = rospy.Time.now()
+        estimator.add(now if stamp is None else stamp, errors)
+        estimate = estimator.estimate(
+            now, lambda e, s: self._compensate(e, axes, s)
+        )
+        if estimate is None:
+            return [None] * len(axes), None
+        latency = (now - estimator.latest_stamp).to_sec()
+        return estimate, latency + estimator.added_latency
+
+    def _compensate(self, errors, axes, stamp):
+        if errors is None:
+            errors = [None] * len(axes)
+        by_axis = dict(zip(axes, errors))
+        error_x, error_y = self.latency_compensator.compensate(
+            by_axis.get("x"), by_axis.get("y"), stamp
+        )
+        # the image axes are aligned with the tool axes only in the tool
+        # frame (see CameraModel)
+        if self.reference_frame == TOOL_FRAME:
+            by_axis.update(
+                (axis, error)
+                for axis, error in (("x", error_x), ("y", error_y))
+                if axis in by_axis
+            )
+        return [by_axis[axis] for axis in axes]
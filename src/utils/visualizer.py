@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Intermediate perception images (masks, candidate contours) without
+# cv2.imshow / cv2.waitKey in the pipeline.
+#
+# The mode comes from the ~visualization parameter:
+#   off     nothing is shown or computed for display (default)
+#   topic   published on /visualization/<name>, only while subscribed
+#   window  cv2.imshow with a 1 ms waitKey, never blocks on a keypress
+#   record  written to ~visualization_dir by the async debug image writer
+# Images can be passed as a callable so that nothing is drawn when off.
+
+import re
+from typing import Callable, Union
+
+import cv2
+import numpy as np
+import rospy
+
+from utils.debug_image_writer import get_debug_image_writer
+from utils.debug_visualization import Overlay, get_debug_publisher
+
+MODES = ("off", "topic", "window", "record")
+DEFAULT_RECORD_DIR = "/home/b-it-bots/temp/robothon/visualization"
+
+
+class Visualizer(object):
+    """
+    Usage:
+        visualizer = get_visualizer()
+        visualizer.show("mask", mask)
+        if visualizer.enabled:
+            ...  # extra drawing only needed for display
+    """
+
+    def __init__(
+        self, mode: str = "off", record_dir: str = DEFAULT_RECORD_DIR
+    ):
+        if mode not in MODES:
+            raise ValueError(
+                "unknown visualization mode '%s', expected one of %s"
+                % (mode, MODES)
+            )
+        self.mode = mode
+        self.record_dir = record_dir
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @staticmethod
+    def topic_name(name: str) -> str:
+        return "/visualization/" + re.sub(r"\W+", "_", name.strip()).lower()
+
+    def show(self, name: str, image: Union[np.ndarray, Overlay, Callable]):
+        """
+        input: name: window / topic / file name prefix
+               image: BGR or grayscale image, an Overlay, or a callable
+                      returning either (only called if enabled)
+        """
+        if not self.enabled:
+            return
+        if self.mode == "topic":
+            publisher = get_debug_publisher(self.topic_name(name))
+            if not publisher.active:
+                return
+        if callable(image):
+            image = image()
+        if isinstance(image, Overlay):
+            image = image.render()
+        if image is None:
+            return
+
+        if self.mode == "topic":
+            encoding = "mono8" if image.ndim == 2 else "bgr8"
+            # rendered later, the caller may keep drawing on image
+            publisher.publish_image(image.copy(), encoding)
+        elif self.mode == "window":
+            cv2.imshow(name, image)
+            cv2.waitKey(1)
+        elif self.mode == "record":
+            prefix = re.sub(r"\W+", "_", name.strip()).lower()
+            get_debug_image_writer(self.record_dir).save(image, prefix)
+
+
+_visualizer = None
+
+
+def get_visualizer() -> Visualizer:
+    """
+    Process-wide visualizer configured from ~visualization and
+    ~visualization_dir
+    """
+    global _visualizer
+    if _visualizer is None:
+        _visualizer = Visualizer(
+            rospy.get_param("~visualization", "off"),
+            rospy.get_param("~visualization_dir", DEFAULT_RECORD_DIR),
+        )
+    return _visualizer
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import glob
+import importlib.util
+import os
+import sys
+import unittest
+
+import cv2
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+
+from utils.detection_backends import (  # noqa: E402
+    BACKENDS,
+    box_iou,
+    create_detector,
+    detections_match,
+    letterbox,
+    onnx_path,
+)
+
+try:
+    from utils.model_registry import MODEL_PARAMS, MODELS
+except ImportError:
+    MODELS = None
+
+# model -> sample images in the repository
+SAMPLES = {
+    "door_knob": sorted(
+        glob.glob(os.path.join(REPO_DIR, "docs", "images", "door", "*.jpg"))
+    ),
+    "probe_holder_horizontal_v2": [
+        os.path.join(
+            REPO_DIR, "docs", "images", "platform", "probe_holder.jpg"
+        )
+    ],
+}
+
+# the samples are letterboxed to the camera frame size, so the static ONNX
+# input (640 px wide, 16:9) scales them like the frames at run time
+FRAME_SHAPE = (720, 1280)
+
+# IoU of matching boxes; the int8 backend only has to find the top box
+IOU_THRESHOLD = 0.9
+INT8_IOU_THRESHOLD = 0.5
+
+# backend -> python module it needs
+_MODULES = {
+    "torch": "yolov5",
+    "onnxruntime": "onnxruntime",
+    "onnxruntime_int8": "onnxruntime",
+    "opencv": "cv2",
+}
+
+
+def available_backends(model_path):
+    """
+    Backends that can run the model here, torch first; the ONNX backends
+    need the files of scripts/export_onnx_models.py
+    """
+    backends = []
+    for backend in BACKENDS:
+        if importlib.util.find_spec(_MODULES[backend]) is None:
+            continue
+        if backend != "torch" and not os.path.exists(
+            onnx_path(model_path, backend)
+        ):
+            continue
+        backends.append(backend)
+    return backends
+
+
+@unittest.skipIf(MODELS is None, "model registry not importable")
+class TestDetectionBackendParity(unittest.TestCase):
+    def detect(self, model_path, backend, images):
+        detector = create_detector(
+            model_path, backend, model_params=MODEL_PARAMS
+        )
+        return [detector.detect(image) for image in images]
+
+    def check_model(self, name):
+        model_path = os.path.join(REPO_DIR, "models", MODELS[name])
+        backends = available_backends(model_path)
+        if not any(backend != "torch" for backend in backends):
+            self.skipTest("%s is not exported to ONNX" % name)
+        if len(backends) < 2:
+            self.skipTest("no second backend to compare %s with" % name)
+        images = [
+            letterbox(cv2.imread(path), FRAME_SHAPE)[0]
+            for path in SAMPLES[name]
+        ]
+        reference_backend = backends[0]
+        reference = self.detect(model_path, reference_backend, images)
+        for backend in backends[1:]:
+            results = self.detect(model_path, backend, images)
+            for path, ref, res in zip(SAMPLES[name], reference, results):
+                msg = "%s vs %s on %s" % (backend, reference_backend, path)
+                if backend != "onnxruntime_int8":
+                    self.assertTrue(
+                        detections_match(ref, res, IOU_THRESHOLD), msg
+                    )
+                elif len(ref):
+                    self.assertTrue(len(res), msg)
+                    self.assertEqual(ref[0, 5], res[0, 5], msg)
+                    self.assertGreater(
+                        box_iou(ref[0], res[0]), INT8_IOU_THRESHOLD, msg
+                    )
+
+    def test_door_knob(self):
+        self.check_model("door_knob")
+
+    def test_probe_holder_horizontal(self):
+        self.check_model("probe_holder_horizontal_v2")
+
+
+if __name__ == "__main__":
+    unittest.main()
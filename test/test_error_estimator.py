@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from utils.error_estimator import ErrorEstimator  # noqa: E402
+
+
+class TestErrorEstimator(unittest.TestCase):
+    def feed(self, estimator, samples, interval=0.1):
+        for i, errors in enumerate(samples):
+            estimator.add(i * interval, errors)
+        return estimator.estimate((len(samples) - 1) * interval)
+
+    def test_single_axis_stream(self):
+        # e.g. detect_probe_holder_horizontal only measures x
+        samples = [(10.0, None), (12.0, None), (11.0, None), (50.0, None)]
+        for method in ErrorEstimator.METHODS:
+            estimator = ErrorEstimator(method=method, window=5, max_age=1.0)
+            estimate = self.feed(estimator, samples)
+            self.assertIsNotNone(estimate, method)
+            self.assertIsNone(estimate[1], method)
+            self.assertAlmostEqual(estimate[0], 11.0, delta=1.5, msg=method)
+
+    def test_single_axis_tuple(self):
+        estimator = ErrorEstimator(method="median", window=5, max_age=1.0)
+        self.assertEqual(self.feed(estimator, [(4.0,), (6.0,)]), [5.0])
+
+    def test_partially_measured_axes(self):
+        samples = [(10.0, 2.0), (10.0, None), (None, 4.0), (10.0, 3.0)]
+        for method in ErrorEstimator.METHODS:
+            estimator = ErrorEstimator(method=method, window=5, max_age=1.0)
+            estimate = self.feed(estimator, samples)
+            self.assertAlmostEqual(estimate[0], 10.0, msg=method)
+            self.assertTrue(2.0 <= estimate[1] <= 4.0, method)
+
+    def test_unmeasured_frames_ignored(self):
+        estimator = ErrorEstimator(method="median", window=5, max_age=1.0)
+        self.assertIsNone(self.feed(estimator, [(None, None), None]))
+
+    def test_outlier_rejected_per_axis(self):
+        samples = [(10.0, 1.0), (11.0, 1.0), (10.0, 90.0), (11.0, 1.0)]
+        estimator = ErrorEstimator(
+            method="trimmed_mean", window=5, max_age=1.0, trim=0.0
+        )
+        estimate = self.feed(estimator, samples)
+        # the y outlier does not discard the x error of its frame
+        self.assertAlmostEqual(estimate[0], 10.5)
+        self.assertAlmostEqual(estimate[1], 1.0)
+        self.assertEqual(estimator.num_rejected, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
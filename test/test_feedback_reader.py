@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import random
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+try:
+    import genpy
+    import kortex_driver.msg
+
+    from utils.feedback_reader import (  # noqa: E402
+        COMMANDED_TOOL_POSE_FIELDS,
+        TOOL_POSE_FIELDS,
+        WRENCH_FIELDS,
+        BaseFeedbackReader,
+        _message_class,
+        _split_type,
+    )
+except ImportError:
+    genpy = None
+
+_INTEGERS = {
+    "byte": (-(2**7), 2**7 - 1),
+    "int8": (-(2**7), 2**7 - 1),
+    "int16": (-(2**15), 2**15 - 1),
+    "uint16": (0, 2**16 - 1),
+    "int32": (-(2**31), 2**31 - 1),
+    "uint32": (0, 2**32 - 1),
+    "int64": (-(2**63), 2**63 - 1),
+    "uint64": (0, 2**64 - 1),
+}
+
+
+def random_value(base_type, rng):
+    if base_type in ("float32", "float64"):
+        # representable as float32, so both paths compare exactly
+        return float(np.float32(rng.uniform(-1000.0, 1000.0)))
+    if base_type == "bool":
+        return rng.random() < 0.5
+    if base_type in ("uint8", "char"):
+        return rng.randint(0, 255)
+    if base_type in _INTEGERS:
+        return rng.randint(*_INTEGERS[base_type])
+    if base_type == "string":
+        return "feedback"
+    if base_type == "time":
+        return genpy.Time(rng.randint(0, 2**31 - 1), rng.randint(0, 10**9 - 1))
+    if base_type == "duration":
+        return genpy.Duration(rng.randint(0, 2**30), rng.randint(0, 10**9 - 1))
+    return None
+
+
+def fill(msg, rng, array_length=3):
+    """
+    Sets every field of msg to random values; variable length arrays get
+    array_length elements
+    """
+    for name, slot_type in zip(msg.__slots__, msg._slot_types):
+        base_type, length = _split_type(slot_type)
+        count = 1 if length is None else length
+        if length == -1:
+            count = array_length
+        if random_value(base_type, rng) is None:
+            values = [
+                fill(_message_class(base_type)(), rng, array_length)
+                for _ in range(count)
+            ]
+        else:
+            values = [random_value(base_type, rng) for _ in range(count)]
+        if length is None:
+            setattr(msg, name, values[0])
+        elif base_type in ("uint8", "char"):
+            # genpy serializes uint8 arrays from bytes
+            setattr(msg, name, bytes(values))
+        else:
+            setattr(msg, name, values)
+    return msg
+
+
+def serialize(msg) -> bytes:
+    buf = io.BytesIO()
+    msg.serialize(buf)
+    return buf.getvalue()
+
+
+@unittest.skipIf(genpy is None, "kortex_driver messages not available")
+class TestBaseFeedbackReader(unittest.TestCase):
+    def setUp(self):
+        self.reader = BaseFeedbackReader(
+            joint_angles=True, gripper_position=True, subscribe=False
+        )
+
+    def random_feedback(self, seed, array_length=3):
+        return fill(
+            kortex_driver.msg.BaseCyclic_Feedback(),
+            random.Random(seed),
+            array_length,
+        )
+
+    def assert_parsed(self, msg):
+        sample = self.reader.parse(serialize(msg))
+        for fields, actual in (
+            (TOOL_POSE_FIELDS, sample.tool_pose),
+            (COMMANDED_TOOL_POSE_FIELDS, sample.commanded_tool_pose),
+            (WRENCH_FIELDS, sample.wrench),
+        ):
+            expected = [getattr(msg.base, f) for f in fields]
+            np.testing.assert_array_equal(actual, np.float32(expected))
+        for name in sample.base.dtype.names:
+            self.assertEqual(
+                sample.base[name],
+                np.array(getattr(msg.base, name), sample.base.dtype[name]),
+                name,
+            )
+        np.testing.assert_array_equal(
+            sample.joint_angles,
+            np.float32([actuator.position for actuator in msg.actuators]),
+        )
+        return sample
+
+    def test_random_messages(self):
+        for seed in range(20):
+            msg = self.random_feedback(seed)
+            grippers = msg.interconnect.oneof_tool_feedback.gripper_feedback
+            self.assertTrue(msg.actuators)
+            self.assertTrue(grippers and grippers[0].motor)
+            sample = self.assert_parsed(msg)
+            gripper = grippers[0]
+            self.assertEqual(
+                np.float32(sample.gripper_position),
+                np.float32(gripper.motor[0].position),
+            )
+
+    def test_without_gripper(self):
+        msg = self.random_feedback(0, array_length=7)
+        msg.interconnect.oneof_tool_feedback.gripper_feedback = []
+        sample = self.assert_parsed(msg)
+        self.assertEqual(len(sample.joint_angles), 7)
+        self.assertIsNone(sample.gripper_position)
+
+
+if __name__ == "__main__":
+    unittest.main()